@@ -0,0 +1 @@
+"""Benchmarks del Generador COTU (árboles sintéticos y medición por fase)."""
@@ -0,0 +1,131 @@
+"""
+Generador de árboles COTU sintéticos para benchmarks.
+Crea AÑO/MES/DÍA/ASEGURADORA/COTUxxxxx con las variantes de nombre que aparecen en
+las carpetas reales: meses "12-DICIEMBRE" / "DICIEMBRE" / "12 DICIEMBRE", días
+"23 DE DICIEMBRE" / "23" / "23 DICIEMBRE", sufijos de detalle ("COTU123 ANULADA"),
+carpetas que no son COTU y algunos números repetidos (duplicados).
+"""
+
+import json
+import os
+import random
+from typing import Any, Dict, List
+
+MESES = [
+    "ENERO", "FEBRERO", "MARZO", "ABRIL", "MAYO", "JUNIO",
+    "JULIO", "AGOSTO", "SEPTIEMBRE", "OCTUBRE", "NOVIEMBRE", "DICIEMBRE",
+]
+ASEGURADORAS = [
+    "SOLIDARIA", "AURORA", "SURA", "BOLIVAR", "ALLIANZ", "MAPFRE", "PREVISORA", "AXA COLPATRIA",
+    "EQUIDAD", "LIBERTY", "ESTADO", "MUNDIAL",
+]
+DETALLES = ["ANULADA", "NOTA CREDITO", "REFACTURADA", "PENDIENTE FIRMA"]
+
+# Archivo que describe el árbol generado (permite reutilizarlo entre ejecuciones)
+MARCA = ".arbol_sintetico.json"
+
+
+def _nombre_mes(num: int, rnd: random.Random) -> str:
+    nombre = MESES[num - 1]
+    variante = rnd.random()
+    if variante < 0.7:
+        return f"{num:02d}-{nombre}"
+    if variante < 0.85:
+        return nombre
+    return f"{num:02d} {nombre}"
+
+
+def _nombre_dia(dia: int, mes: int, rnd: random.Random) -> str:
+    variante = rnd.random()
+    if variante < 0.8:
+        return f"{dia:02d} DE {MESES[mes - 1]}"
+    if variante < 0.9:
+        return f"{dia:02d}"
+    return f"{dia} {MESES[mes - 1]}"
+
+
+def _nombre_aseguradora(indice: int) -> str:
+    nombre = ASEGURADORAS[indice % len(ASEGURADORAS)]
+    vuelta = indice // len(ASEGURADORAS)
+    return f"{nombre} {vuelta + 1}" if vuelta else nombre
+
+
+def dimensiones_para(total: int, anios: int = 1, meses: int = 12, dias: int = 20,
+                     aseguradoras: int = 8) -> Dict[str, int]:
+    """
+    Dimensiones (años × meses × días × aseguradoras × COTUs) para exactamente `total` facturas:
+    `extra` carpetas de aseguradora reciben un COTU más que el resto.
+    """
+    carpetas = anios * meses * dias * aseguradoras
+    cotus, extra = divmod(total, carpetas)
+    return {
+        "anios": anios, "meses": meses, "dias": dias, "aseguradoras": aseguradoras,
+        "cotus": cotus, "extra": extra,
+    }
+
+
+def generar_arbol(base: str, anios: int = 1, meses: int = 12, dias: int = 20, aseguradoras: int = 8,
+                  cotus: int = 10, extra: int = 0, anio_inicial: int = 2024, proporcion_detalle: float = 0.05,
+                  proporcion_duplicados: float = 0.001, extras_por_dia: int = 1,
+                  semilla: int = 0) -> Dict[str, Any]:
+    """
+    Crea el árbol bajo `base` (una carpeta por año) con `cotus` facturas por carpeta de
+    aseguradora (una más en las `extra` primeras) y devuelve su descripción:
+    parámetros, total de facturas y rutas de las carpetas de año.
+    Si `base` ya contiene un árbol con los mismos parámetros, se reutiliza.
+    """
+    parametros = {
+        "anios": anios, "meses": meses, "dias": dias, "aseguradoras": aseguradoras, "cotus": cotus, "extra": extra,
+        "anio_inicial": anio_inicial, "proporcion_detalle": proporcion_detalle,
+        "proporcion_duplicados": proporcion_duplicados, "extras_por_dia": extras_por_dia, "semilla": semilla,
+    }
+    ruta_marca = os.path.join(base, MARCA)
+    if os.path.exists(ruta_marca):
+        with open(ruta_marca, "r", encoding="utf-8") as f:
+            descripcion = json.load(f)
+        if descripcion.get("parametros") == parametros:
+            return descripcion
+        raise FileExistsError(f"{base} ya contiene un árbol sintético con otros parámetros")
+
+    rnd = random.Random(semilla)
+    total = 0
+    numero = 10000
+    emitidos: List[str] = []
+    carpetas_anio = []
+    carpetas_cia = 0
+    for a in range(anios):
+        anio = str(anio_inicial + a)
+        ruta_anio = os.path.join(base, anio)
+        carpetas_anio.append(ruta_anio)
+        for m in range(1, meses + 1):
+            ruta_mes = os.path.join(ruta_anio, _nombre_mes(m, rnd))
+            for d in range(1, dias + 1):
+                ruta_dia = os.path.join(ruta_mes, _nombre_dia(d, m, rnd))
+                for x in range(extras_por_dia):
+                    os.makedirs(os.path.join(ruta_dia, f"SOPORTES {x + 1}"), exist_ok=True)
+                for c in range(aseguradoras):
+                    ruta_cia = os.path.join(ruta_dia, _nombre_aseguradora(c))
+                    os.makedirs(ruta_cia, exist_ok=True)
+                    n_cotus = cotus + (1 if carpetas_cia < extra else 0)
+                    carpetas_cia += 1
+                    for _ in range(n_cotus):
+                        if emitidos and rnd.random() < proporcion_duplicados:
+                            cotu = rnd.choice(emitidos)
+                        else:
+                            numero += 1
+                            cotu = f"COTU{numero}"
+                            emitidos.append(cotu)
+                        nombre = cotu
+                        if rnd.random() < proporcion_detalle:
+                            nombre = f"{cotu} {rnd.choice(DETALLES)}"
+                        try:
+                            os.mkdir(os.path.join(ruta_cia, nombre))
+                        except FileExistsError:
+                            # Duplicado en la misma carpeta: se cuenta como otra variante de nombre
+                            os.mkdir(os.path.join(ruta_cia, f"{cotu} COPIA {total}"))
+                        total += 1
+
+    descripcion = {"parametros": parametros, "facturas": total, "carpetas_anio": carpetas_anio}
+    with open(ruta_marca, "w", encoding="utf-8") as f:
+        json.dump(descripcion, f, ensure_ascii=False, indent=2)
+    return descripcion
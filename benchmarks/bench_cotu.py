@@ -0,0 +1,142 @@
+"""
+Benchmark por fase del motor COTU sobre árboles sintéticos.
+
+Uso:
+    python -m benchmarks.bench_cotu                          # 10k, 100k y 1M facturas
+    python -m benchmarks.bench_cotu --tamanos 10000 --salida resultados.json
+    python -m benchmarks.bench_cotu --dir D:\\bench --conservar  # reutiliza el árbol en otra ejecución
+
+Para cada tamaño mide tiempo de pared y memoria pico (tracemalloc, en una pasada aparte
+para no inflar el tiempo) de: extraer, filtrar (un mes), duplicados, estadísticas,
+CSV (escaneo + escritura en streaming) y Excel. El resultado es JSON para comparar versiones.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import cotu_logic
+from benchmarks.arbol_sintetico import dimensiones_para, generar_arbol
+
+TAMANOS_POR_DEFECTO = [10_000, 100_000, 1_000_000]
+
+
+def _medir(fase: str, funcion: Callable[[], Any], memoria: bool) -> Dict[str, Any]:
+    """Ejecuta `funcion` y devuelve {fase, segundos, memoria_pico_mb, resultado}."""
+    gc.collect()
+    t0 = time.perf_counter()
+    resultado = funcion()
+    segundos = time.perf_counter() - t0
+    pico_mb = None
+    if memoria:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcion()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        pico_mb = round(pico / (1024 * 1024), 2)
+    return {"fase": fase, "segundos": round(segundos, 4), "memoria_pico_mb": pico_mb, "resultado": resultado}
+
+
+def ejecutar(tamano: int, carpeta: str, memoria: bool = True, excel: bool = True,
+             hilos: int = cotu_logic.HILOS_ESCANEO) -> Dict[str, Any]:
+    """Genera (o reutiliza) el árbol de `tamano` facturas en `carpeta` y mide cada fase."""
+    dims = dimensiones_para(tamano)
+    t0 = time.perf_counter()
+    arbol = generar_arbol(carpeta, **dims)
+    segundos_generar = time.perf_counter() - t0
+    ruta_base = arbol["carpetas_anio"][0]
+    anio = int(os.path.basename(ruta_base))
+    desde, hasta = datetime(anio, 3, 1), datetime(anio, 3, 31)
+
+    registros: List[Dict[str, Any]] = []
+
+    def extraer():
+        registros[:] = cotu_logic.extraer_registros(ruta_base, hilos=hilos)
+        return len(registros)
+
+    fases = [_medir("extraer", extraer, memoria)]
+    fases.append(_medir("filtrar", lambda: len(cotu_logic.filtrar_registros(registros, desde, hasta)), memoria))
+    fases.append(_medir("duplicados", lambda: len(cotu_logic.verificar_duplicados(registros)), memoria))
+    fases.append(_medir("estadisticas", lambda: len(cotu_logic.calcular_estadisticas(registros)), memoria))
+
+    salida = os.path.join(carpeta, "salida")
+    os.makedirs(salida, exist_ok=True)
+    ruta_csv = os.path.join(salida, "bench.csv")
+    fases.append(_medir(
+        "csv",
+        lambda: cotu_logic.exportar_csv(cotu_logic.iterar_registros(ruta_base, hilos=hilos), ruta_csv),
+        memoria,
+    ))
+    if excel and cotu_logic.motor_excel():
+        ruta_xlsx = os.path.join(salida, "bench.xlsx")
+
+        def escribir_xlsx():
+            df = cotu_logic.dataframe_reporte(registros)
+            return cotu_logic.escribir_excel(df, ruta_xlsx, cotu_logic.NOMBRES_HOJA[cotu_logic.TIPO_ANIO])
+
+        fases.append(_medir("excel", escribir_xlsx, memoria))
+
+    return {
+        "facturas_objetivo": tamano,
+        "facturas": arbol["facturas"],
+        "dimensiones": dims,
+        "generar_arbol_segundos": round(segundos_generar, 2),
+        "fases": fases,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark por fase del motor COTU.")
+    parser.add_argument("--tamanos", default=",".join(str(t) for t in TAMANOS_POR_DEFECTO),
+                        help="Número de facturas por ejecución, separados por coma")
+    parser.add_argument("--dir", help="Carpeta donde crear los árboles (por defecto, una temporal)")
+    parser.add_argument("--conservar", action="store_true", help="No borrar los árboles al terminar")
+    parser.add_argument("--sin-memoria", action="store_true", help="No medir memoria pico (una sola pasada)")
+    parser.add_argument("--sin-excel", action="store_true", help="Omitir la fase de Excel")
+    parser.add_argument("--hilos", type=int, default=cotu_logic.HILOS_ESCANEO)
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto, salida estándar)")
+    args = parser.parse_args(argv)
+
+    raiz = args.dir or tempfile.mkdtemp(prefix="bench_cotu_")
+    resultados = []
+    try:
+        for tamano in (int(t) for t in args.tamanos.split(",") if t.strip()):
+            carpeta = os.path.join(raiz, f"arbol_{tamano}")
+            print(f"[bench] {tamano} facturas en {carpeta}", file=sys.stderr)
+            resultados.append(ejecutar(tamano, carpeta, memoria=not args.sin_memoria,
+                                       excel=not args.sin_excel, hilos=args.hilos))
+    finally:
+        if not args.conservar and not args.dir:
+            shutil.rmtree(raiz, ignore_errors=True)
+
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "hilos": args.hilos,
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    else:
+        print(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
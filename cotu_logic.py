@@ -0,0 +1,2321 @@
+"""
+Lógica de negocio del Generador de Reportes COTU (sin dependencias de GUI).
+Recorrido de la estructura AÑO/MES/DÍA/ASEGURADORA/COTU, parseo de fechas de
+carpeta e índice persistente de escaneo para carpetas de red.
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+import queue
+import tempfile
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturoTimeout
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Any, Set, Tuple
+
+_log = logging.getLogger("GeneradorCOTU")
+
+# Tipos de reporte
+TIPO_ANIO = "Año"
+TIPO_MES = "Mes"
+TIPO_SEMANA = "Semana"
+TIPO_DIA = "Día"
+
+NOMBRES_HOJA = {
+    TIPO_ANIO: "NOVEDADES ANUALES",
+    TIPO_MES: "NOVEDADES MENSUALES",
+    TIPO_SEMANA: "NOVEDADES SEMANALES",
+    TIPO_DIA: "NOVEDADES DIARIAS",
+}
+
+# Columnas del reporte (mismos nombres que en el Excel generado)
+COL_ANIO = "AÑO"
+COL_MES = "MES"
+COL_FECHA = "FECHA DE LA FACTURA"
+COL_FACTURA = "N° FACTURA"
+COL_DETALLE = "DETALLE COMPLETO"
+COL_COMPANIA = "COMPAÑÍA"
+COLUMNAS = [COL_ANIO, COL_MES, COL_FECHA, COL_FACTURA, COL_DETALLE, COL_COMPANIA]
+_POSICION_COLUMNA = {c: i for i, c in enumerate(COLUMNAS)}
+
+
+class Registro(namedtuple("_CamposRegistro", "anio mes fecha factura detalle compania")):
+    """
+    Registro de una carpeta COTU: tupla inmutable de 6 campos en el orden de COLUMNAS.
+    Ocupa una fracción de un dict con las mismas claves y admite el mismo acceso por
+    nombre de columna (reg[COL_FACTURA], reg.get(COL_COMPANIA, "")), así que el resto
+    del código trata igual registros y dicts. Año, mes, día y aseguradora son cadenas
+    compartidas entre todas las facturas de la misma carpeta (ver registro_desde_ruta).
+    """
+    __slots__ = ()
+
+    def __getitem__(self, clave):
+        if isinstance(clave, str):
+            try:
+                clave = _POSICION_COLUMNA[clave]
+            except KeyError:
+                raise KeyError(clave) from None
+        return tuple.__getitem__(self, clave)
+
+    def get(self, clave: str, defecto: Any = None) -> Any:
+        posicion = _POSICION_COLUMNA.get(clave)
+        return defecto if posicion is None else tuple.__getitem__(self, posicion)
+
+    def keys(self) -> List[str]:
+        return list(COLUMNAS)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return list(zip(COLUMNAS, self))
+
+    def a_dict(self) -> Dict[str, Any]:
+        return dict(zip(COLUMNAS, self))
+
+    def __repr__(self) -> str:
+        return f"Registro({self.a_dict()!r})"
+
+MAX_DEPTH = 6  # AÑO/MES/DÍA/ASEGURADORA/COTU = 5 niveles + margen
+HILOS_ESCANEO = 8  # Listados simultáneos en carpetas de red (I/O, no CPU)
+ADELANTO_ESCANEO = 256  # Carpetas listadas (o en cola) por delante del consumidor, como máximo
+
+
+class Cancelado(Exception):
+    """
+    La operación se interrumpió con un TokenCancelacion.
+    `registros` contiene lo reunido hasta ese momento (extraer_registros), o lista vacía.
+    """
+
+    def __init__(self, mensaje: str = "Operación cancelada", registros: Optional[List[Dict[str, Any]]] = None):
+        super().__init__(mensaje)
+        self.registros = registros if registros is not None else []
+
+
+class TokenCancelacion:
+    """Cancelación cooperativa: el escaneo, los filtros y los escritores la consultan periódicamente."""
+
+    def __init__(self):
+        self._evento = threading.Event()
+
+    def cancelar(self):
+        self._evento.set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self._evento.is_set()
+
+    def comprobar(self):
+        """Lanza Cancelado si se pidió cancelar."""
+        if self.cancelado:
+            raise Cancelado()
+
+
+class TokenCompartido(TokenCancelacion):
+    """
+    Token de un trabajo con varios interesados (EjecutorTrabajos): se considera
+    cancelado cuando todos los tokens unidos lo están.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tokens: List[TokenCancelacion] = []
+        self._lock = threading.Lock()
+
+    def unir(self, token: Optional[TokenCancelacion]):
+        with self._lock:
+            # Un interesado sin token no puede cancelar: el trabajo sigue hasta el final
+            self._tokens.append(token if token is not None else TokenCancelacion())
+
+    @property
+    def cancelado(self) -> bool:
+        if self._evento.is_set():
+            return True
+        with self._lock:
+            return bool(self._tokens) and all(t.cancelado for t in self._tokens)
+
+
+# Filas entre comprobaciones del token en filtros y escritores (el escaneo comprueba en cada carpeta)
+INTERVALO_CANCELACION = 1000
+
+
+def _con_cancelacion(iterable: Iterable[Any], cancelacion: Optional[TokenCancelacion]) -> Iterator[Any]:
+    """Itera `iterable` comprobando `cancelacion` cada INTERVALO_CANCELACION elementos."""
+    if cancelacion is None:
+        return iter(iterable)
+
+    def _generador():
+        for i, elemento in enumerate(iterable):
+            if i % INTERVALO_CANCELACION == 0:
+                cancelacion.comprobar()
+            yield elemento
+    return _generador()
+
+
+class ListaRegistros(list):
+    """
+    Lista de registros con metadatos de la extracción que la produjo.
+    `rango_fechas`: límites (inicio, fin) ya aplicados por extraer_registros (None si ninguno).
+    `sin_fecha`: registros conservados cuya fecha de carpeta no se pudo parsear.
+    `resumen`: ResumenRegistros acumulado al crear la lista (None si no se calculó).
+    """
+    rango_fechas: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None
+    sin_fecha = 0
+    resumen: Optional["ResumenRegistros"] = None
+
+
+class ResumenRegistros:
+    """
+    Conteo por aseguradora y ocurrencias por N° de factura, acumulados en la misma
+    pasada que crea (o filtra) los registros. Estadísticas y duplicados se leen de aquí
+    sin volver a recorrer la lista.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.por_compania: Dict[str, int] = {}
+        self._primero: Dict[str, Dict[str, Any]] = {}  # N° normalizado -> primer registro
+        self._repetidos: Dict[str, List[Dict[str, Any]]] = {}  # N° -> todos sus registros (si hay más de uno)
+
+    def agregar(self, reg: Dict[str, Any]):
+        self.total += 1
+        cia = reg.get(COL_COMPANIA, "SIN ASEGURADORA") or "SIN ASEGURADORA"
+        self.por_compania[cia] = self.por_compania.get(cia, 0) + 1
+        cotu = str(reg.get(COL_FACTURA, "")).strip().upper()
+        if not cotu or cotu == "COTU":
+            return
+        primero = self._primero.get(cotu)
+        if primero is None:
+            self._primero[cotu] = reg
+        elif cotu in self._repetidos:
+            self._repetidos[cotu].append(reg)
+        else:
+            self._repetidos[cotu] = [primero, reg]
+
+    def contar(self, registros: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Devuelve los mismos registros, agregándolos a medida que pasan."""
+        for reg in registros:
+            self.agregar(reg)
+            yield reg
+
+    @property
+    def numeros_repetidos(self) -> List[str]:
+        """N° de factura (normalizados) que aparecen más de una vez, en orden de aparición."""
+        return list(self._repetidos)
+
+    def duplicados(self) -> List[str]:
+        """Mensajes de duplicados (mismo formato que verificar_duplicados)."""
+        mensajes = []
+        for cotu, regs in self._repetidos.items():
+            fechas = dict.fromkeys(r.get(COL_FECHA, "") for r in regs)
+            aseguradoras = dict.fromkeys(r.get(COL_COMPANIA, "") for r in regs)
+            mensajes.append(
+                f"Factura {cotu} aparece {len(regs)} veces "
+                f"(Fechas: {', '.join(fechas)} - Cia: {', '.join(aseguradoras)})"
+            )
+        return mensajes
+
+    def estadisticas(self) -> str:
+        """Resumen por aseguradora (mismo formato que calcular_estadisticas)."""
+        if self.total == 0:
+            return "No hay registros."
+        resumen = [f"Total Facturas: {self.total}"]
+        resumen.append("-" * 20)
+        # Ordenar por cantidad descendente
+        for cia, cant in sorted(self.por_compania.items(), key=lambda x: x[1], reverse=True):
+            porcentaje = (cant / self.total) * 100
+            resumen.append(f"{cia}: {cant} ({porcentaje:.1f}%)")
+        return "\n".join(resumen)
+
+
+def resumen_de(registros: List[Dict[str, Any]]) -> ResumenRegistros:
+    """Resumen precalculado de `registros` o, si no lo tiene, calculado ahora en una pasada."""
+    resumen = getattr(registros, "resumen", None)
+    if resumen is not None:
+        return resumen
+    resumen = ResumenRegistros()
+    for reg in registros:
+        resumen.agregar(reg)
+    if isinstance(registros, ListaRegistros):
+        registros.resumen = resumen
+    return resumen
+
+
+class MedicionRendimiento:
+    """
+    Tiempos por fase de una operación (vista previa, Excel, CSV o modo por lotes) y
+    ritmo del escaneo. Las fases son disjuntas: una fase que contiene a otras solo se
+    queda con el tiempo no atribuido a ellas (p. ej. "csv" es la escritura, sin el
+    escaneo que ocurre dentro del mismo bucle). Se puede alimentar desde varios hilos.
+    """
+
+    def __init__(self, operacion: str, reloj: Callable[[], float] = time.perf_counter):
+        self.operacion = operacion
+        self.fases: Dict[str, float] = {}
+        self.carpetas = 0
+        self.registros = 0  # Registros escaneados (antes de filtrar)
+        self.facturas = 0  # Facturas del resultado
+        self.estado = "ok"
+        self._reloj = reloj
+        self._inicio = reloj()
+        self._fin: Optional[float] = None
+        self._atribuido = 0.0
+        self._lock = threading.Lock()
+
+    def agregar(self, nombre: str, segundos: float):
+        """Suma `segundos` a la fase `nombre`."""
+        with self._lock:
+            self.fases[nombre] = self.fases.get(nombre, 0.0) + segundos
+            self._atribuido += segundos
+
+    @contextmanager
+    def fase(self, nombre: str):
+        """Mide el bloque como fase `nombre` (descontando las fases medidas dentro)."""
+        inicio, atribuido = self._reloj(), self._atribuido
+        try:
+            yield self
+        finally:
+            self.agregar(nombre, max(0.0, (self._reloj() - inicio) - (self._atribuido - atribuido)))
+
+    def terminar(self, estado: Optional[str] = None) -> "MedicionRendimiento":
+        """Fija el tiempo total (y el estado: "ok", "cancelado", "error")."""
+        if estado is not None:
+            self.estado = estado
+        self._fin = self._reloj()
+        return self
+
+    @property
+    def total_s(self) -> float:
+        return (self._fin if self._fin is not None else self._reloj()) - self._inicio
+
+    def _por_segundo(self, cantidad: int) -> float:
+        segundos = self.fases.get("escaneo", 0.0) + self.fases.get("fechas", 0.0)
+        return cantidad / segundos if segundos > 0 else 0.0
+
+    @property
+    def carpetas_por_s(self) -> float:
+        return self._por_segundo(self.carpetas)
+
+    @property
+    def registros_por_s(self) -> float:
+        return self._por_segundo(self.registros)
+
+    def a_dict(self) -> Dict[str, Any]:
+        """Entrada estructurada (JSON) para el log."""
+        return {
+            "operacion": self.operacion,
+            "estado": self.estado,
+            "total_s": round(self.total_s, 4),
+            "fases_s": {nombre: round(seg, 4) for nombre, seg in self.fases.items()},
+            "carpetas": self.carpetas,
+            "registros": self.registros,
+            "facturas": self.facturas,
+            "carpetas_por_s": round(self.carpetas_por_s, 1),
+            "registros_por_s": round(self.registros_por_s, 1),
+        }
+
+    def registrar(self) -> Dict[str, Any]:
+        """Escribe la medición en el log como una línea "Rendimiento {json}" y la devuelve."""
+        datos = self.a_dict()
+        _log.info("Rendimiento %s", json.dumps(datos, ensure_ascii=False))
+        return datos
+
+    def texto(self) -> str:
+        """Resumen legible: total, ritmo del escaneo y fases de mayor a menor."""
+        lineas = [f"{self.operacion}: {self.total_s:.2f} s · {self.facturas} facturas"
+                  + ("" if self.estado == "ok" else f" ({self.estado})")]
+        if self.carpetas:
+            lineas.append(f"Escaneo: {self.carpetas_por_s:,.0f} carpetas/s · {self.registros_por_s:,.0f} registros/s")
+        fases = sorted(self.fases.items(), key=lambda x: x[1], reverse=True)
+        if fases:
+            lineas.append(" · ".join(f"{nombre} {seg:.2f} s" for nombre, seg in fases))
+        return "\n".join(lineas)
+
+
+def configurar_logging():
+    """
+    Añade al log "GeneradorCOTU" el archivo APPDATA/GeneradorCOTU/generador_cotu.log, si es posible.
+    La usan tanto la ventana como el modo por lotes; llamarla otra vez no duplica el handler.
+    """
+    if any(isinstance(h, logging.FileHandler) for h in _log.handlers):
+        return
+    _log.setLevel(logging.INFO)
+    try:
+        log_dir = os.path.join(
+            os.environ.get("APPDATA") or os.environ.get("HOME") or os.path.dirname(os.path.abspath(__file__)),
+            "GeneradorCOTU",
+        )
+        os.makedirs(log_dir, exist_ok=True)
+        log_file = os.path.join(log_dir, "generador_cotu.log")
+        fh = logging.FileHandler(log_file, encoding="utf-8")
+        fh.setLevel(logging.INFO)
+        fh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+        _log.addHandler(fh)
+    except OSError:
+        pass
+
+
+def medir_fase(medicion: Optional[MedicionRendimiento], nombre: str):
+    """medicion.fase(nombre), o un contexto vacío si no se mide."""
+    return medicion.fase(nombre) if medicion is not None else nullcontext()
+
+
+def _listar_subdirectorios(ruta: str) -> List[str]:
+    """Nombres de los subdirectorios de `ruta` (lista vacía si no se puede leer, como os.walk)."""
+    try:
+        with os.scandir(ruta) as it:
+            nombres = []
+            for entrada in it:
+                try:
+                    if entrada.is_dir():
+                        nombres.append(entrada.name)
+                except OSError:
+                    pass
+            return nombres
+    except OSError:
+        return []
+
+
+class IndiceEscaneo:
+    """
+    Índice persistente (SQLite) de los listados de carpetas ya escaneadas.
+    Guarda, por cada directorio, su mtime y los nombres de sus subdirectorios.
+    En un nuevo escaneo solo se vuelve a listar un directorio si su mtime cambió, y
+    las carpetas COTU de un directorio sin cambios ni siquiera se consultan (ver
+    SesionIndice); los registros COTU se reconstruyen a partir de las rutas guardadas.
+    Cuando un directorio se vuelve a listar, se borran las filas de las subcarpetas
+    que ya no están (y de todo lo que tenían debajo).
+    """
+
+    # Un directorio modificado hace menos de estos segundos no se guarda: en carpetas
+    # de red el mtime tiene poca resolución y un cambio inmediato podría no notarse.
+    MARGEN_MTIME_S = 2.0
+
+    def __init__(self, ruta_db: str):
+        self.ruta_db = ruta_db
+        self._lock = threading.Lock()
+        try:
+            with self._conectar() as con:
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS directorios ("
+                    " ruta TEXT PRIMARY KEY,"
+                    " mtime_ns INTEGER NOT NULL,"
+                    " subdirectorios TEXT NOT NULL)"
+                )
+        except sqlite3.Error as e:
+            _log.warning("No se pudo inicializar el índice de escaneo: %s", e)
+
+    def _conectar(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.ruta_db, timeout=10)
+
+    def sesion(self, ruta_base: str, firmas: Optional[Dict[str, Optional[int]]] = None) -> "SesionIndice":
+        """
+        Abre una sesión de escaneo con los listados guardados bajo `ruta_base`.
+        Con `firmas`, la sesión anota el mtime de las carpetas que consulta (ver _listar_anotando).
+        """
+        ruta_base = os.path.normpath(ruta_base)
+        cache: Dict[str, Tuple[int, List[str]]] = {}
+        with self._lock:
+            try:
+                with self._conectar() as con:
+                    filas = con.execute(
+                        "SELECT ruta, mtime_ns, subdirectorios FROM directorios"
+                        " WHERE ruta = ? OR substr(ruta, 1, ?) = ?",
+                        (ruta_base, len(ruta_base) + 1, ruta_base + os.sep),
+                    ).fetchall()
+                for ruta, mtime_ns, subdirs in filas:
+                    cache[ruta] = (mtime_ns, json.loads(subdirs))
+            except (sqlite3.Error, ValueError) as e:
+                _log.warning("No se pudo leer el índice de escaneo: %s", e)
+        return SesionIndice(self, cache, firmas)
+
+    def _guardar(self, cambios: Dict[str, Tuple[int, List[str]]], eliminados: Iterable[str] = ()):
+        eliminados = list(eliminados)
+        if not cambios and not eliminados:
+            return
+        with self._lock:
+            try:
+                with self._conectar() as con:
+                    # Subcarpetas que ya no existen: su fila y las de todo lo que tenían debajo
+                    con.executemany(
+                        "DELETE FROM directorios WHERE ruta = ? OR substr(ruta, 1, ?) = ?",
+                        [(ruta, len(ruta) + 1, ruta + os.sep) for ruta in eliminados],
+                    )
+                    con.executemany(
+                        "INSERT OR REPLACE INTO directorios (ruta, mtime_ns, subdirectorios) VALUES (?, ?, ?)",
+                        [(ruta, mtime, json.dumps(nombres, ensure_ascii=False)) for ruta, (mtime, nombres) in cambios.items()],
+                    )
+            except sqlite3.Error as e:
+                _log.warning("No se pudo actualizar el índice de escaneo: %s", e)
+
+    def vaciar(self):
+        """Elimina todos los listados guardados (el próximo escaneo será completo)."""
+        with self._lock:
+            try:
+                with self._conectar() as con:
+                    con.execute("DELETE FROM directorios")
+            except sqlite3.Error as e:
+                _log.warning("No se pudo vaciar el índice de escaneo: %s", e)
+
+
+def _mtime_ns(ruta: str) -> Optional[int]:
+    try:
+        return os.stat(ruta).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _listar_anotando(listar: Callable[[str], List[str]], firmas: Dict[str, Optional[int]]) -> Callable[[str], List[str]]:
+    """
+    Envuelve `listar` para anotar en `firmas` el mtime de cada carpeta antes de listarla.
+    Las carpetas COTU (casi todas las del árbol) no se anotan: sus altas, bajas y
+    renombrados ya cambian el mtime de la carpeta de aseguradora que las contiene.
+    """
+    def _listar(ruta: str) -> List[str]:
+        if not os.path.basename(ruta).upper().startswith("COTU"):
+            firmas[ruta] = _mtime_ns(ruta)
+        return listar(ruta)
+
+    return _listar
+
+
+class SesionIndice:
+    """
+    Listador de subdirectorios respaldado por un IndiceEscaneo durante un escaneo.
+    Si el mtime de una carpeta coincide con el guardado se usa su listado, y sus
+    subcarpetas COTU se dan por igual de vigentes sin consultar el disco: crear, borrar
+    o renombrar una COTU cambia el mtime de su carpeta de aseguradora. Las COTU sin
+    subcarpetas guardadas no se recorren (es_hoja), así un escaneo de un árbol sin
+    cambios solo hace un stat por carpeta AÑO/MES/DÍA/ASEGURADORA.
+    """
+
+    def __init__(self, indice: IndiceEscaneo, cache: Dict[str, Tuple[int, List[str]]],
+                 firmas: Optional[Dict[str, Optional[int]]] = None):
+        self._indice = indice
+        self._cache = cache
+        self._firmas = firmas
+        self._cambios: Dict[str, Tuple[int, List[str]]] = {}
+        self._eliminados: Set[str] = set()
+        self._sin_cambios: Set[str] = set()  # Carpetas cuyo listado guardado se reutilizó
+        self._lock = threading.Lock()  # listar() se llama desde varios hilos
+        self.reutilizados = 0
+        self.listados = 0
+
+    def _confiable(self, ruta: str) -> bool:
+        """True si `ruta` es una COTU dentro de una carpeta cuyo listado guardado sigue vigente."""
+        padre, nombre = os.path.split(ruta)
+        return nombre.upper().startswith("COTU") and padre in self._sin_cambios
+
+    def es_hoja(self, ruta: str) -> bool:
+        """True si se sabe, sin consultar el disco, que `ruta` no tiene subcarpetas (no hace falta entrar)."""
+        if not self._confiable(ruta):
+            return False
+        guardado = self._cache.get(ruta)
+        return guardado is not None and not guardado[1]
+
+    def listar(self, ruta: str) -> List[str]:
+        """Devuelve los subdirectorios de `ruta`; solo lista el disco si su mtime cambió."""
+        guardado = self._cache.get(ruta)
+        if guardado is not None and self._confiable(ruta):
+            # COTU (con subcarpetas) de una carpeta sin cambios: ni stat ni listado
+            with self._lock:
+                self.reutilizados += 1
+                self._sin_cambios.add(ruta)
+            return guardado[1]
+        try:
+            mtime_ns = os.stat(ruta).st_mtime_ns
+        except OSError:
+            return []
+        if self._firmas is not None and not os.path.basename(ruta).upper().startswith("COTU"):
+            self._firmas[ruta] = mtime_ns
+        if guardado is not None and guardado[0] == mtime_ns:
+            with self._lock:
+                self.reutilizados += 1
+                self._sin_cambios.add(ruta)
+            return guardado[1]
+        nombres = _listar_subdirectorios(ruta)
+        with self._lock:
+            self.listados += 1
+            if guardado is not None:
+                self._eliminados.update(os.path.join(ruta, d) for d in set(guardado[1]).difference(nombres))
+            if time.time() - mtime_ns / 1e9 >= IndiceEscaneo.MARGEN_MTIME_S:
+                self._cambios[ruta] = (mtime_ns, nombres)
+        return nombres
+
+    def guardar(self):
+        """Persiste los listados nuevos o modificados y borra los de carpetas que ya no existen."""
+        self._indice._guardar(self._cambios, self._eliminados)
+        _log.info(
+            "Índice de escaneo: %d carpetas reutilizadas, %d listadas de nuevo, %d eliminadas",
+            self.reutilizados, self.listados, len(self._eliminados),
+        )
+        self._cambios = {}
+        self._eliminados = set()
+
+
+class PodaFechas:
+    """
+    Decide, mientras se baja por el árbol, qué subcarpetas AÑO/MES/DÍA quedan
+    completamente fuera de [fecha_inicio, fecha_fin] y no hace falta recorrer.
+    El contexto de cada carpeta es (nombre_año, nombre_mes); None = sin poda por debajo.
+    Las carpetas cuyo nombre no se reconoce como año/mes/día se recorren siempre.
+    """
+
+    def __init__(self, fecha_inicio: Optional[datetime], fecha_fin: Optional[datetime]):
+        self.fecha_inicio = fecha_inicio
+        self.fecha_fin = fecha_fin
+
+    def contexto_base(self, nombre_base: str) -> Optional[Tuple[str, str]]:
+        """Contexto de la carpeta base: carpeta del año o carpeta padre con años dentro."""
+        return (nombre_base, "") if _es_nombre_anio(nombre_base) else ("", "")
+
+    def hijo(self, contexto: Optional[Tuple[str, str]], nombre: str) -> Tuple[bool, Optional[Tuple[str, str]]]:
+        """Devuelve (podar, contexto_hijo) para la subcarpeta `nombre`."""
+        if contexto is None:
+            return False, None
+        anio, mes = contexto
+        fi, ff = self.fecha_inicio, self.fecha_fin
+        if not anio:
+            # Nivel AÑO (base = FACTURACION con años dentro)
+            if not _es_nombre_anio(nombre):
+                return False, None
+            y = int(nombre)
+            return bool((fi and y < fi.year) or (ff and y > ff.year)), (nombre, "")
+        if not mes:
+            # Nivel MES
+            m = _numero_mes(nombre)
+            if m is None:
+                return False, None
+            y = int(anio)
+            fuera = (fi and (y, m) < (fi.year, fi.month)) or (ff and (y, m) > (ff.year, ff.month))
+            return bool(fuera), (anio, nombre)
+        # Nivel DÍA: misma fecha que tendrán los registros COTU de debajo
+        fecha = parsear_fecha_carpeta(nombre, mes, anio)
+        if fecha is None:
+            return False, None
+        return bool((fi and fecha < fi) or (ff and fecha > ff)), None
+
+
+def _hijos_a_recorrer(raiz: str, depth: int, dirs: List[str], max_depth: int, poda: Optional[PodaFechas],
+                      contexto: Optional[Tuple[str, str]],
+                      hojas: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, Optional[Tuple[str, str]]]]:
+    """
+    Subcarpetas de `raiz` en las que hay que entrar, con su contexto de poda.
+    No se entra en las que `hojas(ruta)` sabe sin subcarpetas (SesionIndice.es_hoja).
+    """
+    if depth + 1 >= max_depth:
+        return []
+    hijos = []
+    for d in dirs:
+        ctx_hijo = None
+        if poda is not None:
+            podar, ctx_hijo = poda.hijo(contexto, d)
+            if podar:
+                continue
+        ruta = os.path.join(raiz, d)
+        if hojas is not None and hojas(ruta):
+            continue
+        hijos.append((ruta, ctx_hijo))
+    return hijos
+
+
+def _recorrer(ruta_base: str, listar: Callable[[str], List[str]], solo_cotu: bool,
+              max_depth: int = MAX_DEPTH, poda: Optional[PodaFechas] = None,
+              depth_inicial: int = 0,
+              hojas: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[str, int, List[str]]]:
+    """
+    Recorrido en profundidad equivalente a os.walk (top-down) limitado a `max_depth`.
+    Devuelve (carpeta, profundidad, subdirectorios) para cada carpeta visitada.
+    Con `poda`, no entra en las carpetas AÑO/MES/DÍA fuera del rango de fechas.
+    `depth_inicial` es la profundidad de `ruta_base` respecto a la carpeta del reporte.
+    Con `hojas`, no se entra en las carpetas que ya se sabe que no tienen subcarpetas.
+    """
+    contexto = poda.contexto_base(os.path.basename(ruta_base)) if poda is not None else None
+    pila = [(ruta_base, depth_inicial, contexto)]
+    while pila:
+        raiz, depth, contexto = pila.pop()
+        dirs = listar(raiz)
+        # Filtrar directorios ANTES de entrar
+        if solo_cotu and depth >= 4:
+            dirs = [d for d in dirs if d.upper().startswith("COTU")]
+        yield raiz, depth, dirs
+        hijos = _hijos_a_recorrer(raiz, depth, dirs, max_depth, poda, contexto, hojas)
+        pila.extend((ruta, depth + 1, ctx) for ruta, ctx in reversed(hijos))
+
+
+def _recorrer_paralelo(ruta_base: str, listar: Callable[[str], List[str]], solo_cotu: bool,
+                       max_depth: int = MAX_DEPTH, hilos: int = HILOS_ESCANEO,
+                       poda: Optional[PodaFechas] = None, depth_inicial: int = 0,
+                       adelanto: int = ADELANTO_ESCANEO,
+                       hojas: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[str, int, List[str]]]:
+    """
+    Igual que _recorrer, pero los subdirectorios se listan en paralelo con un pool acotado.
+    Cada carpeta listada encola de inmediato a sus hijas, así los listados de carpetas
+    hermanas (MES, DÍA, ASEGURADORA) se solapan; los resultados se devuelven en el mismo
+    orden en profundidad que el recorrido secuencial.
+    Como mucho `adelanto` carpetas esperan listadas (o en cola) a que el consumidor
+    llegue a ellas; las demás se encolan cuando el recorrido las alcanza, de modo que
+    la memoria no crece con el tamaño del árbol si el consumidor es más lento.
+    """
+    pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="escaneo")
+    futuros: Dict[str, Future] = {}
+
+    def _tarea(raiz: str, depth: int, contexto: Optional[Tuple[str, str]]):
+        dirs = listar(raiz)
+        if solo_cotu and depth >= 4:
+            dirs = [d for d in dirs if d.upper().startswith("COTU")]
+        hijos = _hijos_a_recorrer(raiz, depth, dirs, max_depth, poda, contexto, hojas)
+        for ruta, ctx in hijos:
+            if len(futuros) >= adelanto:
+                break
+            try:
+                futuros[ruta] = pool.submit(_tarea, ruta, depth + 1, ctx)
+            except RuntimeError:
+                # El pool ya se cerró (el consumidor dejó de iterar)
+                break
+        return dirs, hijos
+
+    try:
+        contexto = poda.contexto_base(os.path.basename(ruta_base)) if poda is not None else None
+        pila = [(ruta_base, depth_inicial, contexto)]
+        while pila:
+            raiz, depth, contexto = pila.pop()
+            futuro = futuros.pop(raiz, None)
+            if futuro is None:
+                futuro = pool.submit(_tarea, raiz, depth, contexto)
+            dirs, hijos = futuro.result()
+            yield raiz, depth, dirs
+            pila.extend((ruta, depth + 1, ctx) for ruta, ctx in reversed(hijos))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def resolver_carpetas_dia(ruta_base: str, fecha: datetime,
+                          listar: Callable[[str], List[str]] = _listar_subdirectorios) -> List[Tuple[str, int]]:
+    """
+    Ruta directa para reportes de un solo día: localiza AÑO/MES/DÍA a partir de la fecha
+    sin recorrer el resto del árbol. Solo lista la carpeta del año (o la base, para buscar
+    la carpeta "2025") y la(s) carpeta(s) del mes, y reconoce las mismas variantes de
+    nombre que parsear_fecha_carpeta ("12-DICIEMBRE", "DICIEMBRE", "23 DE DICIEMBRE"...).
+    Devuelve [(ruta_dia, profundidad)]; lista vacía si la estructura no es la estándar.
+    Se comparan los nombres listados (no se construyen rutas) para conservar las
+    mayúsculas reales de las carpetas en recursos compartidos que no las distinguen.
+    """
+    dia_buscado = datetime(fecha.year, fecha.month, fecha.day)
+    nombre_base = os.path.basename(ruta_base)
+    if _es_nombre_anio(nombre_base):
+        if int(nombre_base) != fecha.year:
+            return []
+        carpetas_anio = [(ruta_base, 0)]
+    else:
+        anio = str(fecha.year)
+        carpetas_anio = [(os.path.join(ruta_base, d), 1) for d in listar(ruta_base) if d == anio]
+
+    carpetas_dia = []
+    for ruta_anio, depth in carpetas_anio:
+        nombre_anio = os.path.basename(ruta_anio)
+        for mes in listar(ruta_anio):
+            if _numero_mes(mes) != fecha.month:
+                continue
+            ruta_mes = os.path.join(ruta_anio, mes)
+            for dia in listar(ruta_mes):
+                if parsear_fecha_carpeta(dia, mes, nombre_anio) == dia_buscado:
+                    carpetas_dia.append((os.path.join(ruta_mes, dia), depth + 2))
+    return carpetas_dia
+
+
+def registro_desde_ruta(ruta_cotu: str, ruta_base: str, nombre_anio: str,
+                        campos_carpeta: Optional[Tuple[str, str, str, str]] = None) -> Registro:
+    """
+    Construye el registro de una carpeta COTU a partir de su ruta.
+    Lógica del script de trabajo: AÑO/MES/DÍA/ASEGURADORA/COTU desde el final.
+    `campos_carpeta` (de campos_de_carpeta) evita recalcular año, mes, día y aseguradora
+    para cada COTU de la misma carpeta.
+    """
+    nombre = os.path.basename(ruta_cotu)
+    partes = nombre.split()
+    cotu = partes[0] if partes else nombre
+    detalle = sys.intern(" ".join(partes[1:])) if len(partes) > 1 else ""
+    if campos_carpeta is None:
+        campos_carpeta = campos_de_carpeta(ruta_cotu, ruta_base, nombre_anio)
+    anio, mes, dia, aseguradora = campos_carpeta
+    return Registro(anio, mes, dia, cotu, detalle, aseguradora)
+
+
+def campos_de_carpeta(ruta_cotu: str, ruta_base: str, nombre_anio: str) -> Tuple[str, str, str, str]:
+    """
+    (año, mes, día, aseguradora) de una carpeta COTU; las cadenas se internan para
+    que los registros de distintas carpetas compartan "SOLIDARIA", "12-DICIEMBRE"...
+    Con la ruta completa AÑO/MES/DÍA/ASEGURADORA/COTU solo dependen de las carpetas
+    padre y valen para todas las COTU hermanas. Con rutas más cortas se cuentan desde
+    la carpeta base y pueden depender de la propia carpeta (p. ej. la del año).
+    """
+    partes_ruta = Path(ruta_cotu).parts
+    try:
+        # -1=COTU, -2=ASEGURADORA, -3=DÍA, -4=MES, -5=AÑO
+        if len(partes_ruta) >= 5:
+            anio_para_fecha = partes_ruta[-5]
+            mes = partes_ruta[-4]
+            dia = partes_ruta[-3]
+            aseguradora = partes_ruta[-2]
+        else:
+            # Fallback: índices respecto a la carpeta base
+            idx_base = partes_ruta.index(os.path.basename(ruta_base))
+            anio_para_fecha = nombre_anio
+            if idx_base + 1 < len(partes_ruta):
+                primero = partes_ruta[idx_base + 1]
+                if len(primero) == 4 and primero.isdigit():
+                    anio_para_fecha = primero
+                    if len(partes_ruta) > idx_base + 4:
+                        mes = partes_ruta[idx_base + 2]
+                        dia = partes_ruta[idx_base + 3]
+                        aseguradora = partes_ruta[idx_base + 4]
+                    else:
+                        mes = dia = aseguradora = ""
+                else:
+                    if len(partes_ruta) > idx_base + 4:
+                        mes, dia = partes_ruta[idx_base + 1], partes_ruta[idx_base + 3]
+                        aseguradora = partes_ruta[idx_base + 4]
+                    elif len(partes_ruta) > idx_base + 3:
+                        mes = partes_ruta[idx_base + 1]
+                        dia = partes_ruta[idx_base + 2]
+                        aseguradora = partes_ruta[idx_base + 3]
+                    else:
+                        mes = partes_ruta[idx_base + 1] if idx_base + 1 < len(partes_ruta) else ""
+                        dia = partes_ruta[idx_base + 2] if idx_base + 2 < len(partes_ruta) else ""
+                        aseguradora = ""
+            else:
+                if len(partes_ruta) > idx_base + 4:
+                    mes, dia = partes_ruta[idx_base + 1], partes_ruta[idx_base + 3]
+                    aseguradora = partes_ruta[idx_base + 4]
+                elif len(partes_ruta) > idx_base + 3:
+                    mes, dia = partes_ruta[idx_base + 1], partes_ruta[idx_base + 2]
+                    aseguradora = partes_ruta[idx_base + 3]
+                else:
+                    mes = partes_ruta[idx_base + 1] if idx_base + 1 < len(partes_ruta) else ""
+                    dia = partes_ruta[idx_base + 2] if idx_base + 2 < len(partes_ruta) else ""
+                    aseguradora = ""
+        return sys.intern(anio_para_fecha), sys.intern(mes), sys.intern(dia), sys.intern(aseguradora)
+    except (IndexError, ValueError):
+        return sys.intern(nombre_anio), "", "", ""
+
+
+def iterar_registros(ruta_base: str, fecha_inicio: Optional[datetime] = None, fecha_fin: Optional[datetime] = None,
+                     solo_cotu: bool = True, indice: Optional[IndiceEscaneo] = None,
+                     progreso: Optional[Callable[[int], None]] = None,
+                     hilos: int = HILOS_ESCANEO,
+                     contadores: Optional[Dict[str, int]] = None,
+                     cancelacion: Optional[TokenCancelacion] = None,
+                     medicion: Optional[MedicionRendimiento] = None,
+                     firmas: Optional[Dict[str, Optional[int]]] = None) -> Iterator[Registro]:
+    """
+    Generador de los registros COTU bajo `ruta_base`, a medida que se recorren las carpetas.
+    Si se pasa `indice`, los directorios cuyo mtime no cambió no se vuelven a listar.
+    Con `hilos` > 1 las carpetas se listan en paralelo (os.scandir en un pool acotado).
+    Con rango de fechas no se entra en las carpetas AÑO/MES/DÍA que quedan fuera de él;
+    si el rango es un único día se va directo a su carpeta (resolver_carpetas_dia).
+    `progreso(n)` se llama cada 50 carpetas procesadas. En `contadores["sin_fecha"]` se
+    acumulan los registros conservados sin fecha de carpeta válida.
+    Con `cancelacion`, se comprueba el token antes de procesar cada carpeta (lanza Cancelado).
+    Con `medicion`, se suman las fases "escaneo" y "fechas" (sin el tiempo que el
+    consumidor pasa entre registro y registro) y las carpetas y registros recorridos.
+    Con `firmas` (dict), se anota el mtime de las carpetas recorridas para validar luego
+    el resultado con firma_vigente.
+    """
+    reloj = time.perf_counter
+    t_inicio, t_fechas, t_consumidor, n_registros = reloj(), 0.0, 0.0, 0
+    if not os.path.exists(ruta_base):
+        raise FileNotFoundError(f"La carpeta no existe: {ruta_base}")
+    # Normalizar (evitar fallo de profundidad con ruta_base con barra final)
+    ruta_base_norm = os.path.normpath(ruta_base.rstrip(os.sep))
+    nombre_anio = os.path.basename(ruta_base_norm)
+    sesion = indice.sesion(ruta_base_norm, firmas) if indice is not None else None
+    if sesion is not None:
+        # La sesión anota las firmas con el mismo stat con el que valida el índice
+        listar, hojas = sesion.listar, sesion.es_hoja
+    else:
+        listar, hojas = _listar_subdirectorios, None
+        if firmas is not None:
+            listar = _listar_anotando(listar, firmas)
+
+    def _recorrer_desde(raiz: str, depth: int, poda: Optional[PodaFechas] = None):
+        if hilos > 1:
+            return _recorrer_paralelo(raiz, listar, solo_cotu, hilos=hilos, poda=poda, depth_inicial=depth,
+                                      hojas=hojas)
+        return _recorrer(raiz, listar, solo_cotu, poda=poda, depth_inicial=depth, hojas=hojas)
+
+    carpetas_dia = []
+    if fecha_inicio is not None and fecha_fin == fecha_inicio:
+        carpetas_dia = resolver_carpetas_dia(ruta_base_norm, fecha_inicio, listar)
+    if carpetas_dia:
+        # Los registros fuera de AÑO/MES/DÍA/ASEGURADORA/COTU no tienen fecha válida y
+        # filtrar_por_tipo los descartaría igualmente: basta con recorrer esos días.
+        _log.info("Reporte diario: ruta directa a %d carpeta(s) de día", len(carpetas_dia))
+        recorrido = (v for ruta, depth in carpetas_dia for v in _recorrer_desde(ruta, depth))
+    else:
+        poda = PodaFechas(fecha_inicio, fecha_fin) if (fecha_inicio or fecha_fin) else None
+        recorrido = _recorrer_desde(ruta_base_norm, 0, poda)
+
+    # Profundidad de las carpetas ASEGURADORA: base = carpeta del año (0) o carpeta padre (1)
+    depth_aseguradora = (0 if _es_nombre_anio(nombre_anio) else 1) + 3
+    carpetas_procesadas = 0
+    try:
+        for raiz, depth, dirs in recorrido:
+            if cancelacion is not None:
+                cancelacion.comprobar()
+            carpetas_procesadas += 1
+            if progreso is not None and carpetas_procesadas % 50 == 0:
+                progreso(carpetas_procesadas)
+            # En una carpeta de aseguradora, año, mes, día (y su fecha) son los mismos para
+            # todas sus COTU; en otros niveles pueden depender de cada subcarpeta
+            compartir = depth == depth_aseguradora and len(Path(raiz).parts) >= 4
+            campos, fuera = None, False
+            for d in dirs:
+                if solo_cotu and not d.upper().startswith("COTU"):
+                    continue
+                ruta_cotu = os.path.join(raiz, d)
+                if campos is None or not compartir:
+                    campos = campos_de_carpeta(ruta_cotu, ruta_base, nombre_anio)
+                    if fecha_inicio or fecha_fin:
+                        t = reloj()
+                        fecha_carpeta = parsear_fecha_carpeta(campos[2], campos[1], campos[0])
+                        t_fechas += reloj() - t
+                        fuera = bool(fecha_carpeta and ((fecha_inicio and fecha_carpeta < fecha_inicio)
+                                                        or (fecha_fin and fecha_carpeta > fecha_fin)))
+                if fuera:
+                    if compartir:
+                        break
+                    continue
+                if (fecha_inicio or fecha_fin) and not fecha_carpeta and contadores is not None:
+                    contadores["sin_fecha"] = contadores.get("sin_fecha", 0) + 1
+                registro = registro_desde_ruta(ruta_cotu, ruta_base, nombre_anio, campos)
+                if medicion is None:
+                    yield registro
+                else:
+                    n_registros += 1
+                    t = reloj()
+                    yield registro
+                    t_consumidor += reloj() - t
+    finally:
+        if sesion is not None:
+            sesion.guardar()
+        if medicion is not None:
+            medicion.agregar("fechas", t_fechas)
+            medicion.agregar("escaneo", max(0.0, reloj() - t_inicio - t_consumidor - t_fechas))
+            medicion.carpetas += carpetas_procesadas
+            medicion.registros += n_registros
+
+
+def extraer_registros(ruta_base: str, fecha_inicio: Optional[datetime] = None, fecha_fin: Optional[datetime] = None,
+                      solo_cotu: bool = True, indice: Optional[IndiceEscaneo] = None,
+                      progreso: Optional[Callable[[int], None]] = None,
+                      hilos: int = HILOS_ESCANEO,
+                      cancelacion: Optional[TokenCancelacion] = None,
+                      medicion: Optional[MedicionRendimiento] = None,
+                      firmas: Optional[Dict[str, Optional[int]]] = None) -> ListaRegistros:
+    """
+    Extrae todos los registros COTU bajo `ruta_base` (ver iterar_registros y
+    GeneradorFacturasCOTU.extraer_facturas). Estadísticas y duplicados se acumulan
+    en `resumen` durante la misma pasada.
+    Si se cancela, la excepción Cancelado lleva en `registros` lo encontrado hasta entonces.
+    """
+    contadores = {"sin_fecha": 0}
+    registros = ListaRegistros()
+    registros.resumen = ResumenRegistros()
+    try:
+        # Fase "agregar": estadísticas, duplicados y lista (el escaneo se mide aparte)
+        with medir_fase(medicion, "agregar"):
+            registros.extend(registros.resumen.contar(iterar_registros(
+                ruta_base, fecha_inicio, fecha_fin, solo_cotu=solo_cotu, indice=indice,
+                progreso=progreso, hilos=hilos, contadores=contadores, cancelacion=cancelacion,
+                medicion=medicion, firmas=firmas,
+            )))
+    except Cancelado as e:
+        e.registros = registros
+        raise
+    if fecha_inicio or fecha_fin:
+        registros.rango_fechas = (fecha_inicio, fecha_fin)
+        registros.sin_fecha = contadores["sin_fecha"]
+    return registros
+
+
+def _predicado_rango(fecha_inicio: Optional[datetime], fecha_fin: Optional[datetime]) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Devuelve una función registro -> bool que indica si la fecha de carpeta está en
+    [fecha_inicio, fecha_fin] (día completo). Cada triple (día, mes, año) distinto se
+    parsea y compara una sola vez; los registros sin fecha válida no pasan.
+    """
+    # Para fecha fin, incluir todo el día
+    limite_fin = fecha_fin.replace(hour=23, minute=59, second=59) if fecha_fin else None
+    dentro: Dict[Tuple[Any, Any, Any], bool] = {}
+
+    def _en_rango(reg: Dict[str, Any]) -> bool:
+        triple = (reg.get(COL_FECHA, ""), reg.get(COL_MES, ""), reg.get(COL_ANIO, ""))
+        ok = dentro.get(triple)
+        if ok is None:
+            fecha = parsear_fecha_carpeta(*triple)
+            ok = fecha is not None \
+                and (fecha_inicio is None or fecha >= fecha_inicio) \
+                and (limite_fin is None or fecha <= limite_fin)
+            dentro[triple] = ok
+        return ok
+
+    return _en_rango
+
+
+def filtrar_registros(registros: List[Dict[str, Any]], fecha_inicio: Optional[datetime] = None,
+                      fecha_fin: Optional[datetime] = None,
+                      cancelacion: Optional[TokenCancelacion] = None) -> List[Dict[str, Any]]:
+    """
+    Conserva los registros cuya fecha de carpeta está en [fecha_inicio, fecha_fin] (día completo).
+    Los registros sin fecha válida se descartan. Si la extracción ya aplicó los mismos
+    límites y no dejó registros sin fecha, se devuelve la lista tal cual. El resultado
+    lleva su `resumen` (estadísticas y duplicados) calculado en la misma pasada.
+    """
+    if not registros:
+        return []
+    if fecha_inicio is None and fecha_fin is None:
+        resultado = ListaRegistros(registros)
+        resultado.resumen = getattr(registros, "resumen", None)
+        return resultado
+    if getattr(registros, "rango_fechas", None) == (fecha_inicio, fecha_fin) and registros.sin_fecha == 0:
+        return registros
+    resultado = ListaRegistros()
+    resultado.resumen = ResumenRegistros()
+    resultado.extend(resultado.resumen.contar(filter(_predicado_rango(fecha_inicio, fecha_fin),
+                                                     _con_cancelacion(registros, cancelacion))))
+    resultado.rango_fechas = (fecha_inicio, fecha_fin)
+    return resultado
+
+
+def filtrar_iterable(registros: Iterable[Dict[str, Any]], fecha_inicio: Optional[datetime] = None,
+                     fecha_fin: Optional[datetime] = None,
+                     cancelacion: Optional[TokenCancelacion] = None) -> Iterator[Dict[str, Any]]:
+    """Versión en streaming de filtrar_registros (no guarda los registros en memoria)."""
+    registros = _con_cancelacion(registros, cancelacion)
+    if fecha_inicio is None and fecha_fin is None:
+        return registros
+    return filter(_predicado_rango(fecha_inicio, fecha_fin), registros)
+
+
+def verificar_duplicados(registros: List[Dict[str, Any]]) -> List[str]:
+    """Retorna lista de mensajes de duplicados encontrados (mismo N° de factura más de una vez)."""
+    return resumen_de(registros).duplicados()
+
+
+def calcular_estadisticas(registros: List[Dict[str, Any]]) -> str:
+    """Genera un resumen estadístico por aseguradora."""
+    return resumen_de(registros).estadisticas()
+
+
+def normalizar_busqueda(texto: str) -> str:
+    """Texto en mayúsculas y sin tildes, para comparar búsquedas ("día" encuentra "DIA")."""
+    texto = str(texto)
+    if texto.isascii():
+        return texto.upper()
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).upper()
+
+
+class IndiceBusqueda:
+    """
+    Búsqueda por subcadena sobre todos los registros de la vista previa.
+    Cada registro tiene una clave normalizada (columnas unidas, ver normalizar_busqueda)
+    que se calcula una sola vez; si la consulta nueva contiene a la anterior, solo se
+    busca entre los resultados anteriores.
+    """
+
+    _SEPARADOR = "\x1f"  # No aparece en nombres de carpeta: una consulta no cruza columnas
+
+    def __init__(self, registros: List[Dict[str, Any]], columnas: Optional[List[str]] = None):
+        self.registros = registros
+        self.columnas = columnas or COLUMNAS
+        self._claves: Optional[List[str]] = None
+        self._ultima: Optional[Tuple[str, List[int]]] = None
+        self._lock = threading.Lock()
+
+    def preparar(self):
+        """Calcula las claves (se puede llamar desde un hilo en segundo plano)."""
+        with self._lock:
+            if self._claves is not None:
+                return
+            # Mes, día y aseguradora se repiten mucho: normalizar cada valor distinto una vez
+            normalizados: Dict[Any, str] = {}
+            sep, columnas = self._SEPARADOR, self.columnas
+            claves = []
+            for reg in self.registros:
+                partes = []
+                for c in columnas:
+                    valor = reg.get(c, "")
+                    n = normalizados.get(valor)
+                    if n is None:
+                        n = normalizados[valor] = normalizar_busqueda(valor)
+                    partes.append(n)
+                claves.append(sep.join(partes))
+            self._claves = claves
+
+    def buscar(self, texto: str) -> List[Dict[str, Any]]:
+        """Registros que contienen `texto` en alguna columna (todos si está vacío)."""
+        consulta = normalizar_busqueda(texto.strip())
+        if not consulta:
+            self._ultima = None
+            return self.registros
+        self.preparar()
+        claves = self._claves
+        if self._ultima is not None and self._ultima[0] in consulta:
+            indices = [i for i in self._ultima[1] if consulta in claves[i]]
+        else:
+            indices = [i for i, clave in enumerate(claves) if consulta in clave]
+        self._ultima = (consulta, indices)
+        registros = self.registros
+        return [registros[i] for i in indices]
+
+
+def columnas_exportacion(formato_resumido: bool) -> List[Tuple[str, str]]:
+    """Pares (clave del registro, encabezado) de las columnas del CSV/Excel."""
+    if formato_resumido:
+        return [(COL_FECHA, "FECHA"), (COL_FACTURA, "COTU"), (COL_COMPANIA, "ASEGURADORA")]
+    return [(c, c) for c in COLUMNAS]
+
+
+def exportar_csv(registros: Iterable[Dict[str, Any]], ruta_csv: str, formato_resumido: bool = False,
+                 cancelacion: Optional[TokenCancelacion] = None) -> int:
+    """
+    Escribe el CSV (utf-8-sig) fila a fila a medida que llegan los registros, sin
+    cargarlos en memoria. Devuelve el número de filas; si no hay ninguna, o se cancela,
+    no deja archivo.
+    """
+    columnas = columnas_exportacion(formato_resumido)
+    total = 0
+    try:
+        with open(ruta_csv, "w", encoding="utf-8-sig", newline="") as f:
+            escritor = csv.writer(f, lineterminator=os.linesep)
+            escritor.writerow([encabezado for _, encabezado in columnas])
+            for reg in _con_cancelacion(registros, cancelacion):
+                escritor.writerow([reg.get(clave, "") for clave, _ in columnas])
+                total += 1
+    except BaseException:
+        _eliminar_si_existe(ruta_csv)
+        raise
+    if total == 0:
+        _eliminar_si_existe(ruta_csv)
+    return total
+
+
+def dataframe_registros(registros: List[Dict[str, Any]]):
+    """
+    DataFrame con una columna por campo. Los Registro se pasan como tuplas (sin
+    construir un dict por fila); listas de dicts se convierten como antes.
+    """
+    import pandas as pd
+    if registros and isinstance(registros[0], Registro):
+        return pd.DataFrame(registros, columns=COLUMNAS)
+    return pd.DataFrame(registros)
+
+
+def dataframe_reporte(registros: List[Dict[str, Any]], formato_resumido: bool = False,
+                      medicion: Optional[MedicionRendimiento] = None):
+    """DataFrame del reporte con las columnas de exportación y el orden del Excel."""
+    with medir_fase(medicion, "dataframe"):
+        df = dataframe_registros(registros)
+    return _columnas_y_orden(df, formato_resumido, medicion)
+
+
+def _columnas_y_orden(df, formato_resumido: bool, medicion: Optional[MedicionRendimiento] = None):
+    """Columnas de exportación y orden del Excel sobre el DataFrame de registros (conserva el índice)."""
+    with medir_fase(medicion, "dataframe"):
+        if formato_resumido:
+            df = df[[COL_FECHA, COL_FACTURA, COL_COMPANIA]].copy()
+            df = df.rename(columns={COL_FECHA: "FECHA", COL_FACTURA: "COTU", COL_COMPANIA: "ASEGURADORA"})
+            columnas_orden = ["FECHA", "COTU", "ASEGURADORA"]
+        else:
+            columnas_orden = [COL_FECHA, COL_MES, COL_FACTURA]
+    by_cols = [c for c in columnas_orden if c in df.columns]
+    if by_cols:
+        with medir_fase(medicion, "ordenar"):
+            df.sort_values(by=by_cols, inplace=True)
+    return df
+
+
+HOJA_RESUMEN = "RESUMEN"
+LARGO_MAX_HOJA = 31  # Límite de Excel para el nombre de una hoja
+_RE_HOJA_INVALIDA = re.compile(r"[\[\]:*?/\\]")
+
+
+def _nombre_hoja(nombre: str, usados: set) -> str:
+    """Nombre de hoja válido para Excel (sin []:*?/ ni barra invertida, máx. 31 caracteres) y único en el libro."""
+    base = _RE_HOJA_INVALIDA.sub("-", str(nombre)).strip(" '")[:LARGO_MAX_HOJA] or "HOJA"
+    candidato, n = base, 2
+    while candidato.upper() in usados:
+        sufijo = f" ({n})"
+        candidato, n = base[:LARGO_MAX_HOJA - len(sufijo)] + sufijo, n + 1
+    usados.add(candidato.upper())
+    return candidato
+
+
+def libro_reporte(registros: List[Dict[str, Any]], formato_resumido: bool = False,
+                  agrupar: Iterable[str] = (COL_MES,), nombre_principal: Optional[str] = None,
+                  medicion: Optional[MedicionRendimiento] = None) -> List[Tuple[str, Any]]:
+    """
+    Hojas (nombre, DataFrame) de un libro con varias pestañas, a partir de una sola
+    extracción: RESUMEN (facturas por mes y por aseguradora), la hoja con todas las
+    facturas si se da `nombre_principal`, y una hoja por mes y/o por aseguradora según
+    `agrupar` (COL_MES, COL_COMPANIA). Todas con las columnas y el orden del reporte.
+    """
+    import pandas as pd
+    with medir_fase(medicion, "dataframe"):
+        base = dataframe_registros(registros)
+    df = _columnas_y_orden(base, formato_resumido, medicion)
+    with medir_fase(medicion, "libro"):
+        # Claves por fila, alineadas por índice (df está reordenado pero conserva el índice de base)
+        meses = base[COL_MES].replace("", "SIN MES")
+        varios_anios = base[COL_ANIO].nunique() > 1
+        if varios_anios:
+            meses = base[COL_ANIO] + " " + meses
+        pares = base[[COL_ANIO, COL_MES]].assign(_hoja=meses).drop_duplicates("_hoja")
+        orden_mes = {hoja: (anio, _numero_mes(mes) or 13, mes)
+                     for hoja, anio, mes in zip(pares["_hoja"], pares[COL_ANIO], pares[COL_MES])}
+        companias = base[COL_COMPANIA].replace("", "SIN ASEGURADORA")
+        total = len(base)
+
+        por_mes = meses.value_counts()
+        por_compania = companias.value_counts()
+        filas_resumen = [("TOTAL", "", total, 100.0)]
+        filas_resumen += [("MES", hoja, int(por_mes[hoja]), round(por_mes[hoja] * 100 / total, 1))
+                          for hoja in sorted(por_mes.index, key=orden_mes.__getitem__)]
+        filas_resumen += [("COMPAÑÍA", cia, int(n), round(n * 100 / total, 1)) for cia, n in por_compania.items()]
+        usados = set()
+        hojas = [(_nombre_hoja(HOJA_RESUMEN, usados),
+                  pd.DataFrame(filas_resumen, columns=["AGRUPACIÓN", "NOMBRE", "FACTURAS", "PORCENTAJE"]))]
+        if nombre_principal:
+            hojas.append((_nombre_hoja(nombre_principal, usados), df))
+
+        agrupar = list(agrupar)
+        for columna, claves, orden in ((COL_MES, meses, orden_mes.__getitem__), (COL_COMPANIA, companias, None)):
+            if columna not in agrupar:
+                continue
+            # groupby conserva dentro de cada grupo el orden de df
+            grupos = dict(tuple(df.groupby(claves, sort=False)))
+            for clave in sorted(grupos, key=orden):
+                hojas.append((_nombre_hoja(clave, usados), grupos[clave]))
+    return hojas
+
+
+def motor_excel() -> Optional[str]:
+    """Motor xlsx disponible: 'openpyxl' (preferido), 'xlsxwriter' o None."""
+    try:
+        import openpyxl  # noqa: F401
+        return "openpyxl"
+    except ImportError:
+        try:
+            import xlsxwriter  # noqa: F401
+            return "xlsxwriter"
+        except ImportError:
+            return None
+
+
+ANCHO_MAX_COLUMNA = 50
+
+
+def anchos_columnas(df) -> List[int]:
+    """
+    Ancho de cada columna: texto más largo (incluida la cabecera) + 2, máximo ANCHO_MAX_COLUMNA.
+    Se calcula sobre el DataFrame con longitudes vectorizadas, sin recorrer celdas de la hoja.
+    """
+    anchos = []
+    for col in df.columns:
+        max_length = len(str(col))
+        if len(df):
+            max_length = max(max_length, int(df[col].astype(str).str.len().max()))
+        anchos.append(min(max_length + 2, ANCHO_MAX_COLUMNA))
+    return anchos
+
+
+def escribir_excel(df, ruta_salida: str, nombre_hoja: str, motor: Optional[str] = None,
+                   cancelacion: Optional[TokenCancelacion] = None) -> str:
+    """
+    Escribe el DataFrame en un xlsx en modo streaming (openpyxl write_only o xlsxwriter
+    constant_memory): las filas van directo al archivo sin mantener el libro en memoria.
+    Conserva nombre de hoja y autofiltro; los anchos se calculan del DataFrame antes de
+    escribir (ver anchos_columnas). Devuelve el motor usado. Si se cancela no deja archivo.
+    """
+    return escribir_libro([(nombre_hoja, df)], ruta_salida, motor, cancelacion)
+
+
+def escribir_libro(hojas: List[Tuple[str, Any]], ruta_salida: str, motor: Optional[str] = None,
+                   cancelacion: Optional[TokenCancelacion] = None) -> str:
+    """
+    Como escribir_excel, con una hoja por cada (nombre, DataFrame) de `hojas` (ver
+    libro_reporte); cada hoja lleva su autofiltro y sus anchos de columna.
+    """
+    motor = motor or motor_excel()
+    if motor is None:
+        raise ImportError("No hay motor de Excel disponible (instala openpyxl)")
+    contenido = [
+        (nombre, df.columns, anchos_columnas(df), len(df),
+         _con_cancelacion(df.itertuples(index=False, name=None), cancelacion))
+        for nombre, df in hojas
+    ]
+    try:
+        _escribir_libro(motor, contenido, ruta_salida)
+    except Cancelado:
+        _eliminar_si_existe(ruta_salida)
+        raise
+    return motor
+
+
+def _escribir_libro(motor: str, hojas: List[Tuple[str, Any, List[int], int, Iterable[tuple]]], ruta_salida: str):
+    """Escribe cada hoja (nombre, columnas, anchos, n_filas, filas) con el motor indicado (ver escribir_libro)."""
+    if motor == "openpyxl":
+        from openpyxl import Workbook
+        from openpyxl.utils import get_column_letter
+        wb = Workbook(write_only=True)
+        creadas = []
+        try:
+            for nombre_hoja, columnas, anchos, n_filas, filas in hojas:
+                hoja = wb.create_sheet(title=nombre_hoja)
+                creadas.append(hoja)
+                # En modo write_only los anchos deben fijarse antes de escribir filas
+                for i, ancho in enumerate(anchos, start=1):
+                    hoja.column_dimensions[get_column_letter(i)].width = ancho
+                hoja.append([str(c) for c in columnas])
+                for fila in filas:
+                    hoja.append([None if v == "" else v for v in fila])
+                hoja.auto_filter.ref = f"A1:{get_column_letter(len(columnas))}{n_filas + 1}"
+        except BaseException:
+            # Cerrar los temporales de las hojas; el libro no llega a guardarse
+            for hoja in creadas:
+                hoja.close()
+            raise
+        wb.save(ruta_salida)
+    else:
+        import xlsxwriter
+        wb = xlsxwriter.Workbook(ruta_salida, {"constant_memory": True})
+        try:
+            for nombre_hoja, columnas, anchos, n_filas, filas in hojas:
+                hoja = wb.add_worksheet(nombre_hoja)
+                for i, ancho in enumerate(anchos):
+                    hoja.set_column(i, i, ancho)
+                hoja.write_row(0, 0, [str(c) for c in columnas])
+                for r, fila in enumerate(filas, start=1):
+                    hoja.write_row(r, 0, fila)
+                hoja.autofilter(0, 0, n_filas, len(columnas) - 1)
+        finally:
+            wb.close()
+
+
+# Archivos columnares (Parquet / Feather): extensión -> formato
+FORMATOS_COLUMNARES = {".parquet": "parquet", ".feather": "feather"}
+COL_FECHA_TIPADA = "FECHA"  # Fecha de la carpeta ya parseada (datetime; vacía si no se pudo)
+_COLUMNAS_CATEGORICAS = (COL_ANIO, COL_MES, COL_FECHA, COL_COMPANIA)
+
+
+def motor_columnar() -> Optional[str]:
+    """Motor para Parquet/Feather disponible: 'pyarrow' o None."""
+    try:
+        import pyarrow  # noqa: F401
+        return "pyarrow"
+    except ImportError:
+        return None
+
+
+def _formato_columnar(ruta: str) -> str:
+    formato = FORMATOS_COLUMNARES.get(os.path.splitext(ruta)[1].lower())
+    if formato is None:
+        raise ValueError(f"Extensión no soportada: {ruta} (usa .parquet o .feather)")
+    return formato
+
+
+def dataframe_columnar(registros: List[Dict[str, Any]], medicion: Optional[MedicionRendimiento] = None):
+    """
+    DataFrame para Parquet/Feather: las seis columnas del registro (año, mes, fecha de
+    carpeta y aseguradora como category), más COL_FECHA_TIPADA con la fecha parseada
+    (NaT si no se pudo). Ordenado por fecha y N° de factura.
+    """
+    import pandas as pd
+    with medir_fase(medicion, "dataframe"):
+        df = dataframe_registros(registros)
+        if df.empty:
+            df = pd.DataFrame(columns=COLUMNAS)
+        claves = [COL_FECHA, COL_MES, COL_ANIO]
+        unicos = df[claves].drop_duplicates()
+        fechas = parsear_fechas_carpetas(unicos.itertuples(index=False, name=None))
+        unicos[COL_FECHA_TIPADA] = pd.to_datetime([fechas[t] for t in unicos.itertuples(index=False, name=None)])
+        df = df.merge(unicos, on=claves, how="left")
+        for col in _COLUMNAS_CATEGORICAS:
+            df[col] = df[col].astype("category")
+        df = df[[COL_ANIO, COL_MES, COL_FECHA, COL_FECHA_TIPADA, COL_FACTURA, COL_DETALLE, COL_COMPANIA]]
+    with medir_fase(medicion, "ordenar"):
+        df = df.sort_values([COL_FECHA_TIPADA, COL_FACTURA], na_position="last", ignore_index=True)
+    return df
+
+
+def exportar_columnar(registros: List[Dict[str, Any]], ruta: str, cancelacion: Optional[TokenCancelacion] = None,
+                      medicion: Optional[MedicionRendimiento] = None) -> int:
+    """
+    Escribe los registros en Parquet o Feather (Arrow IPC) según la extensión de `ruta`
+    (ver dataframe_columnar). Necesita pyarrow. Devuelve el número de filas; si no hay
+    ninguna, o se cancela, no deja archivo.
+    """
+    formato = _formato_columnar(ruta)
+    if motor_columnar() is None:
+        raise ImportError("No hay motor para Parquet/Feather disponible (instala pyarrow)")
+    if not registros:
+        return 0
+    df = dataframe_columnar(registros, medicion)
+    if cancelacion is not None:
+        cancelacion.comprobar()
+    with medir_fase(medicion, formato):
+        try:
+            if formato == "parquet":
+                df.to_parquet(ruta, engine="pyarrow", index=False)
+            else:
+                df.to_feather(ruta)
+        except BaseException:
+            _eliminar_si_existe(ruta)
+            raise
+    return len(df)
+
+
+def registros_desde_dataframe(df) -> ListaRegistros:
+    """
+    ListaRegistros a partir de un DataFrame con las columnas de COLUMNAS (p. ej. uno
+    leído con cargar_columnar). Los valores de las columnas category se comparten entre
+    registros; los vacíos quedan como "". El resumen se calcula en la misma pasada.
+    """
+    columnas = []
+    for col in COLUMNAS:
+        if col in df.columns:
+            serie = df[col]
+            columnas.append(["" if v is None or v != v else str(v) for v in serie.tolist()])
+        else:
+            columnas.append([""] * len(df))
+    registros = ListaRegistros()
+    registros.resumen = ResumenRegistros()
+    registros.extend(registros.resumen.contar(Registro(*fila) for fila in zip(*columnas)))
+    return registros
+
+
+def cargar_columnar(ruta: str, medicion: Optional[MedicionRendimiento] = None) -> ListaRegistros:
+    """
+    Lee un archivo escrito por exportar_columnar y devuelve sus registros, listos para
+    vista previa, estadísticas y duplicados sin recorrer la carpeta del año.
+    """
+    import pandas as pd
+    formato = _formato_columnar(ruta)
+    if motor_columnar() is None:
+        raise ImportError("No hay motor para Parquet/Feather disponible (instala pyarrow)")
+    with medir_fase(medicion, formato):
+        if formato == "parquet":
+            df = pd.read_parquet(ruta, engine="pyarrow")
+        else:
+            df = pd.read_feather(ruta)
+    faltan = [c for c in (COL_FACTURA, COL_COMPANIA) if c not in df.columns]
+    if faltan:
+        raise ValueError(f"El archivo no tiene las columnas {', '.join(faltan)}")
+    with medir_fase(medicion, "agregar"):
+        return registros_desde_dataframe(df)
+
+
+def nombre_archivo_salida(tipo: str, nombre_anio: str, fecha_inicio: Optional[datetime],
+                          fecha_fin: Optional[datetime], extension: str) -> str:
+    """Nombre del archivo de salida (Excel, CSV, Parquet o Feather) según tipo y fechas."""
+    ext = extension if extension.startswith(".") else "." + extension
+    if tipo == TIPO_ANIO:
+        if ext != ".xlsx":
+            return f"cotus_{nombre_anio}{ext}"
+        return f"cotus_{nombre_anio.lower().replace(' ', '_')}.xlsx"
+    if tipo == TIPO_DIA and fecha_inicio:
+        return f"cotus_dia_{fecha_inicio.strftime('%Y%m%d')}{ext}"
+    if fecha_inicio and fecha_fin:
+        if ext != ".xlsx":
+            sufijo = tipo.lower().replace("á", "a").replace("í", "i")
+            return f"cotus_{sufijo}_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}{ext}"
+        pref = "semana" if tipo == TIPO_SEMANA else "mes"
+        return f"cotus_{pref}_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}.xlsx"
+    return f"cotus_{nombre_anio}{ext}"
+
+
+def generar_reporte(ruta_base: str, tipo: str, fecha_inicio: Optional[datetime] = None,
+                    fecha_fin: Optional[datetime] = None, formato: str = "xlsx", formato_resumido: bool = False,
+                    carpeta_salida: Optional[str] = None, cancelacion: Optional[TokenCancelacion] = None,
+                    medicion: Optional[MedicionRendimiento] = None, agrupar: Iterable[str] = (),
+                    **opciones) -> Tuple[Optional[str], int]:
+    """
+    Extrae, filtra por tipo y exporta el reporte (mismo motor que la GUI).
+    `opciones` se pasan a iterar_registros (indice, progreso, hilos...).
+    Con `agrupar` (COL_MES y/o COL_COMPANIA) el xlsx lleva además RESUMEN y una hoja por
+    mes y/o aseguradora (ver libro_reporte).
+    Con formato "parquet" o "feather" se escribe el archivo columnar de exportar_columnar
+    (siempre con todas las columnas; `formato_resumido` no se aplica).
+    Con `medicion`, se miden las fases (ver MedicionRendimiento).
+    Devuelve (ruta del archivo, total de facturas); ruta es None si no hubo facturas.
+    """
+    nombre_anio = os.path.basename(ruta_base.rstrip(os.sep))
+    ruta_salida = os.path.join(carpeta_salida or ruta_base,
+                               nombre_archivo_salida(tipo, nombre_anio, fecha_inicio, fecha_fin, "." + formato))
+    if formato == "csv":
+        registros = iterar_registros(ruta_base, fecha_inicio, fecha_fin, cancelacion=cancelacion,
+                                     medicion=medicion, **opciones)
+        if tipo != TIPO_ANIO:
+            registros = filtrar_iterable(registros, fecha_inicio, fecha_fin)
+        with medir_fase(medicion, "csv"):
+            total = exportar_csv(registros, ruta_salida, formato_resumido, cancelacion)
+        return (ruta_salida if total else None), total
+    registros = extraer_registros(ruta_base, fecha_inicio, fecha_fin, cancelacion=cancelacion,
+                                  medicion=medicion, **opciones)
+    if tipo != TIPO_ANIO:
+        with medir_fase(medicion, "filtrar"):
+            registros = filtrar_registros(registros, fecha_inicio, fecha_fin, cancelacion)
+    if not registros:
+        return None, 0
+    if "." + formato in FORMATOS_COLUMNARES:
+        total = exportar_columnar(registros, ruta_salida, cancelacion, medicion)
+        return ruta_salida, total
+    if agrupar:
+        hojas = libro_reporte(registros, formato_resumido, agrupar, NOMBRES_HOJA[tipo], medicion)
+    else:
+        hojas = [(NOMBRES_HOJA[tipo], dataframe_reporte(registros, formato_resumido, medicion))]
+    with medir_fase(medicion, "excel"):
+        escribir_libro(hojas, ruta_salida, cancelacion=cancelacion)
+    return ruta_salida, len(registros)
+
+
+# Etiquetas (nuevas, eliminadas, movidas, sin cambios) frente a una copia guardada (Parquet/Feather)
+HOJAS_DIFERENCIAS = ("NUEVAS", "ELIMINADAS", "MOVIDAS", "SIN CAMBIOS")
+# Listado periodo a periodo: cada COTU está en una sola carpeta de día, así que casi todas
+# aparecen solo en uno de los dos periodos; no son altas ni bajas
+HOJAS_PERIODOS = ("SOLO PERIODO ACTUAL", "SOLO PERIODO ANTERIOR", "EN AMBOS PERIODOS", "MISMA CARPETA")
+_SIN_NUMERO = ("", "COTU")  # N° que no identifican una factura (no se emparejan como movidas)
+
+
+class DiferenciaRegistros:
+    """
+    Resultado de comparar_registros: facturas nuevas, eliminadas y movidas (mismo N°
+    en otra carpeta de año, mes, día o aseguradora), como pares (anterior, actual).
+    Con `por_periodos` se rotula como listado periodo a periodo (ver HOJAS_PERIODOS).
+    """
+
+    def __init__(self, por_periodos: bool = False):
+        self.nuevos: List[Dict[str, Any]] = []
+        self.eliminados: List[Dict[str, Any]] = []
+        self.movidos: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        self.sin_cambios = 0
+        self.por_periodos = por_periodos
+
+    @property
+    def etiquetas(self) -> Tuple[str, str, str, str]:
+        return HOJAS_PERIODOS if self.por_periodos else HOJAS_DIFERENCIAS
+
+    @property
+    def total_cambios(self) -> int:
+        return len(self.nuevos) + len(self.eliminados) + len(self.movidos)
+
+    def texto(self) -> str:
+        """Resumen de una línea por tipo de cambio."""
+        cantidades = (len(self.nuevos), len(self.eliminados), len(self.movidos), self.sin_cambios)
+        return "\n".join(f"{etiqueta.capitalize()}: {n}" for etiqueta, n in zip(self.etiquetas, cantidades))
+
+
+def _clave_ubicacion(reg: Dict[str, Any]) -> Tuple[str, Any, Any, Any, Any]:
+    """(N° normalizado, aseguradora, año, mes, día): identifica una factura en su carpeta."""
+    if type(reg) is Registro:
+        anio, mes, fecha, factura, _, compania = reg
+        return factura.strip().upper(), compania, anio, mes, fecha
+    return (str(reg.get(COL_FACTURA, "")).strip().upper(), reg.get(COL_COMPANIA, ""),
+            reg.get(COL_ANIO, ""), reg.get(COL_MES, ""), reg.get(COL_FECHA, ""))
+
+
+def comparar_registros(anteriores: List[Dict[str, Any]], actuales: Iterable[Dict[str, Any]],
+                       cancelacion: Optional[TokenCancelacion] = None,
+                       por_periodos: bool = False) -> DiferenciaRegistros:
+    """
+    Compara dos conjuntos de registros con diccionarios por clave de ubicación y por N°
+    de factura (tiempo lineal, sin ordenar). Una factura con el mismo N°, aseguradora y
+    carpeta de día en ambos no cuenta como cambio; con el mismo N° en otra carpeta es
+    movida; el resto son nuevas (solo en `actuales`) o eliminadas (solo en `anteriores`).
+    Los N° repetidos se emparejan uno a uno.
+    """
+    diferencia = DiferenciaRegistros(por_periodos)
+    restantes: Dict[Tuple[str, Any, Any, Any, Any], int] = {}
+    for reg in _con_cancelacion(anteriores, cancelacion):
+        clave = _clave_ubicacion(reg)
+        restantes[clave] = restantes.get(clave, 0) + 1
+    sin_par: List[Tuple[str, Dict[str, Any]]] = []
+    for reg in _con_cancelacion(actuales, cancelacion):
+        clave = _clave_ubicacion(reg)
+        pendientes = restantes.get(clave, 0)
+        if pendientes:
+            restantes[clave] = pendientes - 1
+            diferencia.sin_cambios += 1
+        else:
+            sin_par.append((clave[0], reg))
+    # Anteriores que no encontraron su misma carpeta, por N° (en orden de aparición)
+    por_numero: Dict[str, deque] = {}
+    for reg in _con_cancelacion(anteriores, cancelacion):
+        clave = _clave_ubicacion(reg)
+        pendientes = restantes.get(clave, 0)
+        if not pendientes:
+            continue
+        restantes[clave] = pendientes - 1
+        if clave[0] in _SIN_NUMERO:
+            diferencia.eliminados.append(reg)
+        else:
+            por_numero.setdefault(clave[0], deque()).append(reg)
+    for numero, reg in sin_par:
+        cola = por_numero.get(numero)
+        if cola:
+            diferencia.movidos.append((cola.popleft(), reg))
+        else:
+            diferencia.nuevos.append(reg)
+    for cola in por_numero.values():
+        diferencia.eliminados.extend(cola)
+    return diferencia
+
+
+def periodo_anterior(tipo: str, fecha_inicio: datetime, fecha_fin: datetime) -> Tuple[datetime, datetime]:
+    """
+    Periodo con el que se compara [fecha_inicio, fecha_fin]: el mes natural anterior si
+    el rango es un mes completo; si no, el mismo número de días justo antes (semana, día).
+    """
+    if tipo == TIPO_MES and fecha_inicio.day == 1 and (fecha_inicio.year, fecha_inicio.month) == \
+            (fecha_fin.year, fecha_fin.month) and (fecha_fin + timedelta(days=1)).day == 1:
+        fin = fecha_inicio - timedelta(days=1)
+        return fin.replace(day=1), fin
+    dias = timedelta(days=(fecha_fin - fecha_inicio).days + 1)
+    return fecha_inicio - dias, fecha_fin - dias
+
+
+def separar_periodos(registros: Iterable[Dict[str, Any]], anterior: Tuple[datetime, datetime],
+                     actual: Tuple[datetime, datetime],
+                     cancelacion: Optional[TokenCancelacion] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Reparte en una pasada los registros de un escaneo que cubre ambos periodos:
+    devuelve (registros del periodo anterior, registros del actual). El resto se descarta.
+    """
+    en_anterior, en_actual = _predicado_rango(*anterior), _predicado_rango(*actual)
+    anteriores: List[Dict[str, Any]] = []
+    actuales: List[Dict[str, Any]] = []
+    for reg in _con_cancelacion(registros, cancelacion):
+        if en_actual(reg):
+            actuales.append(reg)
+        elif en_anterior(reg):
+            anteriores.append(reg)
+    return anteriores, actuales
+
+
+def libro_diferencias(diferencia: DiferenciaRegistros) -> List[Tuple[str, Any]]:
+    """
+    Hojas (nombre, DataFrame) del Excel de diferencias: RESUMEN con el número de
+    facturas por tipo de cambio, NUEVAS y ELIMINADAS con las columnas del reporte, y
+    MOVIDAS con la carpeta anterior y la actual de cada factura (o sus equivalentes de
+    HOJAS_PERIODOS en un listado periodo a periodo).
+    """
+    import pandas as pd
+    etiquetas = diferencia.etiquetas
+    resumen = pd.DataFrame({
+        "CAMBIO": list(etiquetas),
+        "FACTURAS": [len(diferencia.nuevos), len(diferencia.eliminados), len(diferencia.movidos),
+                     diferencia.sin_cambios],
+    })
+    hojas = [(HOJA_RESUMEN, resumen)]
+    for nombre, registros in zip(etiquetas, (diferencia.nuevos, diferencia.eliminados)):
+        df = dataframe_registros(registros) if registros else pd.DataFrame(columns=COLUMNAS)
+        hojas.append((nombre, _columnas_y_orden(df, False)))
+    movidas = pd.DataFrame(
+        [(actual.get(COL_FACTURA, ""), anterior.get(COL_MES, ""), anterior.get(COL_FECHA, ""),
+          anterior.get(COL_COMPANIA, ""), actual.get(COL_MES, ""), actual.get(COL_FECHA, ""),
+          actual.get(COL_COMPANIA, ""), actual.get(COL_DETALLE, ""))
+         for anterior, actual in diferencia.movidos],
+        columns=[COL_FACTURA, "MES ANTERIOR", "FECHA ANTERIOR", "COMPAÑÍA ANTERIOR",
+                 COL_MES, COL_FECHA, COL_COMPANIA, COL_DETALLE],
+    )
+    hojas.append((etiquetas[2], movidas.sort_values(COL_FACTURA)))
+    return hojas
+
+
+def nombre_archivo_diferencias(fecha_inicio: Optional[datetime], fecha_fin: Optional[datetime],
+                               contra: Optional[str] = None) -> str:
+    """
+    Nombre del Excel de diferencias: cotus_diferencias_* frente a `contra` (por las fechas
+    del periodo o, en un Año, por el archivo comparado) y cotus_periodos_* sin él.
+    """
+    if fecha_inicio is None or fecha_fin is None:
+        return f"cotus_diferencias_{os.path.splitext(os.path.basename(contra or ''))[0]}.xlsx"
+    prefijo = "diferencias" if contra else "periodos"
+    return f"cotus_{prefijo}_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}.xlsx"
+
+
+def escribir_diferencias(anteriores: List[Dict[str, Any]], actuales: List[Dict[str, Any]], ruta_salida: str,
+                         cancelacion: Optional[TokenCancelacion] = None,
+                         medicion: Optional[MedicionRendimiento] = None,
+                         por_periodos: bool = False) -> DiferenciaRegistros:
+    """Compara los dos conjuntos (ver comparar_registros) y escribe el Excel de libro_diferencias."""
+    with medir_fase(medicion, "comparar"):
+        diferencia = comparar_registros(anteriores, actuales, cancelacion, por_periodos)
+    hojas = libro_diferencias(diferencia)
+    with medir_fase(medicion, "excel"):
+        escribir_libro(hojas, ruta_salida, cancelacion=cancelacion)
+    return diferencia
+
+
+def generar_diferencias(ruta_base: str, tipo: str, fecha_inicio: Optional[datetime] = None,
+                        fecha_fin: Optional[datetime] = None, contra: Optional[str] = None,
+                        carpeta_salida: Optional[str] = None, cancelacion: Optional[TokenCancelacion] = None,
+                        medicion: Optional[MedicionRendimiento] = None,
+                        **opciones) -> Tuple[Optional[str], DiferenciaRegistros]:
+    """
+    Excel de diferencias del periodo (ver libro_diferencias) frente a `contra`: un
+    Parquet/Feather de exportar_columnar guardado antes (p. ej. al cierre de mes). Así se
+    ven las carpetas COTU que aparecieron, desaparecieron o cambiaron de día o aseguradora.
+    Sin `contra` se hace un listado periodo a periodo frente a periodo_anterior (un solo
+    escaneo cubre los dos periodos), rotulado con HOJAS_PERIODOS: como cada COTU está en
+    una sola carpeta de día, no indica altas ni bajas. Un Año completo necesita `contra`.
+    Devuelve (ruta del archivo, diferencia); ruta es None si ambos conjuntos están vacíos.
+    """
+    if contra:
+        anteriores = cargar_columnar(contra, medicion)
+        actuales = extraer_registros(ruta_base, fecha_inicio, fecha_fin, cancelacion=cancelacion,
+                                     medicion=medicion, **opciones)
+        if tipo != TIPO_ANIO:
+            # La copia puede abarcar más (p. ej. el año hasta el cierre): comparar solo el periodo
+            with medir_fase(medicion, "filtrar"):
+                actuales = filtrar_registros(actuales, fecha_inicio, fecha_fin, cancelacion)
+                anteriores = filtrar_registros(anteriores, fecha_inicio, fecha_fin, cancelacion)
+    else:
+        if tipo == TIPO_ANIO or fecha_inicio is None or fecha_fin is None:
+            raise ValueError("Para comparar un año completo indica el archivo anterior (Parquet o Feather)")
+        anterior = periodo_anterior(tipo, fecha_inicio, fecha_fin)
+        registros = extraer_registros(ruta_base, anterior[0], fecha_fin, cancelacion=cancelacion,
+                                      medicion=medicion, **opciones)
+        with medir_fase(medicion, "filtrar"):
+            anteriores, actuales = separar_periodos(registros, anterior, (fecha_inicio, fecha_fin), cancelacion)
+        if not anteriores and anterior[0].year != fecha_inicio.year:
+            _log.warning("El periodo anterior empieza en %s: selecciona la carpeta padre de los años "
+                         "para incluirlo", anterior[0].year)
+    por_periodos = not contra
+    if medicion is not None:
+        medicion.facturas = len(actuales)
+    if not anteriores and not actuales:
+        return None, DiferenciaRegistros(por_periodos)
+    ruta_salida = os.path.join(carpeta_salida or ruta_base, nombre_archivo_diferencias(fecha_inicio, fecha_fin, contra))
+    return ruta_salida, escribir_diferencias(anteriores, actuales, ruta_salida, cancelacion, medicion, por_periodos)
+
+
+class EjecutorTrabajos:
+    """
+    Cola única de trabajos en segundo plano (escaneos de carpetas). Los trabajos se
+    ejecutan de uno en uno para no competir por la carpeta de red; si llega un trabajo
+    con la misma clave que otro en cola o en curso, se une a ese en lugar de repetirlo.
+    """
+
+    def __init__(self):
+        self._cola: "queue.Queue[Tuple[Any, Callable[[TokenCancelacion], Any], TokenCompartido, Future]]" = queue.Queue()
+        self._pendientes: Dict[Any, Tuple[Future, TokenCompartido]] = {}
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+
+    def enviar(self, clave: Any, funcion: Callable[[TokenCancelacion], Any],
+               cancelacion: Optional[TokenCancelacion] = None) -> Future:
+        """
+        Encola `funcion(token)` y devuelve su Future. Con `clave` no None, una petición
+        idéntica pendiente devuelve el mismo Future. El token que recibe la función se
+        cancela cuando todos los interesados cancelan.
+        """
+        with self._lock:
+            if clave is not None and clave in self._pendientes:
+                futuro, token = self._pendientes[clave]
+                token.unir(cancelacion)
+                _log.info("Petición unida a un escaneo ya en curso")
+                return futuro
+            futuro, token = Future(), TokenCompartido()
+            token.unir(cancelacion)
+            if clave is not None:
+                self._pendientes[clave] = (futuro, token)
+            self._cola.put((clave, funcion, token, futuro))
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="ejecutor-trabajos", daemon=True)
+                self._hilo.start()
+        return futuro
+
+    def en_curso(self, clave: Any) -> bool:
+        """True si hay un trabajo con `clave` en cola o ejecutándose."""
+        with self._lock:
+            return clave in self._pendientes
+
+    def _bucle(self):
+        while True:
+            clave, funcion, token, futuro = self._cola.get()
+            try:
+                if token.cancelado:
+                    futuro.set_exception(Cancelado())
+                else:
+                    futuro.set_result(funcion(token))
+            except BaseException as e:
+                futuro.set_exception(e)
+            finally:
+                with self._lock:
+                    if clave is not None and self._pendientes.get(clave, (None,))[0] is futuro:
+                        del self._pendientes[clave]
+
+
+# Resultados de escaneo en memoria: vigencia y número de escaneos recordados
+TTL_CACHE_S = 300
+MAX_RESULTADOS_CACHE = 3
+
+
+def firma_vigente(firmas: Dict[str, Optional[int]], hilos: int = HILOS_ESCANEO) -> bool:
+    """
+    True si ninguna carpeta anotada por iterar_registros(firmas=...) cambió de mtime.
+    Son las carpetas AÑO/MES/DÍA/ASEGURADORA que el escaneo recorrió (sin las podadas
+    ni las COTU), así que una carpeta COTU nueva, borrada o renombrada se detecta.
+    Los stat se hacen en paralelo, como los listados del escaneo.
+    """
+    if not firmas:
+        return False
+    if hilos <= 1 or len(firmas) <= hilos:
+        return all(_mtime_ns(ruta) == mtime for ruta, mtime in firmas.items())
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="firma") as pool:
+        return all(actual == mtime for actual, mtime in zip(pool.map(_mtime_ns, firmas), firmas.values()))
+
+
+class CacheResultados:
+    """
+    Últimos resultados de escaneo en memoria, por clave (carpeta, tipo, fechas, solo COTU).
+    Una entrada vale mientras no pase `ttl_s` y las carpetas que recorrió el escaneo
+    sigan sin cambios (firma_vigente); se conservan como mucho `max_entradas`.
+    """
+
+    def __init__(self, ttl_s: float = TTL_CACHE_S, max_entradas: int = MAX_RESULTADOS_CACHE,
+                 reloj: Callable[[], float] = time.monotonic):
+        self.ttl_s = ttl_s
+        self.max_entradas = max_entradas
+        self._reloj = reloj
+        self._entradas: "OrderedDict[Any, Tuple[float, Dict[str, Optional[int]], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: Any) -> Optional[Any]:
+        """Resultado guardado para `clave`, o None si no hay o dejó de ser válido."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        creado, firmas, resultado = entrada
+        if self._reloj() - creado > self.ttl_s or not firma_vigente(firmas):
+            with self._lock:
+                if self._entradas.get(clave) is entrada:
+                    del self._entradas[clave]
+            return None
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+        return resultado
+
+    def guardar(self, clave: Any, firmas: Dict[str, Optional[int]], resultado: Any):
+        """Guarda `resultado` con las `firmas` anotadas durante su escaneo (ver iterar_registros)."""
+        if not firmas or self.max_entradas <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = (self._reloj(), firmas, resultado)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def vaciar(self):
+        with self._lock:
+            self._entradas.clear()
+
+
+# Espera máxima, tras cancelar, a que el trabajo compartido devuelva sus registros parciales
+ESPERA_PARCIALES_S = 2.0
+
+
+def esperar_resultado(futuro: Future, cancelacion: Optional[TokenCancelacion] = None, intervalo: float = 0.1) -> Any:
+    """
+    Espera el resultado de un trabajo de EjecutorTrabajos. Si `cancelacion` se cancela
+    mientras tanto, lanza Cancelado: con los registros parciales si el trabajo se detuvo
+    (era el último interesado) o sin ellos si sigue en curso para otros.
+    """
+    while True:
+        try:
+            return futuro.result(timeout=intervalo)
+        except FuturoTimeout:
+            if cancelacion is None or not cancelacion.cancelado:
+                continue
+        try:
+            resultado = futuro.result(timeout=ESPERA_PARCIALES_S)
+        except FuturoTimeout:
+            raise Cancelado()
+        raise Cancelado(registros=resultado)
+
+
+TAMANO_PAGINA_HISTORIAL = 100
+
+
+class HistorialReportes:
+    """
+    Historial de reportes generados, en una tabla SQLite a la que solo se añaden filas.
+    Guardar una entrada es un INSERT (no se relee ni se reescribe el historial) y no hay
+    límite de entradas. Las lecturas se sirven por páginas desde una caché en memoria
+    que se carga de la base una sola vez. Si la tabla no existía y hay un
+    historial_reportes.json anterior, se importa al crearla.
+    """
+
+    CAMPOS = ("fecha", "tipo", "archivo", "ruta", "total_facturas", "duracion_s", "formato")
+
+    def __init__(self, ruta_db: str, ruta_json_anterior: Optional[str] = None):
+        self.ruta_db = ruta_db
+        self._lock = threading.Lock()
+        self._cache: Optional[List[Dict[str, Any]]] = None  # Orden cronológico (la más reciente al final)
+        try:
+            with self._conectar() as con:
+                existia = con.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'historial'"
+                ).fetchone()
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS historial ("
+                    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " fecha TEXT NOT NULL,"
+                    " tipo TEXT,"
+                    " archivo TEXT,"
+                    " ruta TEXT,"
+                    " total_facturas INTEGER,"
+                    " duracion_s REAL,"
+                    " formato TEXT)"
+                )
+                if not existia and ruta_json_anterior:
+                    self._importar_json(con, ruta_json_anterior)
+        except sqlite3.Error as e:
+            _log.warning("No se pudo inicializar el historial: %s", e)
+
+    def _conectar(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.ruta_db, timeout=10)
+
+    def _importar_json(self, con: sqlite3.Connection, ruta_json: str):
+        """Copia las entradas del historial JSON anterior (más reciente primero)."""
+        try:
+            with open(ruta_json, "r", encoding="utf-8") as f:
+                anteriores = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(anteriores, list):
+            return
+        filas = [tuple(e.get(c) for c in self.CAMPOS) for e in reversed(anteriores) if isinstance(e, dict)]
+        con.executemany(
+            f"INSERT INTO historial ({', '.join(self.CAMPOS)}) VALUES ({', '.join('?' * len(self.CAMPOS))})", filas
+        )
+        _log.info("Historial: importadas %d entradas de %s", len(filas), ruta_json)
+
+    def _cargar(self) -> List[Dict[str, Any]]:
+        if self._cache is None:
+            try:
+                with self._conectar() as con:
+                    filas = con.execute(f"SELECT {', '.join(self.CAMPOS)} FROM historial ORDER BY id").fetchall()
+                self._cache = [dict(zip(self.CAMPOS, fila)) for fila in filas]
+            except sqlite3.Error as e:
+                _log.warning("No se pudo leer el historial: %s", e)
+                return []
+        return self._cache
+
+    def agregar(self, tipo: str, archivo: str, ruta: str, total_facturas: int,
+                duracion_s: Optional[float] = None, formato: str = "xlsx") -> Optional[Dict[str, Any]]:
+        """Añade una entrada con la fecha actual. Devuelve la entrada, o None si no se pudo guardar."""
+        entrada = {
+            "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "tipo": tipo,
+            "archivo": archivo,
+            "ruta": ruta,
+            "total_facturas": total_facturas,
+            "duracion_s": round(duracion_s, 2) if duracion_s is not None else None,
+            "formato": formato,
+        }
+        with self._lock:
+            try:
+                with self._conectar() as con:
+                    con.execute(
+                        f"INSERT INTO historial ({', '.join(self.CAMPOS)}) VALUES ({', '.join('?' * len(self.CAMPOS))})",
+                        tuple(entrada[c] for c in self.CAMPOS),
+                    )
+            except sqlite3.Error as e:
+                _log.warning("No se pudo guardar el historial: %s", e)
+                return None
+            if self._cache is not None:
+                self._cache.append(entrada)
+        return entrada
+
+    def total(self) -> int:
+        with self._lock:
+            return len(self._cargar())
+
+    def pagina(self, inicio: int = 0, cantidad: int = TAMANO_PAGINA_HISTORIAL) -> List[Dict[str, Any]]:
+        """Entradas de la más reciente a la más antigua, saltando las `inicio` primeras."""
+        with self._lock:
+            entradas = self._cargar()
+            fin = max(len(entradas) - inicio, 0)
+            return entradas[max(fin - cantidad, 0):fin][::-1]
+
+
+ESPERA_GUARDADO_S = 0.5  # Sin cambios nuevos durante este tiempo, se escribe el archivo
+REINTENTOS_REEMPLAZO = 3  # os.replace puede fallar un instante si OneDrive o un antivirus tiene el archivo abierto
+
+
+def escribir_json_atomico(ruta: str, datos: Any):
+    """
+    Escribe `datos` como JSON en un temporal de la misma carpeta y lo renombra sobre
+    `ruta`: el archivo queda con el contenido anterior o con el nuevo, nunca a medias.
+    """
+    fd, temporal = tempfile.mkstemp(prefix="." + os.path.basename(ruta) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(ruta)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(datos, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        for intento in range(REINTENTOS_REEMPLAZO):
+            try:
+                os.replace(temporal, ruta)
+                break
+            except PermissionError:
+                if intento == REINTENTOS_REEMPLAZO - 1:
+                    raise
+                time.sleep(0.1 * (intento + 1))
+    except BaseException:
+        _eliminar_si_existe(temporal)
+        raise
+
+
+class GuardadoDiferido:
+    """
+    Guarda un JSON en segundo plano cuando pasan `espera_s` sin cambios nuevos: varios
+    cambios seguidos se agrupan en una sola escritura atómica (escribir_json_atomico).
+    `programar` no toca el disco, así que se puede llamar desde el hilo de la interfaz.
+    Si la escritura falla se llama a `al_fallar(excepcion)` desde el hilo que escribía.
+    """
+
+    def __init__(self, ruta: str, espera_s: float = ESPERA_GUARDADO_S,
+                 al_fallar: Optional[Callable[[Exception], None]] = None):
+        self.ruta = ruta
+        self.espera_s = espera_s
+        self._al_fallar = al_fallar
+        self._lock = threading.Lock()
+        self._lock_escritura = threading.Lock()  # Una escritura a la vez, en orden
+        self._pendiente: Optional[Any] = None
+        self._temporizador: Optional[threading.Timer] = None
+
+    @property
+    def pendiente(self) -> bool:
+        return self._pendiente is not None
+
+    def programar(self, datos: Any):
+        """Deja `datos` como próximo contenido y reinicia la espera."""
+        with self._lock:
+            self._pendiente = datos
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+            self._temporizador = threading.Timer(self.espera_s, self.guardar_ahora)
+            self._temporizador.daemon = True
+            self._temporizador.start()
+
+    def guardar_ahora(self) -> bool:
+        """Escribe ya lo pendiente (si hay). Devuelve False si la escritura falló."""
+        with self._lock_escritura:
+            with self._lock:
+                datos, self._pendiente = self._pendiente, None
+            if datos is None:
+                return True
+            try:
+                escribir_json_atomico(self.ruta, datos)
+            except (OSError, TypeError, ValueError) as e:
+                _log.warning("No se pudo guardar %s: %s", self.ruta, e)
+                if self._al_fallar is not None:
+                    self._al_fallar(e)
+                return False
+            return True
+
+    def vaciar(self) -> bool:
+        """Cancela la espera y escribe lo pendiente en este hilo (al cerrar la aplicación)."""
+        with self._lock:
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = None
+        return self.guardar_ahora()
+
+
+def _eliminar_si_existe(ruta: str):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+MESES_ESPANOL = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
+    'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
+    'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
+}
+
+# Expresiones precompiladas del parser de fechas de carpeta
+_RE_NO_DIGITOS = re.compile(r'\D')
+_RE_DIGITOS_INICIO = re.compile(r'^(\d+)')
+
+# Miles de facturas comparten unas pocas carpetas DÍA/MES/AÑO: se memoiza por triple
+_MAX_CACHE_FECHAS = 16384
+
+
+def _es_nombre_anio(nombre: str) -> bool:
+    """True si el nombre de carpeta es un año (cuatro dígitos, ej. "2025")."""
+    return len(nombre) == 4 and nombre.isdigit()
+
+
+@lru_cache(maxsize=1024)
+def _numero_mes(mes: str) -> Optional[int]:
+    """
+    Número de mes (1-12) a partir del nombre de carpeta, o None.
+    Acepta "AGOSTO", "08-AGOSTO", "08", etc.
+    """
+    mes_lower = mes.lower().strip()
+
+    # Buscar en el diccionario de meses
+    if mes_lower in MESES_ESPANOL:
+        return MESES_ESPANOL[mes_lower]
+    mes_num = None
+    try:
+        # Intentar extraer número del mes (ej: "08-AGOSTO" -> 8)
+        mes_num = int(_RE_NO_DIGITOS.sub('', mes))
+    except (ValueError, TypeError):
+        pass
+    if mes_num is None or mes_num < 1 or mes_num > 12:
+        # Si no es válido, buscar el nombre del mes en el string
+        for nombre_mes, num in MESES_ESPANOL.items():
+            if nombre_mes in mes_lower:
+                return num
+        return None
+    return mes_num
+
+
+def _parsear_fecha(dia: str, mes: str, anio: str) -> Optional[datetime]:
+    """Parseo sin caché (ver parsear_fecha_carpeta)."""
+    try:
+        if not dia or not mes or not anio:
+            return None
+
+        # Extraer año (solo números)
+        anio_num = None
+        try:
+            anio_num = int(_RE_NO_DIGITOS.sub('', str(anio)))
+        except (ValueError, TypeError):
+            return None
+
+        # Extraer mes (convertir nombre a número)
+        mes_num = _numero_mes(mes)
+        if not mes_num:
+            return None
+
+        # Extraer día
+        dia_num = None
+        dia_str = str(dia).strip()
+
+        # Formato: "02 DE AGOSTO" o "2 DE AGOSTO"
+        # Extraer números del inicio
+        match = _RE_DIGITOS_INICIO.match(dia_str)
+        if match:
+            try:
+                dia_num = int(match.group(1))
+            except (ValueError, TypeError):
+                pass
+
+        # Si no se encontró día, intentar extraer cualquier número
+        if not dia_num:
+            try:
+                dia_num = int(_RE_NO_DIGITOS.sub('', dia_str))
+            except (ValueError, TypeError):
+                return None
+
+        # Validar y crear fecha
+        if dia_num and mes_num and anio_num:
+            try:
+                return datetime(anio_num, mes_num, dia_num)
+            except ValueError:
+                # Fecha inválida (ej: 31 de febrero)
+                return None
+
+    except (ValueError, TypeError, AttributeError, KeyError):
+        pass
+
+    return None
+
+
+_parsear_fecha_cacheada = lru_cache(maxsize=_MAX_CACHE_FECHAS)(_parsear_fecha)
+
+
+def parsear_fecha_carpeta(dia: str, mes: str, anio: str) -> Optional[datetime]:
+    """
+    Intenta parsear la fecha desde los nombres de carpeta
+    Maneja formatos como: "02 DE AGOSTO", "AGOSTO", "2025"
+    El resultado se memoiza por triple (día, mes, año).
+    """
+    try:
+        return _parsear_fecha_cacheada(dia, mes, anio)
+    except TypeError:
+        # Argumentos no hashables: parsear sin caché
+        return _parsear_fecha(dia, mes, anio)
+
+
+def parsear_fechas_carpetas(triples: Iterable[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], Optional[datetime]]:
+    """
+    Versión por lotes de parsear_fecha_carpeta: recibe muchos (día, mes, año) y
+    devuelve un dict {triple: fecha}, parseando una sola vez cada triple distinto.
+    """
+    fechas: Dict[Tuple[str, str, str], Optional[datetime]] = {}
+    for triple in triples:
+        if triple not in fechas:
+            fechas[triple] = parsear_fecha_carpeta(*triple)
+    return fechas
+
+
+# --- Modo por lotes (línea de comandos, sin GUI) ---
+
+_TIPOS_CLI = {
+    "año": TIPO_ANIO, "anio": TIPO_ANIO, "ano": TIPO_ANIO,
+    "mes": TIPO_MES,
+    "semana": TIPO_SEMANA,
+    "día": TIPO_DIA, "dia": TIPO_DIA,
+}
+
+
+COMANDOS_CLI = ("report", "diff")  # Subcomandos de _parser_cli (sin GUI)
+
+
+def _tipo_cli(valor: str) -> str:
+    tipo = _TIPOS_CLI.get(valor.strip().lower())
+    if tipo is None:
+        raise argparse.ArgumentTypeError(f"tipo inválido: {valor} (usa Año, Mes, Semana o Día)")
+    return tipo
+
+
+def _fecha_cli(valor: str) -> datetime:
+    try:
+        return datetime.strptime(valor, "%d/%m/%Y")
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"fecha inválida: {valor} (usa DD/MM/YYYY)") from exc
+
+
+def _parser_cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="generador_facturas_cotu.py",
+                                     description="Generador de Reportes COTU en modo por lotes (sin GUI).")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    rep = sub.add_parser(COMANDOS_CLI[0], help="Genera un reporte CSV, Excel, Parquet o Feather")
+    _argumentos_periodo(rep)
+    rep.add_argument("--formato", choices=["csv", "xlsx", "parquet", "feather"], default="xlsx",
+                     help="parquet y feather requieren pyarrow")
+    rep.add_argument("--resumido", action="store_true", help="Solo FECHA, COTU y ASEGURADORA")
+    rep.add_argument("--hojas-por-mes", action="store_true",
+                     help="xlsx con hoja RESUMEN y una hoja por mes")
+    rep.add_argument("--hojas-por-aseguradora", action="store_true",
+                     help="xlsx con hoja RESUMEN y una hoja por aseguradora")
+    _argumentos_escaneo(rep)
+    dif = sub.add_parser(COMANDOS_CLI[1], help="Excel con las facturas nuevas, eliminadas y movidas respecto a "
+                                               "un Parquet/Feather exportado antes")
+    _argumentos_periodo(dif)
+    base = dif.add_mutually_exclusive_group(required=True)
+    base.add_argument("--contra", help="Parquet/Feather exportado antes (p. ej. al cierre de mes) con el que comparar")
+    base.add_argument("--periodo-anterior", action="store_true",
+                      help="Listado periodo a periodo frente al periodo anterior (no indica altas ni bajas)")
+    _argumentos_escaneo(dif)
+    return parser
+
+
+def _argumentos_periodo(parser: argparse.ArgumentParser):
+    parser.add_argument("--ruta", default=os.getcwd(), help="Carpeta del año (o carpeta padre). Por defecto, la actual.")
+    parser.add_argument("--tipo", type=_tipo_cli, default=TIPO_ANIO, help="Año, Mes, Semana o Día")
+    parser.add_argument("--desde", type=_fecha_cli, help="Fecha de inicio DD/MM/YYYY (Mes, Semana y Día)")
+    parser.add_argument("--hasta", type=_fecha_cli, help="Fecha de fin DD/MM/YYYY (Mes y Semana)")
+
+
+def _argumentos_escaneo(parser: argparse.ArgumentParser):
+    parser.add_argument("--todas-las-carpetas", action="store_true",
+                        help="Incluir carpetas que no empiezan por COTU")
+    parser.add_argument("--salida", help="Carpeta donde guardar el archivo (por defecto, la carpeta del año)")
+    parser.add_argument("--indice", help="Ruta de un índice de escaneo SQLite a usar/actualizar")
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    """
+    Punto de entrada del modo por lotes: `generador_facturas_cotu.py report --tipo Mes --desde ... --hasta ...`
+    (o `diff` con las mismas opciones de periodo, ver generar_diferencias).
+    No importa tkinter ni ttkbootstrap. Devuelve el código de salida (0 = reporte generado).
+    """
+    parser = _parser_cli()
+    args = parser.parse_args(argv)
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    fecha_inicio, fecha_fin = args.desde, args.hasta
+    if args.tipo == TIPO_ANIO:
+        fecha_inicio = fecha_fin = None
+    else:
+        if fecha_inicio is None:
+            parser.error("--desde es obligatorio para reportes de Mes, Semana y Día")
+        if args.tipo == TIPO_DIA:
+            fecha_fin = fecha_inicio
+        elif fecha_fin is None:
+            parser.error("--hasta es obligatorio para reportes de Mes y Semana")
+        elif fecha_fin < fecha_inicio:
+            parser.error("--hasta debe ser posterior o igual a --desde")
+
+    opciones: Dict[str, Any] = {"solo_cotu": not args.todas_las_carpetas}
+    if args.indice:
+        opciones["indice"] = IndiceEscaneo(args.indice)
+    if args.comando == "diff":
+        if args.tipo == TIPO_ANIO and not args.contra:
+            parser.error("--periodo-anterior no se aplica a un Año completo: usa --contra")
+        return _diff_cli(args, fecha_inicio, fecha_fin, opciones)
+
+    agrupar = [c for c, activo in ((COL_MES, args.hojas_por_mes), (COL_COMPANIA, args.hojas_por_aseguradora)) if activo]
+    if agrupar and args.formato != "xlsx":
+        parser.error("--hojas-por-mes y --hojas-por-aseguradora solo se aplican a --formato xlsx")
+
+    medicion = MedicionRendimiento("Lote " + args.formato)
+    try:
+        ruta, total = generar_reporte(args.ruta, args.tipo, fecha_inicio, fecha_fin, args.formato,
+                                      args.resumido, args.salida, medicion=medicion, agrupar=agrupar, **opciones)
+    except Exception as e:
+        _log.error("Error al generar reporte: %s", e)
+        medicion.terminar("error").registrar()
+        return 1
+    medicion.facturas = total
+    medicion.terminar().registrar()
+    if not ruta:
+        _log.warning("No se encontraron facturas con los criterios seleccionados")
+        return 1
+    _log.info("Reporte generado: %s (%s facturas)", ruta, total)
+    print(ruta)
+    return 0
+
+
+def _diff_cli(args: argparse.Namespace, fecha_inicio: Optional[datetime], fecha_fin: Optional[datetime],
+              opciones: Dict[str, Any]) -> int:
+    medicion = MedicionRendimiento("Lote diferencias")
+    try:
+        ruta, diferencia = generar_diferencias(args.ruta, args.tipo, fecha_inicio, fecha_fin, args.contra,
+                                               args.salida, medicion=medicion, **opciones)
+    except Exception as e:
+        _log.error("Error al comparar periodos: %s", e)
+        medicion.terminar("error").registrar()
+        return 1
+    medicion.terminar().registrar()
+    if not ruta:
+        _log.warning("No se encontraron facturas en ninguno de los dos periodos")
+        return 1
+    _log.info("Diferencias: %s (%s)", ruta, diferencia.texto().replace("\n", ", "))
+    print(ruta)
+    return 0
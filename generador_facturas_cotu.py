@@ -5,45 +5,37 @@ Aplicación unificada para generar reportes diarios, semanales, mensuales y anua
 
 __version__ = "2.1.0"
 
+import sys
+import time
+
+# Referencia para medir el tiempo de arranque (importaciones + construcción de la ventana)
+_T_INICIO = time.perf_counter()
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # Modo por lotes (tareas programadas): se resuelve antes de importar tkinter/ttkbootstrap
+    from cotu_logic import COMANDOS_CLI, configurar_logging, main_cli
+    if sys.argv[1] in COMANDOS_CLI:
+        configurar_logging()
+        sys.exit(main_cli(sys.argv[1:]))
+
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox as tk_messagebox
 import ttkbootstrap as ttk
 from ttkbootstrap.dialogs import Messagebox
-from ttkbootstrap.widgets import ToastNotification
 import os
-import sys
 import subprocess
 import threading
-import pandas as pd
 from datetime import datetime
-from pathlib import Path
-import re
 import json
 import logging
 from typing import List, Dict, Optional, Any
 
-_log = logging.getLogger("GeneradorCOTU")
-
+# pandas y los motores de Excel se importan en cotu_logic solo al generar un reporte
+import cotu_logic
 
-def _configurar_logging():
-    """Configura logging a consola y, si es posible, a archivo en APPDATA/GeneradorCOTU."""
-    if any(isinstance(h, logging.FileHandler) for h in _log.handlers):
-        return
-    _log.setLevel(logging.INFO)
-    try:
-        log_dir = os.path.join(
-            os.environ.get("APPDATA") or os.environ.get("HOME") or os.path.dirname(os.path.abspath(__file__)),
-            "GeneradorCOTU",
-        )
-        os.makedirs(log_dir, exist_ok=True)
-        log_file = os.path.join(log_dir, "generador_cotu.log")
-        fh = logging.FileHandler(log_file, encoding="utf-8")
-        fh.setLevel(logging.INFO)
-        fh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
-        _log.addHandler(fh)
-    except OSError:
-        pass
+_log = logging.getLogger("GeneradorCOTU")
+_MS_IMPORTACIONES = (time.perf_counter() - _T_INICIO) * 1000
 
 
 def _es_ruta_sistema(ruta: str) -> bool:
@@ -71,8 +63,6 @@ def _es_ruta_sistema(ruta: str) -> bool:
     return False
 
 
-_configurar_logging()
-
 
 def _tooltip(widget, texto, get_colors=None):
     """Tooltip minimalista. Si get_colors es un callable que devuelve dict con 'bg' y 'text', el tooltip usa esos colores (tema oscuro/claro)."""
@@ -108,6 +98,116 @@ def _tooltip(widget, texto, get_colors=None):
     widget.bind("<Leave>", _hide)
 
 
+class TablaVirtual:
+    """
+    Treeview virtualizado: conserva la lista completa de registros pero solo crea filas
+    para la ventana visible; al desplazarse se reescriben los valores de esas filas.
+    La selección se guarda por registro (no por fila) y se vuelve a aplicar al desplazarse.
+    """
+
+    ALTO_FILA_DEFECTO = 20
+    ALTO_CABECERA = 25
+
+    def __init__(self, parent, columnas: List[str], ancho_columna: int = 120):
+        self.columnas = columnas
+        self.frame = ttk.Frame(parent)
+        self.scrollbar = ttk.Scrollbar(self.frame, command=self._al_desplazar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree = ttk.Treeview(self.frame, columns=columnas, show='headings')
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        for col in columnas:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=ancho_columna)
+        self._datos: List[Dict[str, Any]] = []
+        self._inicio = 0
+        self._filas_visibles = 1
+        self._items: List[str] = []  # Filas reutilizadas del Treeview (una por fila visible)
+        self._seleccion: set = set()  # Índices en _datos de los registros seleccionados
+        try:
+            self._alto_fila = int(ttk.Style().lookup("Treeview", "rowheight") or self.ALTO_FILA_DEFECTO)
+        except (TypeError, ValueError, tk.TclError):
+            self._alto_fila = self.ALTO_FILA_DEFECTO
+        self.tree.bind("<Configure>", self._al_redimensionar)
+        self.tree.bind("<<TreeviewSelect>>", self._al_seleccionar)
+        self.tree.bind("<MouseWheel>", self._al_rueda)
+        self.tree.bind("<Button-4>", lambda e: self.desplazar(-3))
+        self.tree.bind("<Button-5>", lambda e: self.desplazar(3))
+        self.tree.bind("<Prior>", lambda e: self.desplazar(-self._filas_visibles))
+        self.tree.bind("<Next>", lambda e: self.desplazar(self._filas_visibles))
+        self.tree.bind("<Home>", lambda e: self.ir_a(0))
+        self.tree.bind("<End>", lambda e: self.ir_a(len(self._datos)))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def establecer_datos(self, datos: List[Dict[str, Any]]):
+        """Muestra `datos` (sin copiarlos) desde la primera fila."""
+        self._datos = datos
+        self._inicio = 0
+        self._seleccion.clear()
+        self._render()
+
+    def seleccionados(self) -> List[Dict[str, Any]]:
+        """Registros seleccionados, en el orden de la tabla (también los que no están a la vista)."""
+        return [self._datos[i] for i in sorted(self._seleccion)]
+
+    @staticmethod
+    def acotar_inicio(inicio: int, filas_visibles: int, total: int) -> int:
+        """Primera fila válida para una ventana de `filas_visibles` sobre `total` filas."""
+        return max(0, min(inicio, total - filas_visibles))
+
+    def ir_a(self, inicio: int):
+        self._inicio = self.acotar_inicio(inicio, self._filas_visibles, len(self._datos))
+        self._render()
+
+    def desplazar(self, filas: int):
+        self.ir_a(self._inicio + filas)
+
+    def _al_desplazar(self, accion, valor, unidad=None):
+        """Comando de la barra de desplazamiento (moveto/scroll)."""
+        if accion == tk.MOVETO:
+            self.ir_a(int(float(valor) * len(self._datos)))
+        elif accion == tk.SCROLL:
+            paso = self._filas_visibles if unidad == tk.PAGES else 1
+            self.desplazar(int(valor) * paso)
+
+    def _al_rueda(self, event):
+        self.desplazar(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def _al_seleccionar(self, event=None):
+        """Traduce la selección de las filas visibles a índices de registro."""
+        elegidos = set(self.tree.selection())
+        self._seleccion.difference_update(range(self._inicio, self._inicio + len(self._items)))
+        self._seleccion.update(self._inicio + i for i, item in enumerate(self._items) if item in elegidos)
+
+    def _al_redimensionar(self, event):
+        filas = max(1, (event.height - self.ALTO_CABECERA) // self._alto_fila)
+        if filas != self._filas_visibles:
+            self._filas_visibles = filas
+            self.ir_a(self._inicio)
+
+    def _render(self):
+        total = len(self._datos)
+        fin = min(self._inicio + self._filas_visibles, total)
+        necesarias = fin - self._inicio
+        while len(self._items) > necesarias:
+            self.tree.delete(self._items.pop())
+        for i, idx in enumerate(range(self._inicio, fin)):
+            registro = self._datos[idx]
+            valores = [registro.get(col, "") for col in self.columnas]
+            if i < len(self._items):
+                self.tree.item(self._items[i], values=valores)
+            else:
+                self._items.append(self.tree.insert("", tk.END, values=valores))
+        # Las filas muestran otros registros: seleccionar las que ahora muestran uno seleccionado
+        self.tree.selection_set([item for i, item in enumerate(self._items) if self._inicio + i in self._seleccion])
+        if total:
+            self.scrollbar.set(self._inicio / total, fin / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+
 
 class GeneradorFacturasCOTU:
     # --- iOS-inspired Design System ---
@@ -140,17 +240,18 @@ class GeneradorFacturasCOTU:
     }
 
     # Constantes Lógicas
-    TIPO_ANIO = "Año"
-    TIPO_MES = "Mes"
-    TIPO_SEMANA = "Semana"
-    TIPO_DIA = "Día"
+    ESPERA_BUSQUEDA_MS = 250  # Pausa al escribir antes de buscar en la vista previa
+    TIPO_ANIO = cotu_logic.TIPO_ANIO
+    TIPO_MES = cotu_logic.TIPO_MES
+    TIPO_SEMANA = cotu_logic.TIPO_SEMANA
+    TIPO_DIA = cotu_logic.TIPO_DIA
     
-    COL_ANIO = "AÑO"
-    COL_MES = "MES"
-    COL_FECHA = "FECHA DE LA FACTURA"
-    COL_FACTURA = "N° FACTURA"
-    COL_DETALLE = "DETALLE COMPLETO"
-    COL_COMPANIA = "COMPAÑÍA"
+    COL_ANIO = cotu_logic.COL_ANIO
+    COL_MES = cotu_logic.COL_MES
+    COL_FECHA = cotu_logic.COL_FECHA
+    COL_FACTURA = cotu_logic.COL_FACTURA
+    COL_DETALLE = cotu_logic.COL_DETALLE
+    COL_COMPANIA = cotu_logic.COL_COMPANIA
 
     def __init__(self, root: ttk.Window):
         self.root = root
@@ -166,9 +267,23 @@ class GeneradorFacturasCOTU:
         appdata = os.environ.get("APPDATA") or os.environ.get("HOME") or script_dir
         self._historial_dir = os.path.join(appdata, "GeneradorCOTU")
         os.makedirs(self._historial_dir, exist_ok=True)
-        self.historial_file = os.path.join(self._historial_dir, "historial_reportes.json")
+        self.historial_file = os.path.join(self._historial_dir, "historial_reportes.json")  # Formato anterior (se importa)
         self._lock_config = threading.Lock()
-        self._lock_historial = threading.RLock()  # RLock: guardar_historial llama a cargar_historial con lock ya tomado
+        # config.json se escribe en segundo plano, agrupando cambios seguidos (tema, opciones...)
+        self._guardado_config = cotu_logic.GuardadoDiferido(
+            self.config_file, al_fallar=lambda e: self.root.after(0, self._avisar_error_config)
+        )
+        # Historial en SQLite: guardar es un INSERT, la lista se lee por páginas desde memoria
+        self._historial = cotu_logic.HistorialReportes(
+            os.path.join(self._historial_dir, "historial_reportes.sqlite"), self.historial_file
+        )
+        self._historial_mostradas = 0
+        # Índice de escaneo: evita volver a listar carpetas de red que no cambiaron
+        self._indice = cotu_logic.IndiceEscaneo(os.path.join(self._historial_dir, "indice_escaneo.sqlite"))
+        self._cancelaciones = set()  # Tokens de las operaciones en curso (botón Cancelar)
+        self._ejecutor = cotu_logic.EjecutorTrabajos()  # Escaneos de uno en uno; peticiones idénticas se unen
+        self._cache_resultados = cotu_logic.CacheResultados()  # Vista previa -> Excel -> CSV sin volver a escanear
+        self._mediciones: Dict[str, cotu_logic.MedicionRendimiento] = {}  # Última medición por operación (panel Rendimiento)
         
         self._cargar_config()
         
@@ -186,6 +301,10 @@ class GeneradorFacturasCOTU:
         self.fecha_fin = tk.StringVar()
         self.formato_resumido = tk.BooleanVar(value=getattr(self, "_formato_resumido", False))
         self.solo_carpetas_cotu = tk.BooleanVar(value=getattr(self, "_solo_carpetas_cotu", True))
+        self.usar_indice = tk.BooleanVar(value=getattr(self, "_usar_indice", True))
+        self.libro_por_mes = tk.BooleanVar(value=getattr(self, "_libro_por_mes", False))
+        self.libro_por_compania = tk.BooleanVar(value=getattr(self, "_libro_por_compania", False))
+        self.texto_rendimiento = tk.StringVar(value="Sin mediciones todavía: genera una vista previa, un Excel o un CSV.")
         
         # Variables para vista previa
         self.registros_preview = []
@@ -208,6 +327,7 @@ class GeneradorFacturasCOTU:
         
         # Aplicar Tema Global
         self._apply_theme()
+        self.root.protocol("WM_DELETE_WINDOW", self._al_cerrar)
 
     def _apply_theme(self):
         """Aplica tema iOS-inspired: tipografía clara, jerarquía marcada, mucho espacio en blanco"""
@@ -281,33 +401,48 @@ class GeneradorFacturasCOTU:
                     self.tema_oscuro = cfg.get("tema_oscuro", False)
                     self._formato_resumido = cfg.get("formato_resumido", False)
                     self._solo_carpetas_cotu = cfg.get("solo_carpetas_cotu", True)
+                    self._usar_indice = cfg.get("usar_indice_escaneo", True)
+                    self._libro_por_mes = cfg.get("libro_por_mes", False)
+                    self._libro_por_compania = cfg.get("libro_por_compania", False)
                 else:
                     self._ultima_carpeta = ""
                     self._formato_resumido = False
                     self._solo_carpetas_cotu = True
-            except (OSError, json.JSONDecodeError, ValueError):
+                    self._usar_indice = True
+            except (OSError, json.JSONDecodeError, ValueError) as e:
+                _log.warning("No se pudo leer la configuración (%s); se usan los valores por defecto", e)
                 self._ultima_carpeta = ""
                 self._formato_resumido = False
                 self._solo_carpetas_cotu = True
+                self._usar_indice = True
     
     def _guardar_config(self):
-        """Guarda última carpeta, tema y formato en config.json"""
-        with self._lock_config:
-            try:
-                cfg = {
-                    "ultima_carpeta": self.ruta_base.get() or getattr(self, "_ultima_carpeta", ""),
-                    "tema_oscuro": self.tema_oscuro,
-                    "formato_resumido": self.formato_resumido.get(),
-                    "solo_carpetas_cotu": self.solo_carpetas_cotu.get(),
-                }
-                with open(self.config_file, 'w', encoding='utf-8') as f:
-                    json.dump(cfg, f, indent=2, ensure_ascii=False)
-            except (OSError, TypeError, ValueError) as e:
-                _log.warning("No se pudo guardar la configuración: %s", e)
-                Messagebox.show_warning(
-                    "No se pudo guardar la configuración. Si el archivo está en uso por otro programa, ciérrelo e intente de nuevo.",
-                    "Guardado",
-                )
+        """
+        Programa el guardado de última carpeta, tema y formato en config.json. No espera
+        al disco: la escritura (atómica) se hace en segundo plano tras una breve pausa sin cambios.
+        """
+        cfg = {
+            "ultima_carpeta": self.ruta_base.get() or getattr(self, "_ultima_carpeta", ""),
+            "tema_oscuro": self.tema_oscuro,
+            "formato_resumido": self.formato_resumido.get(),
+            "solo_carpetas_cotu": self.solo_carpetas_cotu.get(),
+            "usar_indice_escaneo": self.usar_indice.get(),
+            "libro_por_mes": self.libro_por_mes.get(),
+            "libro_por_compania": self.libro_por_compania.get(),
+        }
+        self._guardado_config.programar(cfg)
+
+    def _avisar_error_config(self):
+        """Aviso (hilo principal) cuando el guardado en segundo plano de config.json falló."""
+        Messagebox.show_warning(
+            "No se pudo guardar la configuración. Si el archivo está en uso por otro programa, ciérrelo e intente de nuevo.",
+            "Guardado",
+        )
+
+    def _al_cerrar(self):
+        """Escribe la configuración pendiente antes de cerrar la ventana."""
+        self._guardado_config.vaciar()
+        self.root.destroy()
     
     def _mostrar_estructura_esperada(self):
         """Muestra ventana con la estructura de carpetas que el programa espera."""
@@ -484,6 +619,35 @@ Ejemplo PC casa (también válido):
             bootstyle="link"
         )
         self.btn_csv.pack(side=tk.LEFT)
+        self.btn_parquet = ttk.Button(
+            self.action_area,
+            text="Parquet",
+            command=self.exportar_parquet,
+            bootstyle="link"
+        )
+        self.btn_parquet.pack(side=tk.LEFT)
+        self.btn_abrir_columnar = ttk.Button(
+            self.action_area,
+            text="Abrir Parquet…",
+            command=self.abrir_columnar,
+            bootstyle="link"
+        )
+        self.btn_abrir_columnar.pack(side=tk.LEFT)
+        self.btn_comparar = ttk.Button(
+            self.action_area,
+            text="Comparar",
+            command=self.comparar_con_archivo,
+            bootstyle="link"
+        )
+        self.btn_comparar.pack(side=tk.LEFT)
+        self.btn_cancelar = ttk.Button(
+            self.action_area,
+            text="Cancelar",
+            command=self.cancelar_operacion,
+            bootstyle="danger-link",
+            state="disabled"
+        )
+        self.btn_cancelar.pack(side=tk.LEFT, padx=8)
         self.progress = ttk.Progressbar(main_frame, mode='indeterminate', bootstyle="success")
         self.progress.pack(fill=tk.X, side=tk.BOTTOM, pady=(0, 16))
         self.status_label = ttk.Label(main_frame, text="Listo", style="Caption.TLabel")
@@ -494,6 +658,10 @@ Ejemplo PC casa (también válido):
         _tooltip(self.btn_preview, "Ver facturas encontradas antes de generar el Excel")
         _tooltip(self.btn_generar, "Generar archivo Excel con las facturas COTU")
         _tooltip(self.btn_csv, "Exportar el mismo conjunto de datos como CSV")
+        _tooltip(self.btn_parquet, "Exportar como Parquet (fechas y aseguradoras tipadas; requiere pyarrow)")
+        _tooltip(self.btn_abrir_columnar, "Abrir un Parquet o Feather exportado y ver su vista previa sin escanear carpetas")
+        _tooltip(self.btn_comparar, "Excel con las facturas nuevas, eliminadas y movidas respecto a un Parquet exportado antes (p. ej. al cierre de mes)")
+        _tooltip(self.btn_cancelar, "Detener el escaneo o la exportación en curso (Esc)")
         
         # Atajos de teclado
         self.root.bind("<Control-o>", lambda e: self.seleccionar_carpeta())
@@ -501,6 +669,7 @@ Ejemplo PC casa (también válido):
         self.root.bind("<Control-p>", lambda e: self.mostrar_vista_previa())
         self.root.bind("<Control-h>", lambda e: self.show_page('historial'))
         self.root.bind("<Control-a>", lambda e: self.show_page('config'))
+        self.root.bind("<Escape>", lambda e: self.cancelar_operacion())
 
         # Inicializar estado visual de cards
         self._update_card_visuals()
@@ -690,27 +859,45 @@ Ejemplo PC casa (también válido):
         self.btn_csv.configure(state="disabled")
 
         # Lanzar hilo Thread
-        threading.Thread(target=self._ejecutar_vista_previa_background, args=(params,), daemon=True).start()
+        self._lanzar_cancelable(self._ejecutar_vista_previa_background, params, "Vista previa")
 
     def _ejecutar_vista_previa_background(self, params):
         """Ejecuta la extracción de datos en segundo plano"""
         _log.info("Hilo de vista previa iniciado")
+        medicion = params["medicion"]
         try:
-            registros = self.extraer_facturas(params["ruta_base"], params["fecha_inicio"], params["fecha_fin"])
+            registros = self._obtener_registros(params)
+            medicion.facturas = len(registros)
             _log.info(f"Extracción completada: {len(registros)} facturas encontrados")
-            
-            if params["tipo"] != self.TIPO_ANIO:
-                registros = self.filtrar_por_tipo(registros, params["tipo"], params["fecha_inicio_str"], params["fecha_fin_str"])
+            # Claves de búsqueda y resumen (estadísticas/duplicados) listos fuera del hilo de la interfaz
+            with medicion.fase("indice_busqueda"):
+                indice = cotu_logic.IndiceBusqueda(registros)
+                indice.preparar()
+                cotu_logic.resumen_de(registros)
             
             # Éxito: Enviar registros
-            self.root.after(0, lambda: self._on_vista_previa_ready(registros, None))
+            self.root.after(0, lambda: self._on_vista_previa_ready(registros, None, indice))
             
+        except cotu_logic.Cancelado as e:
+            # Conservar lo encontrado hasta cancelar por si el usuario quiere verlo
+            parciales = e.registros
+            if parciales and params["tipo"] != self.TIPO_ANIO:
+                parciales = self.filtrar_por_tipo(parciales, params["tipo"], params["fecha_inicio_str"], params["fecha_fin_str"])
+            # Igual que en el caso normal: claves de búsqueda y resumen fuera del hilo de la interfaz
+            with medicion.fase("indice_busqueda"):
+                indice = cotu_logic.IndiceBusqueda(parciales)
+                indice.preparar()
+                cotu_logic.resumen_de(parciales)
+            medicion.estado, medicion.facturas = "cancelado", len(parciales)
+            _log.info("Vista previa cancelada (%d facturas parciales)", len(parciales))
+            self.root.after(0, lambda: self._on_vista_previa_cancelada(parciales, indice))
         except Exception as e:
+            medicion.estado = "error"
             _log.exception("Error en hilo de vista previa")
             # Error: Enviar excepción
             self.root.after(0, lambda: self._on_vista_previa_ready(None, str(e)))
 
-    def _on_vista_previa_ready(self, registros, error):
+    def _on_vista_previa_ready(self, registros, error, indice=None):
         """Maneja los resultados en el hilo principal"""
         _log.info("_on_vista_previa_ready llamado en Main Thread")
         
@@ -734,9 +921,18 @@ Ejemplo PC casa (también válido):
 
         # Construir ventana
         _log.info("Llamando a _construir_ventana_preview")
-        self._construir_ventana_preview(registros)
-
-    def _construir_ventana_preview(self, registros):
+        self._construir_ventana_preview(registros, indice)
+
+    def _on_vista_previa_cancelada(self, parciales, indice: Optional[cotu_logic.IndiceBusqueda] = None):
+        """Vista previa cancelada: restaura botones y ofrece ver las facturas encontradas hasta entonces."""
+        self._al_cancelar(self.btn_preview, self.btn_generar, self.btn_csv)
+        if parciales and tk_messagebox.askyesno(
+            "Vista previa cancelada",
+            f"Se encontraron {len(parciales)} facturas antes de cancelar.\n\n¿Mostrarlas en la vista previa?",
+        ):
+            self._construir_ventana_preview(parciales, indice)
+
+    def _construir_ventana_preview(self, registros, indice: Optional[cotu_logic.IndiceBusqueda] = None):
         """Construye y muestra la ventana de resultados"""
         _log.info("Construyendo ventana de preview...")
         try:
@@ -755,48 +951,33 @@ Ejemplo PC casa (también válido):
             entry_busqueda = ttk.Entry(busqueda_frame, textvariable=var_busqueda, width=40)
             entry_busqueda.pack(side=tk.LEFT, fill=tk.X, expand=True)
             
-            # Frame con scrollbar
-            frame_scroll = ttk.Frame(ventana_preview)
-            frame_scroll.pack(fill=tk.BOTH, expand=True, padx=16, pady=8)
-            
-            scrollbar = ttk.Scrollbar(frame_scroll)
-            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-            
-            # Treeview para mostrar datos
+            # Tabla virtualizada: todos los registros, solo se dibujan las filas visibles
             columnas = [self.COL_ANIO, self.COL_MES, self.COL_FECHA, self.COL_FACTURA, self.COL_DETALLE, self.COL_COMPANIA]
-            tree = ttk.Treeview(frame_scroll, yscrollcommand=scrollbar.set, show='headings')
-            tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-            scrollbar.config(command=tree.yview)
-            
-            tree['columns'] = columnas
-            for col in columnas:
-                tree.heading(col, text=col)
-                tree.column(col, width=120)
-            
-            # Insertar datos (guardar para filtrado)
-            listado_preview = list(registros[:100])
-            
-            def _refiltrar(*_args):
-                texto = var_busqueda.get().strip().upper()
-                for i in tree.get_children():
-                    tree.delete(i)
-                for registro in listado_preview:
-                    if not texto or any(texto in str(registro.get(c, "")).upper() for c in columnas):
-                        valores = [registro.get(col, "") for col in columnas]
-                        tree.insert("", tk.END, values=valores)
-            
-            for registro in listado_preview:
-                valores = [registro.get(col, "") for col in columnas]
-                tree.insert("", tk.END, values=valores)
+            tabla = TablaVirtual(ventana_preview, columnas)
+            tabla.pack(fill=tk.BOTH, expand=True, padx=16, pady=8)
+            tabla.establecer_datos(registros)
+            total = len(registros)
+            if indice is None:
+                indice = cotu_logic.IndiceBusqueda(registros, columnas)
+            busqueda_pendiente = [None]
+
+            def _refiltrar():
+                busqueda_pendiente[0] = None
+                texto = var_busqueda.get()
+                filtrados = indice.buscar(texto)
+                tabla.establecer_datos(filtrados)
+                info_label.config(text=f"Mostrando {len(filtrados)} de {total} facturas." if texto.strip()
+                                  else f"Total: {total} facturas. Escribe arriba para filtrar.")
+
+            def _programar_busqueda(*_args):
+                # Debounce: se busca cuando el usuario deja de escribir
+                if busqueda_pendiente[0] is not None:
+                    ventana_preview.after_cancel(busqueda_pendiente[0])
+                busqueda_pendiente[0] = ventana_preview.after(self.ESPERA_BUSQUEDA_MS, _refiltrar)
             
-            var_busqueda.trace_add("write", _refiltrar)
+            var_busqueda.trace_add("write", _programar_busqueda)
             
-            # Información (si hay más de 100, indicar "Mostrando hasta 100 de N")
-            total = len(registros)
-            if total > 100:
-                texto_info = f"Mostrando hasta 100 de {total} facturas. Escribe arriba para filtrar."
-            else:
-                texto_info = f"Total: {total} facturas. Escribe arriba para filtrar."
+            texto_info = f"Total: {total} facturas. Escribe arriba para filtrar."
             info_label = ttk.Label(
                 ventana_preview,
                 text=texto_info,
@@ -858,7 +1039,7 @@ Ejemplo PC casa (también válido):
         self.tree_historial = ttk.Treeview(frame_scroll, yscrollcommand=scrollbar.set, show='headings', height=16)
         self.tree_historial.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.config(command=self.tree_historial.yview)
-        columnas = ["Fecha", "Tipo", "Archivo", "Ruta", "Facturas"]
+        columnas = ["Fecha", "Tipo", "Archivo", "Ruta", "Facturas", "Duración"]
         self.tree_historial['columns'] = columnas
         for col in columnas:
             self.tree_historial.heading(col, text=col)
@@ -875,32 +1056,44 @@ Ejemplo PC casa (también válido):
                         self._abrir_carpeta(ruta)
         self.tree_historial.bind("<Double-1>", _al_doble_clic)
         ttk.Label(parent, text="Doble clic en una fila para abrir la carpeta", style="Caption.TLabel").pack(pady=(12, 0))
-        ttk.Button(parent, text="Actualizar Lista", command=self.actualizar_lista_historial, bootstyle="secondary-outline").pack(pady=20)
+        botones_historial = ttk.Frame(parent)
+        botones_historial.pack(pady=20)
+        ttk.Button(botones_historial, text="Actualizar Lista", command=self.actualizar_lista_historial, bootstyle="secondary-outline").pack(side=tk.LEFT, padx=(0, 8))
+        self.btn_historial_mas = ttk.Button(botones_historial, text="Cargar más", command=self._cargar_mas_historial, bootstyle="link")
+        self.btn_historial_mas.pack(side=tk.LEFT)
         self.actualizar_lista_historial()
 
     def actualizar_lista_historial(self):
-        """Recarga el treeview del historial"""
+        """Recarga el treeview del historial (primera página, lo más reciente arriba)"""
         if not hasattr(self, 'tree_historial'):
             return
             
         # Limpiar
         for i in self.tree_historial.get_children():
             self.tree_historial.delete(i)
-            
-        historial = self.cargar_historial()
-        if not historial:
-            return
+        self._historial_mostradas = 0
+        self._cargar_mas_historial()
 
+    def _cargar_mas_historial(self):
+        """Añade al final del treeview la siguiente página del historial."""
+        if not hasattr(self, 'tree_historial'):
+            return
+        historial = self.cargar_historial(self._historial_mostradas)
         for item in historial:
-            ruta_completa = item.get("ruta", "")
+            ruta_completa = item.get("ruta") or ""
+            duracion = item.get("duracion_s")
             valores = [
-                item.get("fecha", ""),
-                item.get("tipo", ""),
-                item.get("archivo", ""),
+                item.get("fecha") or "",
+                item.get("tipo") or "",
+                item.get("archivo") or "",
                 ruta_completa[:50] + "..." if len(ruta_completa) > 50 else ruta_completa,
-                str(item.get("total_facturas", 0))
+                str(item.get("total_facturas") or 0),
+                f"{duracion:.1f} s" if duracion is not None else "",
             ]
             self.tree_historial.insert("", tk.END, values=valores, tags=(ruta_completa,))
+        self._historial_mostradas += len(historial)
+        hay_mas = self._historial_mostradas < self._historial.total()
+        self.btn_historial_mas.configure(state="normal" if hay_mas else "disabled")
 
     def _crear_pagina_configuracion(self, parent):
         """Crea la página de configuración - listas claras, separaciones limpias, interruptores suaves"""
@@ -922,6 +1115,33 @@ Ejemplo PC casa (también válido):
             command=self._guardar_config,
             bootstyle="round-toggle"
         ).pack(anchor=tk.W, pady=10)
+        ttk.Checkbutton(
+            frame_general,
+            text="Excel con una hoja por mes (más hoja RESUMEN)",
+            variable=self.libro_por_mes,
+            command=self._guardar_config,
+            bootstyle="round-toggle"
+        ).pack(anchor=tk.W, pady=10)
+        ttk.Checkbutton(
+            frame_general,
+            text="Excel con una hoja por aseguradora (más hoja RESUMEN)",
+            variable=self.libro_por_compania,
+            command=self._guardar_config,
+            bootstyle="round-toggle"
+        ).pack(anchor=tk.W, pady=10)
+        ttk.Checkbutton(
+            frame_general,
+            text="Usar índice de escaneo (solo vuelve a leer carpetas modificadas)",
+            variable=self.usar_indice,
+            command=self._al_cambiar_usar_indice,
+            bootstyle="round-toggle"
+        ).pack(anchor=tk.W, pady=10)
+        ttk.Button(
+            frame_general,
+            text="Vaciar índice de escaneo",
+            command=self._vaciar_indice,
+            bootstyle="link"
+        ).pack(anchor=tk.W)
         ttk.Button(
             frame_general,
             text="Ver estructura de carpetas esperada",
@@ -947,7 +1167,38 @@ Ejemplo PC casa (también válido):
             self.btn_tema.config(text="Tema Claro")
         else:
             self.btn_tema.config(text="Tema Oscuro")
+        frame_rendimiento = ttk.Frame(parent, style="Card.TFrame", padding=28)
+        frame_rendimiento.pack(fill=tk.X, pady=(0, 24))
+        ttk.Label(frame_rendimiento, text="Rendimiento", style="CardSection.TLabel").pack(anchor=tk.W, pady=(0, 18))
+        ttk.Label(
+            frame_rendimiento,
+            textvariable=self.texto_rendimiento,
+            justify=tk.LEFT,
+            wraplength=760,
+        ).pack(anchor=tk.W)
     
+    def _registrar_medicion(self, medicion: cotu_logic.MedicionRendimiento):
+        """Cierra la medición, la escribe en el log y la muestra en el panel Rendimiento (desde cualquier hilo)."""
+        medicion.terminar()
+        medicion.registrar()
+        self.root.after(0, lambda: self._mostrar_medicion(medicion))
+
+    def _mostrar_medicion(self, medicion: cotu_logic.MedicionRendimiento):
+        """Actualiza el panel Rendimiento con la última medición de cada operación."""
+        self._mediciones[medicion.operacion] = medicion
+        self.texto_rendimiento.set("\n\n".join(m.texto() for m in self._mediciones.values()))
+    
+    def _al_cambiar_usar_indice(self):
+        """Activa/desactiva el índice de escaneo y guarda la preferencia."""
+        self._usar_indice = self.usar_indice.get()
+        self._guardar_config()
+
+    def _vaciar_indice(self):
+        """Borra el índice de escaneo y los resultados recientes; el próximo reporte recorrerá todas las carpetas."""
+        self._indice.vaciar()
+        self._cache_resultados.vaciar()
+        self.actualizar_status("Índice de escaneo vaciado", "blue")
+
     def toggle_tema(self):
         """Alterna entre tema oscuro y claro - modo oscuro con grises profundos (no negro puro)."""
         self.tema_oscuro = not self.tema_oscuro
@@ -961,40 +1212,17 @@ Ejemplo PC casa (también válido):
         self._apply_theme()
         self._guardar_config()
     
-    def guardar_historial(self, tipo, archivo, ruta, total_facturas):
-        """Guarda un registro en el historial"""
-        with self._lock_historial:
-            historial = self.cargar_historial()
-            nuevo_registro = {
-                "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "tipo": tipo,
-                "archivo": archivo,
-                "ruta": ruta,
-                "total_facturas": total_facturas
-            }
-            historial.insert(0, nuevo_registro)
-            if len(historial) > 50:
-                historial = historial[:50]
-            try:
-                with open(self.historial_file, 'w', encoding='utf-8') as f:
-                    json.dump(historial, f, indent=2, ensure_ascii=False)
-            except (OSError, TypeError, ValueError) as e:
-                _log.warning("No se pudo guardar el historial: %s", e)
-                Messagebox.show_warning(
-                    "No se pudo guardar el historial de reportes. Si el archivo está en uso, ciérrelo e intente de nuevo.",
-                    "Guardado",
-                )
+    def guardar_historial(self, tipo, archivo, ruta, total_facturas, duracion_s: Optional[float] = None, formato: str = "xlsx"):
+        """Añade un registro al historial (un INSERT, sin reescribir el historial)"""
+        if self._historial.agregar(tipo, archivo, ruta, total_facturas, duracion_s, formato) is None:
+            Messagebox.show_warning(
+                "No se pudo guardar el historial de reportes. Si el archivo está en uso, ciérrelo e intente de nuevo.",
+                "Guardado",
+            )
     
-    def cargar_historial(self):
-        """Carga el historial desde archivo"""
-        with self._lock_historial:
-            try:
-                if os.path.exists(self.historial_file):
-                    with open(self.historial_file, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-            except (OSError, json.JSONDecodeError, ValueError):
-                pass
-            return []
+    def cargar_historial(self, inicio: int = 0, cantidad: int = cotu_logic.TAMANO_PAGINA_HISTORIAL) -> List[Dict[str, Any]]:
+        """Una página del historial, de lo más reciente a lo más antiguo"""
+        return self._historial.pagina(inicio, cantidad)
     
     def _abrir_carpeta(self, carpeta):
         """Abre la carpeta en el explorador del sistema"""
@@ -1010,80 +1238,166 @@ Ejemplo PC casa (también válido):
         except (OSError, subprocess.SubprocessError):
             pass
 
+    def _lanzar_cancelable(self, destino, params: Dict[str, Any], operacion: str):
+        """
+        Ejecuta `destino(params)` en segundo plano con un token de cancelación nuevo en
+        params["cancelacion"] y una medición de fases en params["medicion"] (se registra al terminar).
+        """
+        token = cotu_logic.TokenCancelacion()
+        params["cancelacion"] = token
+        params["medicion"] = medicion = cotu_logic.MedicionRendimiento(operacion)
+        self._cancelaciones.add(token)
+        self.btn_cancelar.configure(state="normal")
+
+        def _ejecutar():
+            try:
+                destino(params)
+            except BaseException:
+                medicion.estado = "error"
+                raise
+            finally:
+                self._registrar_medicion(medicion)
+                self.root.after(0, lambda: self._liberar_cancelacion(token))
+
+        threading.Thread(target=_ejecutar, daemon=True).start()
+
+    def _liberar_cancelacion(self, token):
+        """Quita el token de la operación terminada; sin operaciones en curso se desactiva Cancelar."""
+        self._cancelaciones.discard(token)
+        if not self._cancelaciones:
+            self.btn_cancelar.configure(state="disabled")
+
+    def cancelar_operacion(self):
+        """Pide cancelar las operaciones en curso (escaneo, filtrado y escritura comprueban el token)."""
+        if not self._cancelaciones:
+            return
+        for token in list(self._cancelaciones):
+            token.cancelar()
+        self.actualizar_status("Cancelando...", "red")
+
+    def _al_cancelar(self, *botones):
+        """Callback en hilo principal cuando una operación terminó por cancelación."""
+        self.progress.stop()
+        for boton in botones:
+            boton.config(state='normal')
+        self.actualizar_status("Operación cancelada", "text")
+
     def _obtener_ruta_salida(self, params: Dict[str, Any], extension: str) -> str:
         """Devuelve la ruta del archivo de salida (Excel o CSV) según tipo y fechas."""
-        ruta_base = params["ruta_base"]
-        tipo = params["tipo"]
-        nombre_anio = params["nombre_anio"]
-        fecha_inicio = params.get("fecha_inicio")
-        fecha_fin = params.get("fecha_fin")
-        ext = extension if extension.startswith(".") else "." + extension
-        if tipo == self.TIPO_ANIO:
-            if ext == ".csv":
-                nombre = f"cotus_{nombre_anio}.csv"
-            else:
-                nombre = f"cotus_{nombre_anio.lower().replace(' ', '_')}.xlsx"
-        elif tipo == self.TIPO_DIA and fecha_inicio:
-            nombre = f"cotus_dia_{fecha_inicio.strftime('%Y%m%d')}{ext}"
-        elif fecha_inicio and fecha_fin:
-            if ext == ".csv":
-                sufijo = tipo.lower().replace("á", "a").replace("í", "i")
-                nombre = f"cotus_{sufijo}_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}.csv"
-            else:
-                pref = "semana" if tipo == self.TIPO_SEMANA else "mes"
-                nombre = f"cotus_{pref}_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}.xlsx"
-        else:
-            nombre = f"cotus_{nombre_anio}{ext}"
-        return os.path.join(ruta_base, nombre)
+        nombre = cotu_logic.nombre_archivo_salida(
+            params["tipo"], params["nombre_anio"], params.get("fecha_inicio"), params.get("fecha_fin"), extension
+        )
+        return os.path.join(params["ruta_base"], nombre)
 
     def _ejecutar_csv(self, params):
-        """Ejecuta en segundo plano la extracción y exportación a CSV."""
+        """Ejecuta en segundo plano la extracción y exportación a CSV (fila a fila, en memoria constante)."""
         ruta_csv, total, error_msg = None, 0, None
+        medicion = params.get("medicion")
         try:
-            registros = self.extraer_facturas(params["ruta_base"], params["fecha_inicio"], params["fecha_fin"])
-            if params["tipo"] != self.TIPO_ANIO:
-                registros = self.filtrar_por_tipo(registros, params["tipo"], params["fecha_inicio_str"], params["fecha_fin_str"])
-            if not registros:
+            ruta_csv = self._obtener_ruta_salida(params, ".csv")
+            cancelacion = params.get("cancelacion")
+            clave = self._clave_escaneo(params)
+            registros = self._resultado_reciente(clave)
+            if registros is None and self._ejecutor.en_curso(clave):
+                # Escaneo idéntico en curso: esperar a su resultado (la caché ya se miró)
+                registros = self._obtener_registros(params, usar_cache=False)
+            if registros is not None:
+                with cotu_logic.medir_fase(medicion, "csv"):
+                    total = cotu_logic.exportar_csv(iter(registros), ruta_csv, params["formato_resumido"], cancelacion)
+            else:
+                # Escaneo y escritura en streaming, en la cola del ejecutor ("csv" mide solo la escritura)
+                def _escribir(token):
+                    with cotu_logic.medir_fase(medicion, "csv"):
+                        return cotu_logic.exportar_csv(
+                            self._iterar_facturas(params, token), ruta_csv, params["formato_resumido"], token
+                        )
+
+                # Clave propia: dos CSV iguales se unen, pero un Excel no espera un total de filas
+                clave_csv = ("csv", clave, params["formato_resumido"])
+                futuro = self._ejecutor.enviar(clave_csv, _escribir, cancelacion)
+                with cotu_logic.medir_fase(medicion, "espera"):
+                    total = cotu_logic.esperar_resultado(futuro, cancelacion)
+            if medicion is not None:
+                medicion.facturas = total
+            if not total:
                 res = (None, 0, "No se encontraron facturas con los criterios seleccionados")
-                self.root.after(0, lambda r=res: self._al_finalizar_csv(r))
+                self.root.after(0, lambda r=res: self._al_finalizar_csv(r, params))
                 return
-            df = pd.DataFrame(registros)
-            if params["formato_resumido"]:
-                df = df[[self.COL_FECHA, self.COL_FACTURA, self.COL_COMPANIA]].copy()
-                df = df.rename(columns={self.COL_FECHA: "FECHA", self.COL_FACTURA: "COTU", self.COL_COMPANIA: "ASEGURADORA"})
-            nombre_anio = params["nombre_anio"]
-            tipo, fecha_inicio, fecha_fin = params["tipo"], params["fecha_inicio"], params["fecha_fin"]
-            sufijo = tipo.lower().replace("á", "a").replace("í", "i")
-            if tipo == self.TIPO_ANIO:
-                nombre = f"cotus_{nombre_anio}.csv"
-            elif tipo == self.TIPO_DIA:
-                nombre = f"cotus_dia_{fecha_inicio.strftime('%Y%m%d')}.csv"
-            else:
-                nombre = f"cotus_{sufijo}_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}.csv"
-            ruta_csv = os.path.join(params["ruta_base"], nombre)
-            df.to_csv(ruta_csv, index=False, encoding="utf-8-sig")
-            _log.info("CSV exportado: %s (%s facturas)", ruta_csv, len(df))
-            res = (ruta_csv, len(df), None)
+            _log.info("CSV exportado: %s (%s facturas)", ruta_csv, total)
+            res = (ruta_csv, total, None)
+        except cotu_logic.Cancelado:
+            if medicion is not None:
+                medicion.estado = "cancelado"
+            _log.info("Exportación CSV cancelada")
+            self.root.after(0, lambda: self._al_cancelar(self.btn_csv))
+            return
         except Exception as e:
+            if medicion is not None:
+                medicion.estado = "error"
             _log.exception("Error al exportar CSV")
             res = (None, 0, str(e))
-        self.root.after(0, lambda r=res: self._al_finalizar_csv(r))
+        self.root.after(0, lambda r=res: self._al_finalizar_csv(r, params))
 
-    def _al_finalizar_csv(self, res):
-        """Callback en hilo principal tras terminar _ejecutar_csv."""
+    def _ejecutar_columnar(self, params):
+        """Ejecuta en segundo plano la extracción y exportación a Parquet (reutiliza un escaneo reciente)."""
+        medicion = params.get("medicion")
+        try:
+            ruta = self._obtener_ruta_salida(params, ".parquet")
+            registros = self._obtener_registros(params)
+            total = cotu_logic.exportar_columnar(registros, ruta, params.get("cancelacion"), medicion)
+            if medicion is not None:
+                medicion.facturas = total
+            if not total:
+                res = (None, 0, "No se encontraron facturas con los criterios seleccionados")
+            else:
+                _log.info("Parquet exportado: %s (%s facturas)", ruta, total)
+                res = (ruta, total, None)
+        except cotu_logic.Cancelado:
+            if medicion is not None:
+                medicion.estado = "cancelado"
+            _log.info("Exportación Parquet cancelada")
+            self.root.after(0, lambda: self._al_cancelar(self.btn_parquet))
+            return
+        except Exception as e:
+            if medicion is not None:
+                medicion.estado = "error"
+            _log.exception("Error al exportar Parquet")
+            res = (None, 0, str(e))
+        self.root.after(0, lambda r=res: self._al_finalizar_csv(r, params))
+
+    def _al_finalizar_csv(self, res, params: Optional[Dict[str, Any]] = None):
+        """Callback en hilo principal tras terminar _ejecutar_csv o _ejecutar_columnar."""
+        formato = (params or {}).get("formato", "csv")
+        etiqueta = formato.upper() if formato == "csv" else formato.capitalize()
         self.progress.stop()
-        self.btn_csv.config(state='normal')
+        (self.btn_parquet if formato == "parquet" else self.btn_csv).config(state='normal')
         ruta_csv, total, error_msg = res
         if error_msg:
             self.actualizar_status(error_msg[:50] + "…" if len(error_msg) > 50 else error_msg, "red")
-            Messagebox.show_error(f"Error al exportar CSV:\n{error_msg}", "Error")
+            Messagebox.show_error(f"Error al exportar {etiqueta}:\n{error_msg}", "Error")
         elif ruta_csv:
-            self.actualizar_status("CSV exportado correctamente", "green")
+            if params is not None:
+                medicion = params.get("medicion")
+                self.guardar_historial(params["tipo"], os.path.basename(ruta_csv), ruta_csv, total,
+                                       medicion.total_s if medicion is not None else None, formato)
+                self.actualizar_lista_historial()
+            self.actualizar_status(f"{etiqueta} exportado correctamente", "green")
             # Diálogo de éxito con opción Abrir carpeta (proyecto actual)
             self._mostrar_exito_abrir_carpeta(ruta_csv, total)
 
     def exportar_csv(self):
         """Exporta el mismo conjunto de datos que el reporte actual como CSV (en segundo plano)."""
+        self._exportar_archivo("csv")
+
+    def exportar_parquet(self):
+        """Exporta el conjunto de datos actual como Parquet con columnas tipadas (en segundo plano)."""
+        if cotu_logic.motor_columnar() is None:
+            Messagebox.show_warning("Para exportar a Parquet instala pyarrow:\npip install pyarrow", "Aviso")
+            return
+        self._exportar_archivo("parquet")
+
+    def _params_exportacion(self) -> Optional[Dict[str, Any]]:
+        """Parámetros de la selección actual (carpeta, tipo y fechas) o None si no son válidos (ya se avisó)."""
         if not self.ruta_base.get():
             Messagebox.show_warning("Por favor, selecciona primero la carpeta del año", "Aviso")
             return
@@ -1120,27 +1434,163 @@ Ejemplo PC casa (también válido):
             "formato_resumido": self.formato_resumido.get(),
             "nombre_anio": os.path.basename(self.ruta_base.get().rstrip(os.sep)),
         }
-        ruta_csv = self._obtener_ruta_salida(params, ".csv")
-        if os.path.exists(ruta_csv):
-            if not tk_messagebox.askyesno("Sobrescribir archivo", f"El archivo ya existe:\n{ruta_csv}\n\n¿Deseas sobrescribirlo?"):
+        return params
+
+    def _exportar_archivo(self, formato: str):
+        """Valida carpeta y fechas, confirma si el archivo ya existe y lanza la exportación `formato` ("csv" o "parquet")."""
+        params = self._params_exportacion()
+        if params is None:
+            return
+        params["formato"] = formato
+        ruta_salida = self._obtener_ruta_salida(params, "." + formato)
+        if os.path.exists(ruta_salida):
+            if not tk_messagebox.askyesno("Sobrescribir archivo", f"El archivo ya existe:\n{ruta_salida}\n\n¿Deseas sobrescribirlo?"):
                 return
         self.progress.start()
-        self.btn_csv.config(state='disabled')
-        self.actualizar_status("Exportando CSV...", "blue")
-        threading.Thread(target=self._ejecutar_csv, args=(params,), daemon=True).start()
+        if formato == "parquet":
+            self.btn_parquet.config(state='disabled')
+            self.actualizar_status("Exportando Parquet...", "blue")
+            self._lanzar_cancelable(self._ejecutar_columnar, params, "Parquet")
+        else:
+            self.btn_csv.config(state='disabled')
+            self.actualizar_status("Exportando CSV...", "blue")
+            self._lanzar_cancelable(self._ejecutar_csv, params, "CSV")
+
+    def abrir_columnar(self):
+        """Abre un Parquet/Feather exportado y muestra su vista previa, estadísticas y duplicados."""
+        if cotu_logic.motor_columnar() is None:
+            Messagebox.show_warning("Para abrir archivos Parquet instala pyarrow:\npip install pyarrow", "Aviso")
+            return
+        ruta = filedialog.askopenfilename(
+            title="Abrir reporte Parquet o Feather",
+            initialdir=self.ruta_base.get() or None,
+            filetypes=[("Parquet / Feather", "*.parquet *.feather"), ("Todos los archivos", "*.*")],
+        )
+        if not ruta:
+            return
+        self.progress.start()
+        self.actualizar_status("Leyendo archivo...", "blue")
+        self.btn_preview.configure(state="disabled")
+        self.btn_generar.configure(state="disabled")
+        self.btn_csv.configure(state="disabled")
+        self._lanzar_cancelable(self._ejecutar_cargar_columnar, {"ruta": ruta}, "Abrir Parquet")
+
+    def _ejecutar_cargar_columnar(self, params):
+        """Lee el archivo columnar en segundo plano y prepara búsqueda y resumen para la vista previa."""
+        medicion = params["medicion"]
+        try:
+            registros = cotu_logic.cargar_columnar(params["ruta"], medicion)
+            params["cancelacion"].comprobar()
+            medicion.facturas = len(registros)
+            with medicion.fase("indice_busqueda"):
+                indice = cotu_logic.IndiceBusqueda(registros)
+                indice.preparar()
+            _log.info("Archivo leído: %s (%d facturas)", params["ruta"], len(registros))
+            self.root.after(0, lambda: self._on_vista_previa_ready(registros, None, indice))
+        except cotu_logic.Cancelado:
+            medicion.estado = "cancelado"
+            self.root.after(0, lambda: self._al_cancelar(self.btn_preview, self.btn_generar, self.btn_csv))
+        except Exception as e:
+            medicion.estado = "error"
+            _log.exception("Error al leer %s", params["ruta"])
+            self.root.after(0, lambda: self._on_vista_previa_ready(None, str(e)))
+
+    def comparar_con_archivo(self):
+        """
+        Excel con las facturas nuevas, eliminadas y movidas de la selección actual respecto
+        a un Parquet/Feather exportado antes (p. ej. al cierre de mes), para cualquier tipo de reporte.
+        """
+        if cotu_logic.motor_columnar() is None:
+            Messagebox.show_warning(
+                "Para comparar hace falta un Parquet exportado antes; instala pyarrow:\npip install pyarrow", "Aviso")
+            return
+        params = self._params_exportacion()
+        if params is None:
+            return
+        params["contra"] = filedialog.askopenfilename(
+            title="Parquet o Feather con el que comparar",
+            initialdir=params["ruta_base"],
+            filetypes=[("Parquet / Feather", "*.parquet *.feather"), ("Todos los archivos", "*.*")],
+        )
+        if not params["contra"]:
+            return
+        params["ruta_salida"] = os.path.join(params["ruta_base"], cotu_logic.nombre_archivo_diferencias(
+            params["fecha_inicio"], params["fecha_fin"], params["contra"]))
+        if os.path.exists(params["ruta_salida"]):
+            if not tk_messagebox.askyesno("Sobrescribir archivo", f"El archivo ya existe:\n{params['ruta_salida']}\n\n¿Deseas sobrescribirlo?"):
+                return
+        self.progress.start()
+        self.btn_comparar.config(state='disabled')
+        self.actualizar_status("Comparando con el archivo...", "blue")
+        self._lanzar_cancelable(self._ejecutar_diferencias, params, "Diferencias")
+
+    def _ejecutar_diferencias(self, params):
+        """Lee el archivo de referencia, obtiene las facturas actuales (con la caché de escaneos) y escribe el Excel de diferencias."""
+        medicion, cancelacion = params["medicion"], params["cancelacion"]
+        try:
+            anteriores = cotu_logic.cargar_columnar(params["contra"], medicion)
+            if params["tipo"] != self.TIPO_ANIO:
+                # La copia puede abarcar más (p. ej. el año hasta el cierre): comparar solo el periodo
+                with medicion.fase("filtrar"):
+                    anteriores = cotu_logic.filtrar_registros(
+                        anteriores, params["fecha_inicio"], params["fecha_fin"], cancelacion)
+            actuales = self._obtener_registros(params)
+            medicion.facturas = len(actuales)
+            if not anteriores and not actuales:
+                res = (None, None, "No hay facturas ni en el archivo ni en la carpeta")
+            else:
+                diferencia = cotu_logic.escribir_diferencias(anteriores, actuales, params["ruta_salida"],
+                                                             cancelacion, medicion)
+                _log.info("Diferencias: %s (%s)", params["ruta_salida"], diferencia.texto().replace("\n", ", "))
+                res = (params["ruta_salida"], diferencia, None)
+        except cotu_logic.Cancelado:
+            medicion.estado = "cancelado"
+            _log.info("Comparación cancelada")
+            self.root.after(0, lambda: self._al_cancelar(self.btn_comparar))
+            return
+        except Exception as e:
+            medicion.estado = "error"
+            _log.exception("Error al comparar con %s", params["contra"])
+            res = (None, None, str(e))
+        self.root.after(0, lambda r=res: self._al_finalizar_diferencias(r, params))
+
+    def _al_finalizar_diferencias(self, res, params: Dict[str, Any]):
+        """Callback en hilo principal tras terminar _ejecutar_diferencias."""
+        self.progress.stop()
+        self.btn_comparar.config(state='normal')
+        ruta_salida, diferencia, error_msg = res
+        if error_msg:
+            self.actualizar_status(error_msg[:50] + "…" if len(error_msg) > 50 else error_msg, "red")
+            Messagebox.show_error(f"Error al comparar:\n{error_msg}", "Error")
+            return
+        medicion = params.get("medicion")
+        self.guardar_historial(f"Diferencias {params['tipo']}", os.path.basename(ruta_salida), ruta_salida,
+                               diferencia.total_cambios, medicion.total_s if medicion is not None else None)
+        self.actualizar_lista_historial()
+        self.actualizar_status(f"✓ {diferencia.total_cambios} cambios respecto a {os.path.basename(params['contra'])}", "green")
+        self._mostrar_exito_abrir_carpeta(ruta_salida, diferencia.total_cambios, diferencia.texto())
     
-    def _mostrar_exito_abrir_carpeta(self, ruta_salida, total_facturas):
-        """Muestra diálogo de éxito con botón para abrir la carpeta (F3: fondo coherente con tema)"""
+    def _mostrar_exito_abrir_carpeta(self, ruta_salida, total_facturas, detalle: Optional[str] = None):
+        """
+        Muestra diálogo de éxito con botón para abrir la carpeta (F3: fondo coherente con tema).
+        `detalle` sustituye la línea del total (p. ej. el resumen de diferencias).
+        """
         ventana = tk.Toplevel(self.root)
         ventana.title("Éxito")
-        ventana.geometry("520x220")
+        ventana.geometry("520x300" if detalle else "520x220")
         ventana.transient(self.root)
         ventana.grab_set()
         ventana.configure(bg=self.colors["bg"])
-        titulo = "CSV exportado exitosamente" if ruta_salida.lower().endswith(".csv") else "Excel generado exitosamente"
+        extension = os.path.splitext(ruta_salida)[1].lower()
+        if extension == ".csv":
+            titulo = "CSV exportado exitosamente"
+        elif extension in cotu_logic.FORMATOS_COLUMNARES:
+            titulo = "Parquet exportado exitosamente"
+        else:
+            titulo = "Excel generado exitosamente"
         ttk.Label(ventana, text=titulo, font=("Segoe UI", 13, "bold")).pack(pady=(24, 12))
         ttk.Label(ventana, text=ruta_salida, wraplength=460, font=("Segoe UI", 10)).pack(pady=6)
-        ttk.Label(ventana, text=f"Total de facturas: {total_facturas}", font=("Segoe UI", 11)).pack(pady=6)
+        ttk.Label(ventana, text=detalle or f"Total de facturas: {total_facturas}", font=("Segoe UI", 11)).pack(pady=6)
         btn_frame = ttk.Frame(ventana)
         btn_frame.pack(pady=20)
         ttk.Button(btn_frame, text="Abrir carpeta", command=lambda: (self._abrir_carpeta(os.path.dirname(ruta_salida)), ventana.destroy())).pack(side=tk.LEFT, padx=8)
@@ -1150,51 +1600,11 @@ Ejemplo PC casa (también válido):
     
     def verificar_duplicados(self, registros: List[Dict[str, Any]]) -> List[str]:
         """Retorna lista de mensajes de duplicados encontrados"""
-        vistos = {} # clave: numero_cotu -> lista de indices
-        duplicados = []
-        
-        for i, reg in enumerate(registros):
-            cotu = str(reg.get(self.COL_FACTURA, "")).strip().upper()
-            if not cotu or cotu == "COTU":
-                continue
-            if cotu in vistos:
-                vistos[cotu].append(i)
-            else:
-                vistos[cotu] = [i]
-        
-        for cotu, indices in vistos.items():
-            if len(indices) > 1:
-                # Encontrado duplicado
-                fechas = set()
-                aseguradoras = set()
-                for idx in indices:
-                    fechas.add(registros[idx].get(self.COL_FECHA, ""))
-                    aseguradoras.add(registros[idx].get(self.COL_COMPANIA, ""))
-                
-                msg = f"Factura {cotu} aparece {len(indices)} veces (Fechas: {', '.join(fechas)} - Cia: {', '.join(aseguradoras)})"
-                duplicados.append(msg)
-        return duplicados
+        return cotu_logic.verificar_duplicados(registros)
 
     def calcular_estadisticas(self, registros: List[Dict[str, Any]]) -> str:
         """Genera un resumen estadístico por aseguradora"""
-        total = len(registros)
-        if total == 0:
-            return "No hay registros."
-            
-        conteo = {}
-        for reg in registros:
-            cia = reg.get(self.COL_COMPANIA, "SIN ASEGURADORA") or "SIN ASEGURADORA"
-            conteo[cia] = conteo.get(cia, 0) + 1
-        
-        resumen = [f"Total Facturas: {total}"]
-        resumen.append("-" * 20)
-        
-        # Ordenar por cantidad descendente
-        for cia, cant in sorted(conteo.items(), key=lambda x: x[1], reverse=True):
-            porcentaje = (cant / total) * 100
-            resumen.append(f"{cia}: {cant} ({porcentaje:.1f}%)")
-            
-        return "\n".join(resumen)
+        return cotu_logic.calcular_estadisticas(registros)
     
     def validar_fecha(self, fecha_str: str) -> Optional[datetime]:
         """Valida formato de fecha DD/MM/YYYY"""
@@ -1203,7 +1613,10 @@ Ejemplo PC casa (también válido):
         except ValueError:
             return None
     
-    def extraer_facturas(self, ruta_base: str, fecha_inicio: Optional[datetime] = None, fecha_fin: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    def extraer_facturas(self, ruta_base: str, fecha_inicio: Optional[datetime] = None, fecha_fin: Optional[datetime] = None,
+                         cancelacion: Optional[cotu_logic.TokenCancelacion] = None,
+                         medicion: Optional[cotu_logic.MedicionRendimiento] = None,
+                         firmas: Optional[Dict[str, Optional[int]]] = None) -> List[Dict[str, Any]]:
         """
         Extrae todas las facturas COTU de la estructura de carpetas.
         OPTIMIZADO para carpetas de red con limitación de profundidad.
@@ -1211,281 +1624,162 @@ Ejemplo PC casa (también válido):
           AÑO / MES / DÍA / ASEGURADORA / COTUxxxxx
         Ejemplo: 2025 / 12-DICIEMBRE / 23 DE DICIEMBRE / SOLIDARIA / COTU74335
         También admite base = carpeta padre (FACTURACION) con año en primer subnivel.
+        Si hay índice de escaneo activo, solo se vuelven a listar las carpetas cuyo mtime cambió.
+        Con `cancelacion`, lanza cotu_logic.Cancelado (con los registros parciales) al cancelar.
+        Con `medicion`, se miden las fases del escaneo (ver cotu_logic.MedicionRendimiento).
+        Con `firmas`, se anota el mtime de las carpetas recorridas (ver cotu_logic.firma_vigente).
         """
-        registros = []
-        if not os.path.exists(ruta_base):
-            raise FileNotFoundError(f"La carpeta no existe: {ruta_base}")
-        # Normalizar para cálculo de profundidad (evitar fallo con ruta_base con barra final)
-        ruta_base_norm = os.path.normpath(ruta_base.rstrip(os.sep))
-        nombre_anio = os.path.basename(ruta_base_norm)
-        solo_cotu = getattr(self, "solo_carpetas_cotu", None)
-        solo_cotu = solo_cotu.get() if solo_cotu is not None else True
-        
-        # Contador para actualizar progreso
-        carpetas_procesadas = 0
-        max_depth = 6  # AÑO/MES/DÍA/ASEGURADORA/COTU = 5 niveles + margen
-
-        for root, dirs, _ in os.walk(ruta_base):
-            # OPTIMIZACIÓN 1: Limitar profundidad (ruta_base_norm evita fallo con barra final)
-            suffix = root[len(ruta_base_norm):] if root.startswith(ruta_base_norm) else root[len(ruta_base):]
-            depth = suffix.count(os.sep)
-            if depth >= max_depth:
-                dirs[:] = []  # No entrar en subdirectorios
-                continue
-            
-            # OPTIMIZACIÓN 2: Filtrar directorios ANTES de entrar
-            if solo_cotu and depth >= 4:
-                dirs[:] = [d for d in dirs if d.upper().startswith("COTU")]
-            
-            # OPTIMIZACIÓN 3: Actualizar progreso cada 50 carpetas
-            carpetas_procesadas += 1
-            if carpetas_procesadas % 50 == 0:
-                self.root.after(0, lambda n=carpetas_procesadas: 
-                    self.actualizar_status(f"Escaneando... {n} carpetas", "blue"))
-            for d in dirs:
-                if solo_cotu and not d.upper().startswith("COTU"):
-                    continue
-                ruta_cotu = os.path.join(root, d)
-                partes = d.split()
-                cotu = partes[0] if partes else d
-                detalle = " ".join(partes[1:]) if len(partes) > 1 else ""
-                partes_ruta = Path(ruta_cotu).parts
-                try:
-                    # Lógica del script de trabajo: AÑO/MES/DÍA/ASEGURADORA/COTU desde el final
-                    # -1=COTU, -2=ASEGURADORA, -3=DÍA, -4=MES, -5=AÑO
-                    if len(partes_ruta) >= 5:
-                        anio_para_fecha = partes_ruta[-5]
-                        mes = partes_ruta[-4]
-                        dia = partes_ruta[-3]
-                        aseguradora = partes_ruta[-2]
-                    else:
-                        # Fallback: índices respecto a la carpeta base
-                        idx_base = partes_ruta.index(os.path.basename(ruta_base))
-                        anio_para_fecha = nombre_anio
-                        if idx_base + 1 < len(partes_ruta):
-                            primero = partes_ruta[idx_base + 1]
-                            if len(primero) == 4 and primero.isdigit():
-                                anio_para_fecha = primero
-                                if len(partes_ruta) > idx_base + 4:
-                                    mes = partes_ruta[idx_base + 2]
-                                    dia = partes_ruta[idx_base + 3]
-                                    aseguradora = partes_ruta[idx_base + 4]
-                                else:
-                                    mes = dia = aseguradora = ""
-                            else:
-                                if len(partes_ruta) > idx_base + 4:
-                                    mes, dia = partes_ruta[idx_base + 1], partes_ruta[idx_base + 3]
-                                    aseguradora = partes_ruta[idx_base + 4]
-                                elif len(partes_ruta) > idx_base + 3:
-                                    mes = partes_ruta[idx_base + 1]
-                                    dia = partes_ruta[idx_base + 2]
-                                    aseguradora = partes_ruta[idx_base + 3]
-                                else:
-                                    mes = partes_ruta[idx_base + 1] if idx_base + 1 < len(partes_ruta) else ""
-                                    dia = partes_ruta[idx_base + 2] if idx_base + 2 < len(partes_ruta) else ""
-                                    aseguradora = ""
-                        else:
-                            if len(partes_ruta) > idx_base + 4:
-                                mes, dia = partes_ruta[idx_base + 1], partes_ruta[idx_base + 3]
-                                aseguradora = partes_ruta[idx_base + 4]
-                            elif len(partes_ruta) > idx_base + 3:
-                                mes, dia = partes_ruta[idx_base + 1], partes_ruta[idx_base + 2]
-                                aseguradora = partes_ruta[idx_base + 3]
-                            else:
-                                mes = partes_ruta[idx_base + 1] if idx_base + 1 < len(partes_ruta) else ""
-                                dia = partes_ruta[idx_base + 2] if idx_base + 2 < len(partes_ruta) else ""
-                                aseguradora = ""
-                    if fecha_inicio or fecha_fin:
-                        fecha_carpeta = self.parsear_fecha_carpeta(dia, mes, anio_para_fecha)
-                        if fecha_carpeta:
-                            if fecha_inicio and fecha_carpeta < fecha_inicio:
-                                continue
-                            if fecha_fin and fecha_carpeta > fecha_fin:
-                                continue
-                    registros.append({
-                        self.COL_ANIO: anio_para_fecha,
-                        self.COL_MES: mes,
-                        self.COL_FECHA: dia,
-                        self.COL_FACTURA: cotu,
-                        self.COL_DETALLE: detalle,
-                        self.COL_COMPANIA: aseguradora
-                    })
-                except (IndexError, ValueError):
-                    registros.append({
-                        self.COL_ANIO: nombre_anio,
-                        self.COL_MES: "",
-                        self.COL_FECHA: "",
-                        self.COL_FACTURA: cotu,
-                        self.COL_DETALLE: detalle,
-                        self.COL_COMPANIA: ""
-                    })
-        
+        registros = cotu_logic.extraer_registros(
+            ruta_base, fecha_inicio, fecha_fin, cancelacion=cancelacion, medicion=medicion, firmas=firmas,
+            **self._opciones_escaneo()
+        )
+
         # Actualizar estado final
         self.root.after(0, lambda: 
             self.actualizar_status(f"✓ {len(registros)} facturas encontradas", "green"))
         
         return registros
     
+    def _opciones_escaneo(self) -> Dict[str, Any]:
+        """Opciones comunes del escaneo: filtro COTU, índice y progreso en la barra de estado."""
+        solo_cotu = getattr(self, "solo_carpetas_cotu", None)
+        solo_cotu = solo_cotu.get() if solo_cotu is not None else True
+        indice = getattr(self, "_indice", None)
+        if indice is not None and not getattr(self, "_usar_indice", True):
+            indice = None
+
+        def _progreso(n):
+            self.root.after(0, lambda n=n: self.actualizar_status(f"Escaneando... {n} carpetas", "blue"))
+
+        return {"solo_cotu": solo_cotu, "indice": indice, "progreso": _progreso}
+
+    def _clave_escaneo(self, params: Dict[str, Any]):
+        """Identifica un escaneo: misma carpeta, tipo, fechas y opción de solo carpetas COTU."""
+        return (
+            os.path.normcase(os.path.normpath(params["ruta_base"])),
+            params["tipo"],
+            params["fecha_inicio"],
+            params["fecha_fin"],
+            bool(self.solo_carpetas_cotu.get()),
+        )
+
+    def _resultado_reciente(self, clave) -> Optional[List[Dict[str, Any]]]:
+        """Resultado en caché, aún válido, del escaneo `clave` (None si no hay)."""
+        registros = self._cache_resultados.obtener(clave)
+        if registros is not None:
+            _log.info("Reutilizando resultado del escaneo anterior (%d facturas)", len(registros))
+            self.root.after(0, lambda: self.actualizar_status(
+                f"✓ {len(registros)} facturas (resultado del escaneo anterior)", "green"))
+        return registros
+
+    def _obtener_registros(self, params: Dict[str, Any], usar_cache: bool = True) -> List[Dict[str, Any]]:
+        """
+        Facturas ya filtradas por tipo para `params`. Si hay un resultado reciente y válido
+        del mismo escaneo se reutiliza; si no, se escanea en el ejecutor compartido (si hay
+        uno idéntico en cola o en curso, se espera a ese). `usar_cache=False` cuando quien
+        llama ya consultó la caché.
+        """
+        clave = self._clave_escaneo(params)
+        if usar_cache:
+            registros = self._resultado_reciente(clave)
+            if registros is not None:
+                return registros
+        futuro = self._ejecutor.enviar(
+            clave,
+            lambda token: self._escanear(params, clave, token),
+            params.get("cancelacion"),
+        )
+        # "espera": cola del ejecutor o escaneo idéntico de otra operación
+        with cotu_logic.medir_fase(params.get("medicion"), "espera"):
+            return cotu_logic.esperar_resultado(futuro, params.get("cancelacion"))
+
+    def _escanear(self, params: Dict[str, Any], clave, cancelacion: Optional[cotu_logic.TokenCancelacion] = None):
+        """Extrae y filtra por tipo (se ejecuta en el hilo del ejecutor) y guarda el resultado en la caché."""
+        medicion = params.get("medicion")
+        firmas: Dict[str, Optional[int]] = {}
+        registros = self.extraer_facturas(params["ruta_base"], params["fecha_inicio"], params["fecha_fin"],
+                                          cancelacion, medicion, firmas)
+        if params["tipo"] != self.TIPO_ANIO:
+            with cotu_logic.medir_fase(medicion, "filtrar"):
+                registros = self.filtrar_por_tipo(
+                    registros, params["tipo"], params["fecha_inicio_str"], params["fecha_fin_str"], cancelacion
+                )
+        self._cache_resultados.guardar(clave, firmas, registros)
+        return registros
+
+    def _iterar_facturas(self, params: Dict[str, Any], cancelacion: Optional[cotu_logic.TokenCancelacion] = None):
+        """Generador de facturas ya filtradas por tipo, para exportar sin cargarlas en memoria."""
+        registros = cotu_logic.iterar_registros(
+            params["ruta_base"], params["fecha_inicio"], params["fecha_fin"],
+            cancelacion=cancelacion, medicion=params.get("medicion"), **self._opciones_escaneo()
+        )
+        if params["tipo"] == self.TIPO_ANIO:
+            return registros
+        fecha_inicio = self.validar_fecha(params["fecha_inicio_str"]) if params["fecha_inicio_str"] else None
+        fecha_fin = self.validar_fecha(params["fecha_fin_str"]) if params["fecha_fin_str"] else None
+        return cotu_logic.filtrar_iterable(registros, fecha_inicio, fecha_fin)
+
     def parsear_fecha_carpeta(self, dia: str, mes: str, anio: str) -> Optional[datetime]:
         """
         Intenta parsear la fecha desde los nombres de carpeta
         Maneja formatos como: "02 DE AGOSTO", "AGOSTO", "2025"
         """
-        # Diccionario de meses en español
-        meses_espanol = {
-            'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
-            'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
-            'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
-        }
-        
-        try:
-            if not dia or not mes or not anio:
-                return None
-            
-            # Extraer año (solo números)
-            anio_num = None
-            try:
-                anio_num = int(re.sub(r'\D', '', str(anio)))
-            except (ValueError, TypeError):
-                return None
-            
-            # Extraer mes (convertir nombre a número)
-            mes_num = None
-            mes_lower = mes.lower().strip()
-            
-            # Buscar en el diccionario de meses
-            if mes_lower in meses_espanol:
-                mes_num = meses_espanol[mes_lower]
-            else:
-                # Intentar extraer número del mes (ej: "08-AGOSTO" -> 8)
-                try:
-                    mes_num = int(re.sub(r'\D', '', mes))
-                    if mes_num < 1 or mes_num > 12:
-                        # Si no es válido, buscar el nombre del mes en el string
-                        for nombre_mes, num in meses_espanol.items():
-                            if nombre_mes in mes_lower:
-                                mes_num = num
-                                break
-                except (ValueError, TypeError):
-                    # Buscar nombre del mes en el string
-                    for nombre_mes, num in meses_espanol.items():
-                        if nombre_mes in mes_lower:
-                            mes_num = num
-                            break
-            
-            if not mes_num:
-                return None
-            
-            # Extraer día
-            dia_num = None
-            dia_str = str(dia).strip()
-            
-            # Formato: "02 DE AGOSTO" o "2 DE AGOSTO"
-            # Extraer números del inicio
-            match = re.match(r'^(\d+)', dia_str)
-            if match:
-                try:
-                    dia_num = int(match.group(1))
-                except (ValueError, TypeError):
-                    pass
-            
-            # Si no se encontró día, intentar extraer cualquier número
-            if not dia_num:
-                try:
-                    dia_num = int(re.sub(r'\D', '', dia_str))
-                except (ValueError, TypeError):
-                    return None
-            
-            # Validar y crear fecha
-            if dia_num and mes_num and anio_num:
-                try:
-                    return datetime(anio_num, mes_num, dia_num)
-                except ValueError:
-                    # Fecha inválida (ej: 31 de febrero)
-                    return None
-                    
-        except (ValueError, TypeError, AttributeError, KeyError):
-            pass
-        
-        return None
+        return cotu_logic.parsear_fecha_carpeta(dia, mes, anio)
     
-    def filtrar_por_tipo(self, registros: List[Dict[str, Any]], tipo: str, fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Filtra registros según el tipo de reporte"""
+    def filtrar_por_tipo(self, registros: List[Dict[str, Any]], tipo: str, fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None,
+                         cancelacion: Optional[cotu_logic.TokenCancelacion] = None) -> List[Dict[str, Any]]:
+        """Filtra registros según el tipo de reporte (sin DataFrame: una comparación por carpeta de día)"""
         if tipo == self.TIPO_ANIO:
             return registros
-        
-        df = pd.DataFrame(registros)
-        if df.empty:
-            return []
-        
-        # Convertir fechas
-        df['FECHA_PARSED'] = df.apply(
-            lambda row: self.parsear_fecha_carpeta(
-                row[self.COL_FECHA], 
-                row[self.COL_MES], 
-                row[self.COL_ANIO]
-            ), axis=1
-        )
-        
-        if fecha_inicio:
-            fecha_inicio_dt = self.validar_fecha(fecha_inicio)
-            if fecha_inicio_dt:
-                df = df[df['FECHA_PARSED'] >= fecha_inicio_dt]
-        
-        if fecha_fin:
-            fecha_fin_dt = self.validar_fecha(fecha_fin)
-            if fecha_fin_dt:
-                # Para fecha fin, incluir todo el día
-                fecha_fin_dt = fecha_fin_dt.replace(hour=23, minute=59, second=59)
-                df = df[df['FECHA_PARSED'] <= fecha_fin_dt]
-        
-        # Eliminar columna temporal
-        df = df.drop('FECHA_PARSED', axis=1)
-        
-        return df.to_dict('records')
+        fecha_inicio_dt = self.validar_fecha(fecha_inicio) if fecha_inicio else None
+        fecha_fin_dt = self.validar_fecha(fecha_fin) if fecha_fin else None
+        return cotu_logic.filtrar_registros(registros, fecha_inicio_dt, fecha_fin_dt, cancelacion)
     
+    def _agrupacion_libro(self) -> List[str]:
+        """Columnas por las que el Excel lleva una hoja por valor (vacío: una sola hoja)."""
+        agrupar = []
+        if self.libro_por_mes.get():
+            agrupar.append(self.COL_MES)
+        if self.libro_por_compania.get():
+            agrupar.append(self.COL_COMPANIA)
+        return agrupar
+
     def _ejecutar_generar(self, params):
         """Ejecuta en segundo plano la extracción y exportación del reporte. Al terminar programa callback en el hilo principal."""
         ok, ruta_salida, total, tipo, nombre_archivo, error_msg, warning_msg = False, None, 0, None, None, None, None
+        dups: List[str] = []
+        cancelacion = params.get("cancelacion")
+        medicion = params.get("medicion")
         try:
-            registros = self.extraer_facturas(params["ruta_base"], params["fecha_inicio"], params["fecha_fin"])
+            registros = self._obtener_registros(params)
+            if medicion is not None:
+                medicion.facturas = len(registros)
             if not registros:
-                res = (False, None, 0, None, None, "No se encontraron facturas COTU en el rango seleccionado.", None)
-                self.root.after(0, lambda r=res: self._al_finalizar_generar(r))
-                return
-            if params["tipo"] != self.TIPO_ANIO:
-                registros = self.filtrar_por_tipo(registros, params["tipo"], params["fecha_inicio_str"], params["fecha_fin_str"])
-            if not registros:
-                res = (False, None, 0, None, None, "No se encontraron facturas en el rango de fechas especificado.", None)
+                if params["tipo"] == self.TIPO_ANIO:
+                    mensaje = "No se encontraron facturas COTU en el rango seleccionado."
+                else:
+                    mensaje = "No se encontraron facturas en el rango de fechas especificado."
+                res = (False, None, 0, None, None, mensaje, None)
                 self.root.after(0, lambda r=res: self._al_finalizar_generar(r))
                 return
             
-            # Detectar duplicados en background para logging
+            # Duplicados ya agregados durante la extracción (se pasan al callback para el aviso)
             dups = self.verificar_duplicados(registros)
             if dups:
                 _log.warning("Se detectaron %d duplicados en el reporte", len(dups))
 
-            df = pd.DataFrame(registros)
-            if params["formato_resumido"]:
-                df = df[[self.COL_FECHA, self.COL_FACTURA, self.COL_COMPANIA]].copy()
-                df = df.rename(columns={self.COL_FECHA: "FECHA", self.COL_FACTURA: "COTU", self.COL_COMPANIA: "ASEGURADORA"})
-                columnas_orden = ["FECHA", "COTU", "ASEGURADORA"]
-            else:
-                columnas_orden = [self.COL_FECHA, self.COL_MES, self.COL_FACTURA]
-            by_cols = [c for c in columnas_orden if c in df.columns]
-            if by_cols:
-                df.sort_values(by=by_cols, inplace=True)
-            tipo, nombre_anio = params["tipo"], params["nombre_anio"]
-            fecha_inicio, fecha_fin = params["fecha_inicio"], params["fecha_fin"]
-            if tipo == self.TIPO_ANIO:
-                nombre_archivo = f"cotus_{nombre_anio.lower().replace(' ', '_')}.xlsx"
-            elif tipo == self.TIPO_DIA:
-                nombre_archivo = f"cotus_dia_{fecha_inicio.strftime('%Y%m%d')}.xlsx"
-            elif tipo == self.TIPO_SEMANA:
-                nombre_archivo = f"cotus_semana_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}.xlsx"
+            tipo = params["tipo"]
+            nombre_hoja = cotu_logic.NOMBRES_HOJA[tipo]
+            if params.get("agrupar"):
+                # Libro con RESUMEN + hoja principal + una hoja por mes/aseguradora, de la misma extracción
+                hojas = cotu_logic.libro_reporte(registros, params["formato_resumido"], params["agrupar"],
+                                                 nombre_hoja, medicion)
+                df = dict(hojas)[nombre_hoja]
             else:
-                nombre_archivo = f"cotus_mes_{fecha_inicio.strftime('%Y%m%d')}_{fecha_fin.strftime('%Y%m%d')}.xlsx"
-            ruta_salida = os.path.join(params["ruta_base"], nombre_archivo)
+                df = cotu_logic.dataframe_reporte(registros, params["formato_resumido"], medicion)
+                hojas = [(nombre_hoja, df)]
+            ruta_salida = self._obtener_ruta_salida(params, ".xlsx")
+            nombre_archivo = os.path.basename(ruta_salida)
             carpeta_salida = os.path.dirname(ruta_salida)
             try:
                 test_file = os.path.join(carpeta_salida, ".permiso_escritura_tmp")
@@ -1496,40 +1790,16 @@ Ejemplo PC casa (también válido):
                 res = (False, None, 0, tipo, None, "No hay permisos de escritura en la carpeta seleccionada.", None)
                 self.root.after(0, lambda r=res: self._al_finalizar_generar(r))
                 return
+            motor = cotu_logic.motor_excel()
+            if motor is None:
+                warning_msg = "openpyxl no está instalado. Se generará CSV en su lugar.\nPara generar Excel, instala: pip install openpyxl"
             try:
-                import openpyxl  # noqa: F401
-                engine, usar_openpyxl = 'openpyxl', True
-            except ImportError:
-                try:
-                    import xlsxwriter  # noqa: F401
-                    engine, usar_openpyxl = 'xlsxwriter', False
-                except ImportError:
-                    engine, usar_openpyxl = None, False
-                    warning_msg = "openpyxl no está instalado. Intentando con engine por defecto.\nPara mejores resultados, instala: pip install openpyxl"
-            writer = None
-            try:
-                writer = pd.ExcelWriter(ruta_salida, engine=engine) if engine else pd.ExcelWriter(ruta_salida)
-                nombre_hoja = {self.TIPO_ANIO: "NOVEDADES ANUALES", self.TIPO_MES: "NOVEDADES MENSUALES", self.TIPO_SEMANA: "NOVEDADES SEMANALES", self.TIPO_DIA: "NOVEDADES DIARIAS"}[tipo]
-                df.to_excel(writer, index=False, sheet_name=nombre_hoja)
-                if usar_openpyxl:
-                    hoja = writer.sheets[nombre_hoja]
-                    hoja.auto_filter.ref = hoja.dimensions
-                    for column in hoja.columns:
-                        max_length = 0
-                        for cell in column:
-                            try:
-                                n = len(str(cell.value))
-                                if n > max_length:
-                                    max_length = n
-                            except (TypeError, AttributeError):
-                                pass
-                        hoja.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
+                # Escritura en streaming: memoria constante aunque el reporte tenga muchas filas
+                with cotu_logic.medir_fase(medicion, "excel"):
+                    cotu_logic.escribir_libro(hojas, ruta_salida, motor, cancelacion)
+            except cotu_logic.Cancelado:
+                raise
             except Exception as e:
-                if writer is not None:
-                    try:
-                        writer.close()
-                    except Exception:
-                        pass
                 ruta_csv = ruta_salida.replace('.xlsx', '.csv')
                 df.to_csv(ruta_csv, index=False, encoding='utf-8-sig')
                 err_text = f"No se pudo generar Excel. Se generó CSV en su lugar:\n{ruta_csv}\n\nError original: {str(e)}\n\nPara generar Excel, instala: pip install openpyxl"
@@ -1537,42 +1807,45 @@ Ejemplo PC casa (también válido):
                 res = (False, ruta_csv, len(df), tipo, os.path.basename(ruta_csv), err_text, warning_msg)
                 self.root.after(0, lambda r=res: self._al_finalizar_generar(r))
                 return
-            finally:
-                if writer is not None:
-                    try:
-                        writer.close()
-                    except Exception:
-                        pass
             ok, total = True, len(df)
             _log.info("Reporte generado: %s (%s facturas)", ruta_salida, total)
+        except cotu_logic.Cancelado:
+            if medicion is not None:
+                medicion.estado = "cancelado"
+            _log.info("Generación de reporte cancelada")
+            self.root.after(0, lambda: self._al_cancelar(self.btn_generar))
+            return
         except Exception as e:
+            if medicion is not None:
+                medicion.estado = "error"
             error_msg = str(e)
             _log.exception("Error al generar reporte")
         
-        # Pasar registros a callback para validar duplicados
-        # (truco: agregamos registros al resultado para usarlos en el callback)
-        res = (ok, ruta_salida, total, tipo, nombre_archivo, error_msg, warning_msg, registros if ok else [])
-        self.root.after(0, lambda r=res: self._al_finalizar_generar(r))
+        # Pasar los duplicados ya calculados al callback (no se recorren registros en el hilo principal)
+        res = (ok, ruta_salida, total, tipo, nombre_archivo, error_msg, warning_msg, dups if ok else [])
+        self.root.after(0, lambda r=res: self._al_finalizar_generar(r, medicion))
 
-    def _al_finalizar_generar(self, res):
+    def _al_finalizar_generar(self, res, medicion: Optional[cotu_logic.MedicionRendimiento] = None):
         """Callback en hilo principal tras terminar _ejecutar_generar."""
         self.progress.stop()
         self.btn_generar.config(state='normal')
         
         # Desempaquetar (manejando compatibilidad con tupla vieja por si acaso)
         if len(res) == 8:
-            ok, ruta_salida, total, tipo, nombre_archivo, error_msg, warning_msg, registros = res
+            ok, ruta_salida, total, tipo, nombre_archivo, error_msg, warning_msg, dups = res
         else:
             ok, ruta_salida, total, tipo, nombre_archivo, error_msg, warning_msg = res
-            registros = []
+            dups = []
             
         if warning_msg:
             Messagebox.show_warning(warning_msg, "Advertencia")
         if ok and ruta_salida:
-            self.guardar_historial(tipo, nombre_archivo, ruta_salida, total)
+            self.guardar_historial(tipo, nombre_archivo, ruta_salida, total,
+                                   medicion.total_s if medicion is not None else None)
             self._guardar_config()
             self.actualizar_status("Reporte generado exitosamente", "green")
             # Toast notification
+            from ttkbootstrap.widgets import ToastNotification
             ToastNotification(
                 title="✅ Reporte Generado",
                 message=f"Archivo: {nombre_archivo}\nTotal: {total} facturas",
@@ -1585,8 +1858,6 @@ Ejemplo PC casa (también válido):
             self._mostrar_exito_abrir_carpeta(ruta_salida, total)
             
             # Alerta de duplicados si los hay
-            dups = self.verificar_duplicados(registros) if registros else []
-
             msg_extra = ""
             if dups:
                 msg_extra = f"\n\n⚠️ Se detectaron {len(dups)} facturas con número duplicado. Revise la vista previa para detalles."
@@ -1639,6 +1910,7 @@ Ejemplo PC casa (también válido):
             "fecha_fin_str": self.fecha_fin.get(),
             "formato_resumido": self.formato_resumido.get(),
             "nombre_anio": os.path.basename(self.ruta_base.get().rstrip(os.sep)),
+            "agrupar": self._agrupacion_libro(),
         }
         ruta_excel = self._obtener_ruta_salida(params, ".xlsx")
         if os.path.exists(ruta_excel):
@@ -1647,13 +1919,25 @@ Ejemplo PC casa (también válido):
         self.progress.start()
         self.btn_generar.config(state='disabled')
         self.actualizar_status("Extrayendo facturas...", "blue")
-        threading.Thread(target=self._ejecutar_generar, args=(params,), daemon=True).start()
+        self._lanzar_cancelable(self._ejecutar_generar, params, "Excel")
+
+
+def _registrar_arranque(root, salir: bool):
+    """Registra cuánto tardó la ventana en estar lista; con --medir-arranque lo imprime y cierra."""
+    ms_ventana = (time.perf_counter() - _T_INICIO) * 1000
+    _log.info("Arranque: ventana lista en %.0f ms (importaciones %.0f ms)", ms_ventana, _MS_IMPORTACIONES)
+    if salir:
+        print(f"importaciones_ms={_MS_IMPORTACIONES:.0f} ventana_ms={ms_ventana:.0f}")
+        root.destroy()
 
 
 def main():
+    cotu_logic.configurar_logging()
+    medir_arranque = "--medir-arranque" in sys.argv[1:]
     # Usar ttkbootstrap Window en lugar de tk.Tk
     root = ttk.Window(themename="flatly")
     GeneradorFacturasCOTU(root)
+    root.after_idle(lambda: _registrar_arranque(root, medir_arranque))
     root.mainloop()
 
 
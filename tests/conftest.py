@@ -49,6 +49,5 @@ def app():
 
     # Locks (añadidos en auditoría): mock para tests
     gen._lock_config = MagicMock()
-    gen._lock_historial = MagicMock()
 
     yield gen
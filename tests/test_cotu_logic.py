@@ -0,0 +1,1071 @@
+"""
+Tests unitarios para cotu_logic (motor de extracción sin GUI).
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import cotu_logic
+from cotu_logic import COL_COMPANIA, COL_FACTURA
+
+
+def _crear_arbol(base):
+    """Crea AÑO/MES/DÍA/ASEGURADORA/COTUxxx bajo `base` y devuelve la carpeta del año."""
+    dia = base / "2025" / "12-DICIEMBRE" / "23 DE DICIEMBRE"
+    (dia / "SOLIDARIA" / "COTU001").mkdir(parents=True)
+    (dia / "SOLIDARIA" / "COTU002 ANULADA").mkdir(parents=True)
+    (base / "2025" / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "AURORA" / "COTU003").mkdir(parents=True)
+    return base / "2025"
+
+
+def _envejecer(ruta):
+    """Retrasa el mtime de todas las carpetas para que el índice las considere estables."""
+    antiguo = 1_600_000_000
+    for raiz, dirs, _ in os.walk(ruta):
+        for d in dirs:
+            os.utime(os.path.join(raiz, d), (antiguo, antiguo))
+    os.utime(ruta, (antiguo, antiguo))
+
+
+# --- IndiceEscaneo ---
+class TestIndiceEscaneo:
+    """Tests para el índice persistente de escaneo."""
+
+    def test_mismos_registros_con_y_sin_indice(self, tmp_path):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        indice = cotu_logic.IndiceEscaneo(str(tmp_path / "indice.sqlite"))
+        sin_indice = cotu_logic.extraer_registros(str(ruta_anio))
+        con_indice = cotu_logic.extraer_registros(str(ruta_anio), indice=indice)
+        assert sorted(map(str, sin_indice)) == sorted(map(str, con_indice))
+        assert {r[COL_FACTURA] for r in con_indice} == {"COTU001", "COTU002", "COTU003"}
+
+    def test_segundo_escaneo_no_vuelve_a_listar(self, tmp_path):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        _envejecer(ruta_anio)
+        indice = cotu_logic.IndiceEscaneo(str(tmp_path / "indice.sqlite"))
+        cotu_logic.extraer_registros(str(ruta_anio), indice=indice)
+
+        sesion = indice.sesion(str(ruta_anio))
+        list(cotu_logic._recorrer(str(ruta_anio), sesion.listar, True))
+        assert sesion.listados == 0
+        assert sesion.reutilizados > 0
+
+    def test_detecta_carpeta_nueva(self, tmp_path):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        _envejecer(ruta_anio)
+        indice = cotu_logic.IndiceEscaneo(str(tmp_path / "indice.sqlite"))
+        cotu_logic.extraer_registros(str(ruta_anio), indice=indice)
+
+        (ruta_anio / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "AURORA" / "COTU004").mkdir()
+        registros = cotu_logic.extraer_registros(str(ruta_anio), indice=indice)
+        assert "COTU004" in {r[COL_FACTURA] for r in registros}
+        assert {r[COL_COMPANIA] for r in registros} == {"SOLIDARIA", "AURORA"}
+
+    @pytest.mark.parametrize("hilos", [1, 4])
+    def test_reescaneo_sin_cambios_sin_tocar_las_cotu(self, tmp_path, monkeypatch, hilos):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        aseguradora = ruta_anio / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "AURORA"
+        for n in range(100, 140):
+            (aseguradora / f"COTU{n}").mkdir()
+        (aseguradora / "COTU100" / "COTU100-A").mkdir()  # COTU dentro de COTU
+        _envejecer(ruta_anio)
+        indice = cotu_logic.IndiceEscaneo(str(tmp_path / "indice.sqlite"))
+        en_frio = cotu_logic.extraer_registros(str(ruta_anio), indice=indice, hilos=hilos)
+
+        stats, listados = [], []
+        stat, scandir = os.stat, os.scandir
+        monkeypatch.setattr(os, "stat", lambda ruta, *a, **k: stats.append(str(ruta)) or stat(ruta, *a, **k))
+        monkeypatch.setattr(os, "scandir", lambda ruta=".": listados.append(str(ruta)) or scandir(ruta))
+        en_caliente = cotu_logic.extraer_registros(str(ruta_anio), indice=indice, hilos=hilos)
+        monkeypatch.undo()
+
+        assert sorted(en_caliente) == sorted(en_frio)
+        assert "COTU100-A" in {r.factura for r in en_caliente}
+        # Un stat por carpeta AÑO/MES/DÍA/ASEGURADORA (y el de la comprobación de la base); ninguna COTU
+        carpetas = {os.path.relpath(r, ruta_anio) for r in stats}
+        assert carpetas == {".", "12-DICIEMBRE",
+                            os.path.join("12-DICIEMBRE", "23 DE DICIEMBRE"),
+                            os.path.join("12-DICIEMBRE", "23 DE DICIEMBRE", "SOLIDARIA"),
+                            os.path.join("12-DICIEMBRE", "24 DE DICIEMBRE"),
+                            os.path.join("12-DICIEMBRE", "24 DE DICIEMBRE", "AURORA")}
+        assert len(stats) <= len(carpetas) + 1
+        assert listados == []
+
+    def test_borra_carpetas_que_ya_no_existen(self, tmp_path):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        _envejecer(ruta_anio)
+        indice = cotu_logic.IndiceEscaneo(str(tmp_path / "indice.sqlite"))
+        cotu_logic.extraer_registros(str(ruta_anio), indice=indice)
+        mes = ruta_anio / "12-DICIEMBRE"
+        (mes / "24 DE DICIEMBRE").rename(mes / "25 DE DICIEMBRE")
+        os.rmdir(mes / "23 DE DICIEMBRE" / "SOLIDARIA" / "COTU002 ANULADA")
+        registros = cotu_logic.extraer_registros(str(ruta_anio), indice=indice)
+        assert {r.fecha for r in registros} == {"23 DE DICIEMBRE", "25 DE DICIEMBRE"}
+
+        with sqlite3.connect(indice.ruta_db) as con:
+            rutas = [fila[0] for fila in con.execute("SELECT ruta FROM directorios")]
+        assert rutas and not [r for r in rutas if "24 DE DICIEMBRE" in r or "COTU002" in r]
+        assert any("25 DE DICIEMBRE" in r for r in rutas)
+
+    def test_vaciar(self, tmp_path):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        _envejecer(ruta_anio)
+        indice = cotu_logic.IndiceEscaneo(str(tmp_path / "indice.sqlite"))
+        cotu_logic.extraer_registros(str(ruta_anio), indice=indice)
+        indice.vaciar()
+        sesion = indice.sesion(str(ruta_anio))
+        sesion.listar(str(ruta_anio))
+        assert sesion.listados == 1
+
+
+# --- _recorrer_paralelo ---
+class TestRecorridoParalelo:
+    """El recorrido en paralelo debe devolver lo mismo (y en el mismo orden) que el secuencial."""
+
+    def _arbol_profundo(self, base):
+        ruta_anio = _crear_arbol(base)
+        # COTU dentro de COTU y niveles por debajo de max_depth
+        profunda = ruta_anio / "12-DICIEMBRE" / "23 DE DICIEMBRE" / "SOLIDARIA" / "COTU001" / "COTU001-A" / "X" / "COTU999"
+        profunda.mkdir(parents=True)
+        (ruta_anio / "11-NOVIEMBRE" / "02 DE NOVIEMBRE" / "BOLIVAR" / "NOTAS").mkdir(parents=True)
+        return ruta_anio
+
+    def test_mismo_orden_que_secuencial(self, tmp_path):
+        ruta_anio = str(self._arbol_profundo(tmp_path))
+        for solo_cotu in (True, False):
+            secuencial = list(cotu_logic._recorrer(ruta_anio, cotu_logic._listar_subdirectorios, solo_cotu))
+            paralelo = list(cotu_logic._recorrer_paralelo(ruta_anio, cotu_logic._listar_subdirectorios, solo_cotu, hilos=4))
+            assert paralelo == secuencial
+
+    def test_registros_iguales_a_os_walk(self, tmp_path):
+        ruta_anio = str(self._arbol_profundo(tmp_path))
+        paralelo = cotu_logic.extraer_registros(ruta_anio, hilos=4)
+        secuencial = cotu_logic.extraer_registros(ruta_anio, hilos=1)
+        assert paralelo == secuencial
+        # COTU999 está a profundidad 7: fuera de max_depth
+        assert "COTU999" not in {r[COL_FACTURA] for r in paralelo}
+
+    def test_adelanto_acotado(self, tmp_path):
+        ruta_anio = str(self._arbol_profundo(tmp_path))
+        secuencial = list(cotu_logic._recorrer(ruta_anio, cotu_logic._listar_subdirectorios, False))
+        for adelanto in (0, 1, 3):
+            paralelo = list(cotu_logic._recorrer_paralelo(
+                ruta_anio, cotu_logic._listar_subdirectorios, False, hilos=4, adelanto=adelanto))
+            assert paralelo == secuencial
+
+    def test_cierre_anticipado(self, tmp_path):
+        ruta_anio = str(self._arbol_profundo(tmp_path))
+        recorrido = cotu_logic._recorrer_paralelo(ruta_anio, cotu_logic._listar_subdirectorios, True, hilos=2)
+        assert next(recorrido)[0] == ruta_anio
+        recorrido.close()
+
+
+# --- PodaFechas ---
+class TestPodaFechas:
+    """Tests para la poda por rango de fechas durante el recorrido."""
+
+    def test_decisiones_por_nivel(self):
+        poda = cotu_logic.PodaFechas(datetime(2025, 12, 23), datetime(2025, 12, 23))
+        ctx = poda.contexto_base("2025")
+        assert poda.hijo(ctx, "11-NOVIEMBRE")[0] is True
+        podar, ctx_mes = poda.hijo(ctx, "12-DICIEMBRE")
+        assert podar is False
+        assert poda.hijo(ctx_mes, "22 DE DICIEMBRE")[0] is True
+        assert poda.hijo(ctx_mes, "23 DE DICIEMBRE") == (False, None)
+        # Nombres no reconocidos: se recorren siempre
+        assert poda.hijo(ctx, "VARIOS") == (False, None)
+
+    def test_base_con_anios_dentro(self):
+        poda = cotu_logic.PodaFechas(datetime(2025, 1, 1), datetime(2025, 1, 31))
+        ctx = poda.contexto_base("FACTURACION")
+        assert poda.hijo(ctx, "2024")[0] is True
+        assert poda.hijo(ctx, "2025") == (False, ("2025", ""))
+
+    def test_un_dia_lista_una_sola_carpeta_dia(self, tmp_path, monkeypatch):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        (ruta_anio / "11-NOVIEMBRE" / "02 DE NOVIEMBRE" / "BOLIVAR" / "COTU010").mkdir(parents=True)
+        listadas = []
+        original = cotu_logic._listar_subdirectorios
+
+        def _contar(ruta):
+            listadas.append(ruta)
+            return original(ruta)
+
+        monkeypatch.setattr(cotu_logic, "_listar_subdirectorios", _contar)
+        fecha = datetime(2025, 12, 24)
+        registros = cotu_logic.extraer_registros(str(ruta_anio), fecha, fecha, hilos=1)
+        assert [r[COL_FACTURA] for r in registros] == ["COTU003"]
+        dias = [r for r in listadas if os.path.basename(r).endswith("DE DICIEMBRE") or "NOVIEMBRE" in r]
+        assert [os.path.basename(r) for r in dias] == ["24 DE DICIEMBRE"]
+
+
+# --- resolver_carpetas_dia ---
+class TestResolverCarpetasDia:
+    """Tests para la ruta directa de reportes diarios."""
+
+    def test_variantes_de_nombre(self, tmp_path):
+        anio = tmp_path / "2025"
+        (anio / "12-DICIEMBRE" / "23 DE DICIEMBRE" / "SOLIDARIA" / "COTU1").mkdir(parents=True)
+        (anio / "DICIEMBRE" / "23 DICIEMBRE" / "AURORA" / "COTU2").mkdir(parents=True)
+        (anio / "DICIEMBRE" / "24 DE DICIEMBRE" / "AURORA" / "COTU3").mkdir(parents=True)
+        dias = cotu_logic.resolver_carpetas_dia(str(anio), datetime(2025, 12, 23))
+        assert sorted(os.path.relpath(r, anio) for r, _ in dias) == [
+            os.path.join("12-DICIEMBRE", "23 DE DICIEMBRE"),
+            os.path.join("DICIEMBRE", "23 DICIEMBRE"),
+        ]
+        assert {depth for _, depth in dias} == {2}
+
+    def test_base_con_anios_dentro(self, tmp_path):
+        (tmp_path / "FACT" / "2025" / "01-ENERO" / "05 DE ENERO" / "SOL" / "COTU9").mkdir(parents=True)
+        dias = cotu_logic.resolver_carpetas_dia(str(tmp_path / "FACT"), datetime(2025, 1, 5))
+        assert [depth for _, depth in dias] == [3]
+        registros = cotu_logic.extraer_registros(str(tmp_path / "FACT"), datetime(2025, 1, 5), datetime(2025, 1, 5))
+        assert [(r[COL_FACTURA], r["AÑO"]) for r in registros] == [("COTU9", "2025")]
+
+    def test_sin_candidatos_usa_recorrido_podado(self, tmp_path):
+        # Estructura no estándar: la base no es un año ni contiene la carpeta del año
+        (tmp_path / "FACTURAS 2025" / "DICIEMBRE" / "23 DE DICIEMBRE" / "SOL" / "COTU5").mkdir(parents=True)
+        base = str(tmp_path / "FACTURAS 2025")
+        fecha = datetime(2025, 12, 23)
+        assert cotu_logic.resolver_carpetas_dia(base, fecha) == []
+        registros = cotu_logic.extraer_registros(base, fecha, fecha)
+        assert [r[COL_FACTURA] for r in registros] == ["COTU5"]
+
+
+# --- parsear_fechas_carpetas ---
+class TestParsearFechasCarpetas:
+    """Tests para el parser de fechas memoizado y su versión por lotes."""
+
+    def test_lote_parsea_cada_triple_una_vez(self):
+        triples = [("23 DE DICIEMBRE", "12-DICIEMBRE", "2025")] * 1000 + [("31 DE FEBRERO", "FEBRERO", "2025")]
+        fechas = cotu_logic.parsear_fechas_carpetas(triples)
+        assert fechas == {
+            ("23 DE DICIEMBRE", "12-DICIEMBRE", "2025"): datetime(2025, 12, 23),
+            ("31 DE FEBRERO", "FEBRERO", "2025"): None,
+        }
+
+    def test_cache_reutiliza_resultado(self):
+        cotu_logic._parsear_fecha_cacheada.cache_clear()
+        for _ in range(3):
+            assert cotu_logic.parsear_fecha_carpeta("02 DE AGOSTO", "08-AGOSTO", "2025") == datetime(2025, 8, 2)
+        info = cotu_logic._parsear_fecha_cacheada.cache_info()
+        assert info.misses == 1 and info.hits == 2
+
+    def test_valores_no_texto(self):
+        assert cotu_logic.parsear_fecha_carpeta(float("nan"), "AGOSTO", "2025") is None
+        assert cotu_logic.parsear_fecha_carpeta("2", ["AGOSTO"], "2025") is None
+
+
+# --- exportar_csv ---
+class TestExportarCsv:
+    """Tests para la exportación CSV en streaming."""
+
+    def test_igual_que_pandas(self, tmp_path):
+        pd = pytest.importorskip("pandas")
+        registros = cotu_logic.extraer_registros(str(_crear_arbol(tmp_path / "arbol")))
+        for resumido in (False, True):
+            ruta = tmp_path / f"stream_{resumido}.csv"
+            assert cotu_logic.exportar_csv(iter(registros), str(ruta), resumido) == 3
+            df = pd.DataFrame([r.a_dict() for r in registros])
+            if resumido:
+                df = df[[cotu_logic.COL_FECHA, COL_FACTURA, COL_COMPANIA]].rename(
+                    columns={cotu_logic.COL_FECHA: "FECHA", COL_FACTURA: "COTU", COL_COMPANIA: "ASEGURADORA"})
+            esperado = tmp_path / f"pandas_{resumido}.csv"
+            df.to_csv(esperado, index=False, encoding="utf-8-sig")
+            assert ruta.read_bytes() == esperado.read_bytes()
+
+    def test_sin_registros_no_deja_archivo(self, tmp_path):
+        ruta = tmp_path / "vacio.csv"
+        assert cotu_logic.exportar_csv(iter([]), str(ruta)) == 0
+        assert not ruta.exists()
+
+    def test_filtrar_iterable(self):
+        registros = [
+            {"AÑO": "2025", "MES": "DICIEMBRE", cotu_logic.COL_FECHA: "20 DE DICIEMBRE", COL_FACTURA: "COTU1"},
+            {"AÑO": "2025", "MES": "DICIEMBRE", cotu_logic.COL_FECHA: "25 DE DICIEMBRE", COL_FACTURA: "COTU2"},
+        ]
+        filtrados = cotu_logic.filtrar_iterable(iter(registros), datetime(2025, 12, 21), datetime(2025, 12, 31))
+        assert [r[COL_FACTURA] for r in filtrados] == ["COTU2"]
+
+
+# --- escribir_excel ---
+class TestEscribirExcel:
+    """Tests para la escritura xlsx en streaming."""
+
+    def test_hoja_filtro_orden_y_anchos(self, tmp_path):
+        pytest.importorskip("pandas")
+        openpyxl = pytest.importorskip("openpyxl")
+        registros = cotu_logic.extraer_registros(str(_crear_arbol(tmp_path / "arbol")))
+        df = cotu_logic.dataframe_reporte(list(reversed(registros)), formato_resumido=True)
+        ruta = tmp_path / "reporte.xlsx"
+        assert cotu_logic.escribir_excel(df, str(ruta), "NOVEDADES ANUALES", "openpyxl") == "openpyxl"
+        hoja = openpyxl.load_workbook(ruta)["NOVEDADES ANUALES"]
+        filas = list(hoja.iter_rows(values_only=True))
+        assert filas[0] == ("FECHA", "COTU", "ASEGURADORA")
+        assert [f[1] for f in filas[1:]] == ["COTU001", "COTU002", "COTU003"]
+        assert hoja.auto_filter.ref == "A1:C4"
+        assert hoja.column_dimensions["A"].width == len("23 DE DICIEMBRE") + 2
+        assert hoja.column_dimensions["C"].width == len("ASEGURADORA") + 2
+
+    def test_anchos_columnas_con_tope(self):
+        pd = pytest.importorskip("pandas")
+        df = pd.DataFrame({"A": ["x", "", "abcd"], "LARGA": ["y" * 80, "z", ""]})
+        assert cotu_logic.anchos_columnas(df) == [len("abcd") + 2, cotu_logic.ANCHO_MAX_COLUMNA]
+        assert cotu_logic.anchos_columnas(df.iloc[0:0]) == [3, 7]
+
+
+# --- modo por lotes ---
+class TestCli:
+    """Tests para el modo por línea de comandos."""
+
+    def test_report_csv_mes(self, tmp_path, capsys):
+        anio = _crear_arbol(tmp_path)
+        codigo = cotu_logic.main_cli(["report", "--ruta", str(anio), "--tipo", "Mes", "--desde", "24/12/2025",
+                                      "--hasta", "31/12/2025", "--formato", "csv", "--resumido"])
+        assert codigo == 0
+        ruta = anio / "cotus_mes_20251224_20251231.csv"
+        assert capsys.readouterr().out.strip() == str(ruta)
+        assert ruta.read_text(encoding="utf-8-sig").splitlines() == ["FECHA,COTU,ASEGURADORA", "24 DE DICIEMBRE,COTU003,AURORA"]
+
+    def test_sin_facturas_devuelve_1(self, tmp_path):
+        anio = _crear_arbol(tmp_path)
+        assert cotu_logic.main_cli(["report", "--ruta", str(anio), "--tipo", "dia", "--desde", "01/12/2025",
+                                    "--formato", "csv"]) == 1
+        assert not list(anio.glob("cotus_*"))
+
+    def test_fechas_obligatorias(self, tmp_path):
+        with pytest.raises(SystemExit):
+            cotu_logic.main_cli(["report", "--ruta", str(tmp_path), "--tipo", "Semana", "--desde", "01/12/2025"])
+
+    def test_fecha_invalida_conserva_la_causa(self):
+        with pytest.raises(argparse.ArgumentTypeError) as exc:
+            cotu_logic._fecha_cli("31-12-2025")
+        assert isinstance(exc.value.__cause__, ValueError)
+
+    def _ejecutar_sin_gui(self, argumentos, appdata=None):
+        """Ejecuta generador_facturas_cotu.py como script; devuelve 'código tkinter ttkbootstrap'."""
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        codigo = (
+            "import runpy, sys\n"
+            f"sys.argv = ['generador_facturas_cotu.py'] + {argumentos!r}\n"
+            "try:\n"
+            f"    runpy.run_path({os.path.join(raiz, 'generador_facturas_cotu.py')!r}, run_name='__main__')\n"
+            "except SystemExit as e:\n"
+            "    print(e.code, 'tkinter' in sys.modules, 'ttkbootstrap' in sys.modules)\n"
+        )
+        entorno = dict(os.environ, APPDATA=str(appdata)) if appdata else None
+        res = subprocess.run([sys.executable, "-c", codigo], cwd=raiz, capture_output=True, text=True, env=entorno)
+        return res.stdout.strip().splitlines()[-1]
+
+    def test_no_importa_tkinter(self, tmp_path):
+        anio = _crear_arbol(tmp_path)
+        assert self._ejecutar_sin_gui(["report", "--ruta", str(anio), "--formato", "csv"]) == "0 False False"
+        assert (anio / "cotus_2025.csv").exists()
+
+    def test_registra_rendimiento_en_el_log(self, tmp_path):
+        anio = _crear_arbol(tmp_path / "arbol")
+        appdata = tmp_path / "appdata"
+        assert self._ejecutar_sin_gui(["report", "--ruta", str(anio), "--formato", "csv"], appdata) == "0 False False"
+        log = (appdata / "GeneradorCOTU" / "generador_cotu.log").read_text(encoding="utf-8")
+        assert "Rendimiento {" in log
+
+    def test_diff_no_importa_tkinter(self, tmp_path):
+        pytest.importorskip("pandas")
+        pytest.importorskip("openpyxl")
+        anio = _crear_arbol(tmp_path)
+        assert self._ejecutar_sin_gui(["diff", "--ruta", str(anio), "--tipo", "Mes", "--desde", "01/12/2025",
+                                       "--hasta", "31/12/2025", "--periodo-anterior"]) == "0 False False"
+        assert (anio / "cotus_periodos_20251201_20251231.xlsx").exists()
+
+
+# --- árbol sintético y benchmark ---
+class TestArbolSintetico:
+    """Tests para el generador de árboles de benchmarks/."""
+
+    def test_total_exacto_y_variantes(self, tmp_path):
+        from benchmarks.arbol_sintetico import dimensiones_para, generar_arbol
+        dims = dimensiones_para(500, meses=2, dias=3, aseguradoras=4)
+        arbol = generar_arbol(str(tmp_path), **dims, proporcion_detalle=0.5, proporcion_duplicados=0.05)
+        assert arbol["facturas"] == 500
+        registros = cotu_logic.extraer_registros(arbol["carpetas_anio"][0])
+        assert len(registros) == 500
+        assert all(cotu_logic.parsear_fecha_carpeta(r[cotu_logic.COL_FECHA], r[cotu_logic.COL_MES], r[cotu_logic.COL_ANIO])
+                   for r in registros)
+        assert any(r[cotu_logic.COL_DETALLE] for r in registros)
+        assert cotu_logic.verificar_duplicados(registros)
+        # Mismos parámetros: se reutiliza sin volver a crear carpetas
+        assert generar_arbol(str(tmp_path), **dims, proporcion_detalle=0.5, proporcion_duplicados=0.05) == arbol
+
+    def test_ejecutar_benchmark(self, tmp_path):
+        from benchmarks.bench_cotu import ejecutar
+        resultado = ejecutar(300, str(tmp_path), memoria=False, excel=False, hilos=2)
+        fases = {f["fase"]: f for f in resultado["fases"]}
+        assert resultado["facturas"] == 300
+        assert fases["extraer"]["resultado"] == fases["csv"]["resultado"] == 300
+        assert set(fases) == {"extraer", "filtrar", "duplicados", "estadisticas", "csv"}
+
+
+# --- cancelación ---
+class _TokenTras(cotu_logic.TokenCancelacion):
+    """Token que se cancela solo tras `n` comprobaciones."""
+
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+
+    def comprobar(self):
+        self.n -= 1
+        if self.n < 0:
+            self.cancelar()
+        super().comprobar()
+
+
+class TestCancelacion:
+    """Tests para la cancelación cooperativa del escaneo, filtros y escritores."""
+
+    @pytest.mark.parametrize("hilos", [1, 4])
+    def test_extraer_conserva_parciales(self, tmp_path, hilos):
+        anio = _crear_arbol(tmp_path)
+        # 2025, 12-DICIEMBRE, 23 DE DICIEMBRE, SOLIDARIA (2 COTU) y COTU001; se cancela en la siguiente carpeta
+        with pytest.raises(cotu_logic.Cancelado) as exc:
+            cotu_logic.extraer_registros(str(anio), hilos=hilos, cancelacion=_TokenTras(5))
+        assert sorted(r[COL_FACTURA] for r in exc.value.registros) == ["COTU001", "COTU002"]
+
+    def test_token_ya_cancelado(self, tmp_path):
+        token = cotu_logic.TokenCancelacion()
+        token.cancelar()
+        assert token.cancelado
+        with pytest.raises(cotu_logic.Cancelado):
+            cotu_logic.filtrar_registros([{}] * 10, datetime(2025, 1, 1), None, token)
+
+    def test_csv_cancelado_no_deja_archivo(self, tmp_path):
+        anio = _crear_arbol(tmp_path / "arbol")
+        ruta = tmp_path / "salida.csv"
+        token = cotu_logic.TokenCancelacion()
+        registros = cotu_logic.iterar_registros(str(anio), cancelacion=token)
+        # Se cancela después de escribir la primera fila
+        filas = (token.cancelar() or r if i else r for i, r in enumerate(registros))
+        with pytest.raises(cotu_logic.Cancelado):
+            cotu_logic.exportar_csv(filas, str(ruta))
+        assert not ruta.exists()
+
+    def test_excel_cancelado_no_deja_archivo(self, tmp_path):
+        pd = pytest.importorskip("pandas")
+        pytest.importorskip("openpyxl")
+        token = cotu_logic.TokenCancelacion()
+        token.cancelar()
+        ruta = tmp_path / "reporte.xlsx"
+        with pytest.raises(cotu_logic.Cancelado):
+            cotu_logic.escribir_excel(pd.DataFrame({"A": [1, 2]}), str(ruta), "HOJA", "openpyxl", token)
+        assert not ruta.exists()
+
+
+# --- ejecutor de trabajos ---
+class TestEjecutorTrabajos:
+    """Tests para la cola de escaneos con peticiones idénticas unidas."""
+
+    def test_peticiones_identicas_se_unen(self):
+        ejecutor = cotu_logic.EjecutorTrabajos()
+        liberar = threading.Event()
+        llamadas = []
+
+        def escaneo(_token):
+            llamadas.append(1)
+            liberar.wait(5)
+            return ["registro"]
+
+        f1 = ejecutor.enviar(("ruta", "Mes"), escaneo)
+        f2 = ejecutor.enviar(("ruta", "Mes"), escaneo)
+        assert f1 is f2 and ejecutor.en_curso(("ruta", "Mes"))
+        liberar.set()
+        assert cotu_logic.esperar_resultado(f1) == ["registro"]
+        assert llamadas == [1]
+        assert not ejecutor.en_curso(("ruta", "Mes"))
+        # Terminado el escaneo, una petición nueva vuelve a ejecutarse
+        assert ejecutor.enviar(("ruta", "Mes"), escaneo).result(5) == ["registro"]
+        assert llamadas == [1, 1]
+
+    def test_trabajos_de_uno_en_uno(self):
+        ejecutor = cotu_logic.EjecutorTrabajos()
+        activos, maximo = [0], [0]
+        lock = threading.Lock()
+
+        def trabajo(_token):
+            with lock:
+                activos[0] += 1
+                maximo[0] = max(maximo[0], activos[0])
+            threading.Event().wait(0.02)
+            with lock:
+                activos[0] -= 1
+
+        futuros = [ejecutor.enviar(None, trabajo) for _ in range(4)]
+        for f in futuros:
+            f.result(5)
+        assert maximo[0] == 1
+
+    def test_cancelar_solo_si_cancelan_todos(self, monkeypatch):
+        monkeypatch.setattr(cotu_logic, "ESPERA_PARCIALES_S", 0.2)
+        ejecutor = cotu_logic.EjecutorTrabajos()
+        visto = threading.Event()
+
+        def escaneo(token):
+            visto.set()
+            while not token.cancelado:
+                threading.Event().wait(0.01)
+            raise cotu_logic.Cancelado(registros=["parcial"])
+
+        t1, t2 = cotu_logic.TokenCancelacion(), cotu_logic.TokenCancelacion()
+        futuro = ejecutor.enviar("clave", escaneo, t1)
+        ejecutor.enviar("clave", escaneo, t2)
+        visto.wait(5)
+        t1.cancelar()
+        with pytest.raises(cotu_logic.Cancelado) as exc:
+            cotu_logic.esperar_resultado(futuro, t1)
+        # t2 sigue esperando: el escaneo no se detuvo ni devolvió parciales a t1
+        assert exc.value.registros == [] and not futuro.done()
+        t2.cancelar()
+        with pytest.raises(cotu_logic.Cancelado) as exc:
+            cotu_logic.esperar_resultado(futuro, t2)
+        assert exc.value.registros == ["parcial"]
+
+
+# --- caché de resultados ---
+class TestCacheResultados:
+    """Tests para la caché en memoria de resultados de escaneo."""
+
+    def _escanear(self, ruta, **opciones):
+        firmas = {}
+        registros = cotu_logic.extraer_registros(str(ruta), firmas=firmas, **opciones)
+        return firmas, registros
+
+    def test_reutiliza_hasta_ttl(self, tmp_path):
+        anio = _crear_arbol(tmp_path)
+        ahora = [0.0]
+        cache = cotu_logic.CacheResultados(ttl_s=60, reloj=lambda: ahora[0])
+        firmas, registros = self._escanear(anio)
+        cache.guardar("clave", firmas, registros)
+        ahora[0] = 59
+        assert cache.obtener("clave") is registros
+        ahora[0] = 61
+        assert cache.obtener("clave") is None
+
+    def test_firmas_sin_carpetas_cotu(self, tmp_path):
+        anio = _crear_arbol(tmp_path)
+        firmas, _ = self._escanear(anio, hilos=1)
+        nombres = {os.path.relpath(r, anio) for r in firmas}
+        assert nombres == {".", "12-DICIEMBRE", os.path.join("12-DICIEMBRE", "23 DE DICIEMBRE"),
+                           os.path.join("12-DICIEMBRE", "24 DE DICIEMBRE"),
+                           os.path.join("12-DICIEMBRE", "23 DE DICIEMBRE", "SOLIDARIA"),
+                           os.path.join("12-DICIEMBRE", "24 DE DICIEMBRE", "AURORA")}
+
+    @pytest.mark.parametrize("cambio", ["nueva", "renombrada", "borrada", "mes"])
+    def test_invalida_si_cambia_una_carpeta_cotu(self, tmp_path, cambio):
+        anio = _crear_arbol(tmp_path)
+        _envejecer(anio)
+        cache = cotu_logic.CacheResultados()
+        firmas, registros = self._escanear(anio)
+        cache.guardar("clave", firmas, registros)
+        assert cache.obtener("clave") is registros
+        aseguradora = anio / "12-DICIEMBRE" / "23 DE DICIEMBRE" / "SOLIDARIA"
+        if cambio == "nueva":
+            (aseguradora / "COTU099").mkdir()
+        elif cambio == "renombrada":
+            (aseguradora / "COTU001").rename(aseguradora / "COTU001 ANULADA")
+        elif cambio == "borrada":
+            os.rmdir(aseguradora / "COTU001")
+        else:
+            (anio / "01-ENERO").mkdir()
+        assert cache.obtener("clave") is None
+
+    def test_carpetas_podadas_no_invalidan(self, tmp_path):
+        anio = _crear_arbol(tmp_path)
+        noviembre = anio / "11-NOVIEMBRE" / "02 DE NOVIEMBRE" / "AURORA"
+        noviembre.mkdir(parents=True)
+        _envejecer(anio)
+        cache = cotu_logic.CacheResultados()
+        firmas, registros = self._escanear(anio, fecha_inicio=datetime(2025, 12, 1), fecha_fin=datetime(2025, 12, 31))
+        cache.guardar("clave", firmas, registros)
+        (noviembre / "COTU050").mkdir()  # Fuera del rango escaneado
+        assert cache.obtener("clave") is registros
+
+    def test_firma_en_paralelo(self, tmp_path):
+        anio = _crear_arbol(tmp_path)
+        firmas, _ = self._escanear(anio)
+        assert cotu_logic.firma_vigente(firmas, hilos=2)
+        assert not cotu_logic.firma_vigente({})
+        firmas[str(tmp_path / "no_existe")] = 1
+        assert not cotu_logic.firma_vigente(firmas, hilos=2)
+
+    def test_limite_de_entradas(self, tmp_path):
+        cache = cotu_logic.CacheResultados(max_entradas=2)
+        firmas = {str(tmp_path): os.stat(tmp_path).st_mtime_ns}
+        for clave in ("a", "b"):
+            cache.guardar(clave, firmas, [clave])
+        assert cache.obtener("a") == ["a"]  # "a" pasa a ser la más reciente
+        cache.guardar("c", firmas, ["c"])
+        assert cache.obtener("b") is None
+        assert cache.obtener("a") == ["a"] and cache.obtener("c") == ["c"]
+
+
+# --- búsqueda en la vista previa ---
+class TestIndiceBusqueda:
+    """Tests para la búsqueda indexada de la vista previa."""
+
+    def _registros(self):
+        return [
+            {cotu_logic.COL_FECHA: "23 DE DICIEMBRE", COL_FACTURA: "COTU74335", COL_COMPANIA: "SOLIDARIA"},
+            {cotu_logic.COL_FECHA: "24 DE DICIEMBRE", COL_FACTURA: "COTU74336", COL_COMPANIA: "COMPAÑÍA ÁGIL"},
+            {cotu_logic.COL_FECHA: "02 DE ENERO", COL_FACTURA: "COTU80001", COL_COMPANIA: "AURORA"},
+        ]
+
+    def test_busca_en_todas_las_columnas_sin_tildes(self):
+        indice = cotu_logic.IndiceBusqueda(self._registros())
+        assert [r[COL_FACTURA] for r in indice.buscar("diciembre")] == ["COTU74335", "COTU74336"]
+        assert [r[COL_FACTURA] for r in indice.buscar("compania agil")] == ["COTU74336"]
+        assert [r[COL_FACTURA] for r in indice.buscar("ÁGIL")] == ["COTU74336"]
+        assert len(indice.buscar("  ")) == 3
+
+    def test_estrecha_el_resultado_anterior(self):
+        registros = self._registros()
+        indice = cotu_logic.IndiceBusqueda(registros)
+        assert len(indice.buscar("COTU7")) == 2
+        # Consulta más larga: solo se revisan los 2 candidatos anteriores
+        indice._claves[2] = "COTU74335"  # fuera de los candidatos: no debe aparecer
+        assert [r[COL_FACTURA] for r in indice.buscar("COTU7433")] == ["COTU74335", "COTU74336"]
+        assert [r[COL_FACTURA] for r in indice.buscar("COTU74335")] == ["COTU74335"]
+        # Consulta que no contiene a la anterior: búsqueda completa
+        assert [r[COL_FACTURA] for r in indice.buscar("74335")] == ["COTU74335", "COTU80001"]
+
+    def test_no_cruza_columnas(self):
+        indice = cotu_logic.IndiceBusqueda(self._registros())
+        assert indice.buscar("COTU74335SOLIDARIA") == []
+
+
+class TestResumenRegistros:
+    """Tests para estadísticas y duplicados agregados durante la extracción."""
+
+    def _arbol_con_duplicado(self, base):
+        ruta_anio = _crear_arbol(base)
+        (ruta_anio / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "AURORA" / "COTU001").mkdir()
+        return ruta_anio
+
+    def test_extraer_agrega_en_la_misma_pasada(self, tmp_path):
+        registros = cotu_logic.extraer_registros(str(self._arbol_con_duplicado(tmp_path / "arbol")))
+        resumen = registros.resumen
+        assert resumen.total == len(registros) == 4
+        assert resumen.por_compania == {"SOLIDARIA": 2, "AURORA": 2}
+        assert resumen.numeros_repetidos == ["COTU001"]
+        assert cotu_logic.verificar_duplicados(registros) == resumen.duplicados()
+        assert cotu_logic.calcular_estadisticas(registros).startswith("Total Facturas: 4")
+
+    def test_filtrar_recalcula_para_el_subconjunto(self, tmp_path):
+        registros = cotu_logic.extraer_registros(str(self._arbol_con_duplicado(tmp_path / "arbol")))
+        dia = datetime(2025, 12, 24)
+        filtrados = cotu_logic.filtrar_registros(registros, dia, dia)
+        assert filtrados.resumen is not registros.resumen
+        assert filtrados.resumen.por_compania == {"AURORA": 2}
+        assert cotu_logic.verificar_duplicados(filtrados) == []
+
+    def test_lista_simple_mismo_formato(self):
+        registros = [
+            {cotu_logic.COL_FECHA: "23 DE DICIEMBRE", COL_FACTURA: "COTU1", COL_COMPANIA: "SOLIDARIA"},
+            {cotu_logic.COL_FECHA: "24 DE DICIEMBRE", COL_FACTURA: "cotu1 ", COL_COMPANIA: "AURORA"},
+            {cotu_logic.COL_FECHA: "24 DE DICIEMBRE", COL_FACTURA: "COTU1", COL_COMPANIA: "AURORA"},
+        ]
+        assert cotu_logic.verificar_duplicados(registros) == [
+            "Factura COTU1 aparece 3 veces (Fechas: 23 DE DICIEMBRE, 24 DE DICIEMBRE - Cia: SOLIDARIA, AURORA)"
+        ]
+        assert cotu_logic.calcular_estadisticas(registros).splitlines()[2:] == ["AURORA: 2 (66.7%)", "SOLIDARIA: 1 (33.3%)"]
+        assert cotu_logic.calcular_estadisticas([]) == "No hay registros."
+
+
+class TestRegistro:
+    """Tests para el registro compacto de una carpeta COTU."""
+
+    def test_acceso_como_dict(self, tmp_path):
+        registros = cotu_logic.extraer_registros(str(_crear_arbol(tmp_path / "arbol")))
+        reg = min(registros, key=lambda r: r.factura)
+        assert isinstance(reg, cotu_logic.Registro)
+        assert reg[COL_FACTURA] == reg.factura == "COTU001"
+        assert reg.get(COL_COMPANIA) == "SOLIDARIA"
+        assert reg.get("NO EXISTE", "") == ""
+        assert reg.keys() == cotu_logic.COLUMNAS
+        assert reg.a_dict()[cotu_logic.COL_ANIO] == "2025"
+        with pytest.raises(KeyError):
+            reg["NO EXISTE"]
+
+    def test_comparte_cadenas_de_carpeta(self, tmp_path):
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        (ruta_anio / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "SOLIDARIA" / "COTU004").mkdir(parents=True)
+        registros = cotu_logic.extraer_registros(str(ruta_anio), hilos=1)
+        solidaria = [r for r in registros if r.compania == "SOLIDARIA"]
+        assert len(solidaria) == 3
+        assert all(r.compania is solidaria[0].compania for r in solidaria)
+        assert all(r.mes is solidaria[0].mes for r in registros)
+        assert sys.getsizeof(registros[0]) < sys.getsizeof(registros[0].a_dict())
+
+    def _sin_compartir(self, ruta_base, solo_cotu):
+        """Registros calculando año, mes, día y aseguradora para cada carpeta, como os.walk."""
+        esperados = []
+        for raiz, dirs, _ in os.walk(ruta_base):
+            for d in dirs:
+                if not solo_cotu or d.upper().startswith("COTU"):
+                    esperados.append(cotu_logic.registro_desde_ruta(os.path.join(raiz, d), ruta_base, "FACTURACION"))
+        return esperados
+
+    def test_base_por_encima_de_los_anios(self, tmp_path, monkeypatch):
+        # Ruta relativa corta: los campos se calculan respecto a la carpeta base
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "FACTURACION" / "2024" / "12-DICIEMBRE" / "23 DE DICIEMBRE" / "SOLIDARIA" / "COTU001").mkdir(parents=True)
+        (tmp_path / "FACTURACION" / "2025" / "01-ENERO" / "02 DE ENERO" / "AURORA" / "COTU002").mkdir(parents=True)
+        # Listados ordenados: "2024" va antes que "2025" en la misma carpeta base
+        listar = cotu_logic._listar_subdirectorios
+        monkeypatch.setattr(cotu_logic, "_listar_subdirectorios", lambda ruta: sorted(listar(ruta)))
+        registros = cotu_logic.extraer_registros("FACTURACION", solo_cotu=False, hilos=1)
+        anios = {r.factura: r.anio for r in registros if r.factura in ("2024", "2025")}
+        assert anios == {"2024": "2024", "2025": "2025"}
+        assert sorted(registros) == sorted(self._sin_compartir("FACTURACION", solo_cotu=False))
+
+    def test_rango_no_descarta_hermanas_de_otra_fecha(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        mes = tmp_path / "2025" / "12-DICIEMBRE"
+        for dia in ("01 DE DICIEMBRE", "24 DE DICIEMBRE"):
+            (mes / dia / "AURORA" / "COTU001").mkdir(parents=True)
+        listar = cotu_logic._listar_subdirectorios
+        monkeypatch.setattr(cotu_logic, "_listar_subdirectorios", lambda ruta: sorted(listar(ruta)))
+        registros = cotu_logic.extraer_registros("2025", datetime(2025, 12, 20), datetime(2025, 12, 31),
+                                                 solo_cotu=False, hilos=1)
+        # La carpeta "01 DE DICIEMBRE" (fuera del rango) no oculta a "24 DE DICIEMBRE"
+        assert "24 DE DICIEMBRE" in {r.fecha for r in registros if r.compania == ""}
+        assert "01 DE DICIEMBRE" not in {r.fecha for r in registros}
+
+    def test_dataframe_por_columnas(self, tmp_path):
+        pytest.importorskip("pandas")
+        registros = cotu_logic.extraer_registros(str(_crear_arbol(tmp_path / "arbol")))
+        df = cotu_logic.dataframe_registros(registros)
+        assert list(df.columns) == cotu_logic.COLUMNAS
+        assert df[COL_FACTURA].tolist() == [r.factura for r in registros]
+        assert list(cotu_logic.dataframe_registros([r.a_dict() for r in registros]).columns) == cotu_logic.COLUMNAS
+
+
+class TestMedicionRendimiento:
+    """Tests para la medición de tiempos por fase."""
+
+    def test_fases_disjuntas(self):
+        ahora = [0.0]
+        medicion = cotu_logic.MedicionRendimiento("Excel", reloj=lambda: ahora[0])
+        with medicion.fase("espera"):
+            ahora[0] += 1.0
+            with medicion.fase("escaneo"):
+                ahora[0] += 3.0
+        medicion.agregar("escaneo", 1.0)
+        ahora[0] += 0.5
+        medicion.terminar()
+        assert medicion.fases == {"espera": 1.0, "escaneo": 4.0}
+        assert medicion.total_s == 4.5
+
+    def test_extraer_cuenta_carpetas_y_registros(self, tmp_path, caplog):
+        ruta_anio = str(_crear_arbol(tmp_path / "arbol"))
+        medicion = cotu_logic.MedicionRendimiento("Vista previa")
+        registros = cotu_logic.extraer_registros(ruta_anio, datetime(2025, 12, 1), datetime(2025, 12, 31),
+                                                 hilos=1, medicion=medicion)
+        assert medicion.registros == len(registros) == 3
+        assert medicion.carpetas > 0
+        assert {"escaneo", "fechas", "agregar"} <= set(medicion.fases)
+        with caplog.at_level("INFO", logger="GeneradorCOTU"):
+            datos = medicion.terminar().registrar()
+        assert datos["registros"] == 3 and datos["estado"] == "ok"
+        assert any(m.startswith("Rendimiento {") for m in caplog.messages)
+        assert "carpetas/s" in medicion.texto()
+
+    def test_generar_reporte_csv(self, tmp_path):
+        ruta_anio = str(_crear_arbol(tmp_path / "arbol"))
+        medicion = cotu_logic.MedicionRendimiento("Lote csv")
+        ruta, total = cotu_logic.generar_reporte(ruta_anio, cotu_logic.TIPO_MES, datetime(2025, 12, 1),
+                                                 datetime(2025, 12, 31), "csv", medicion=medicion)
+        assert total == 3 and os.path.exists(ruta)
+        assert {"escaneo", "csv"} <= set(medicion.fases)
+        assert medicion.registros == 3
+
+
+class TestHistorialReportes:
+    """Tests para el historial de reportes en SQLite."""
+
+    def test_sin_limite_y_por_paginas(self, tmp_path):
+        historial = cotu_logic.HistorialReportes(str(tmp_path / "historial.sqlite"))
+        for i in range(120):
+            historial.agregar("Mes", f"reporte_{i}.xlsx", f"/r/reporte_{i}.xlsx", i, duracion_s=1.234)
+        assert historial.total() == 120
+        primera = historial.pagina(0, 50)
+        assert [e["archivo"] for e in primera[:2]] == ["reporte_119.xlsx", "reporte_118.xlsx"]
+        assert primera[0]["duracion_s"] == 1.23 and primera[0]["formato"] == "xlsx"
+        assert [e["archivo"] for e in historial.pagina(100, 50)][-1] == "reporte_0.xlsx"
+        assert len(historial.pagina(100, 50)) == 20
+        assert historial.pagina(200) == []
+        # Persistente: otra instancia lee lo mismo
+        otra = cotu_logic.HistorialReportes(str(tmp_path / "historial.sqlite"))
+        assert otra.pagina(0, 1) == primera[:1]
+
+    def test_agregar_tras_leer_actualiza_la_cache(self, tmp_path):
+        historial = cotu_logic.HistorialReportes(str(tmp_path / "historial.sqlite"))
+        historial.agregar("Año", "a.xlsx", "/r/a.xlsx", 1)
+        assert historial.total() == 1
+        historial.agregar("Día", "b.csv", "/r/b.csv", 2, formato="csv")
+        assert [e["archivo"] for e in historial.pagina()] == ["b.csv", "a.xlsx"]
+
+    def test_importa_json_anterior_una_vez(self, tmp_path):
+        ruta_json = tmp_path / "historial_reportes.json"
+        ruta_json.write_text(
+            '[{"fecha": "2025-01-02 10:00:00", "tipo": "Mes", "archivo": "nuevo.xlsx", "ruta": "/r", "total_facturas": 5},'
+            ' {"fecha": "2025-01-01 10:00:00", "tipo": "Día", "archivo": "viejo.xlsx", "ruta": "/r", "total_facturas": 1}]',
+            encoding="utf-8",
+        )
+        ruta_db = str(tmp_path / "historial.sqlite")
+        historial = cotu_logic.HistorialReportes(ruta_db, str(ruta_json))
+        assert [e["archivo"] for e in historial.pagina()] == ["nuevo.xlsx", "viejo.xlsx"]
+        assert historial.pagina()[0]["duracion_s"] is None
+        assert cotu_logic.HistorialReportes(ruta_db, str(ruta_json)).total() == 2
+
+
+class TestGuardadoDiferido:
+    """Tests para el guardado atómico y diferido de config.json."""
+
+    def test_escritura_fallida_conserva_el_archivo(self, tmp_path):
+        ruta = tmp_path / "config.json"
+        cotu_logic.escribir_json_atomico(str(ruta), {"tema_oscuro": True})
+        with pytest.raises(TypeError):
+            cotu_logic.escribir_json_atomico(str(ruta), {"tema_oscuro": object()})
+        assert ruta.read_text(encoding="utf-8") == '{\n  "tema_oscuro": true\n}'
+        assert os.listdir(tmp_path) == ["config.json"]
+
+    def test_agrupa_cambios_seguidos(self, tmp_path, monkeypatch):
+        escritos = []
+        monkeypatch.setattr(cotu_logic, "escribir_json_atomico", lambda ruta, datos: escritos.append(datos))
+        guardado = cotu_logic.GuardadoDiferido(str(tmp_path / "config.json"), espera_s=0.05)
+        for i in range(5):
+            guardado.programar({"n": i})
+        assert escritos == [] and guardado.pendiente
+        deadline = time.monotonic() + 2
+        while not escritos and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        assert escritos == [{"n": 4}]
+        assert not guardado.pendiente
+
+    def test_vaciar_escribe_ya_y_avisa_si_falla(self, tmp_path):
+        fallos = []
+        ruta = tmp_path / "config.json"
+        guardado = cotu_logic.GuardadoDiferido(str(ruta), espera_s=60, al_fallar=fallos.append)
+        guardado.programar({"ultima_carpeta": "C:/2025"})
+        assert guardado.vaciar() is True
+        assert '"ultima_carpeta": "C:/2025"' in ruta.read_text(encoding="utf-8")
+        guardado.programar({"x": object()})
+        assert guardado.vaciar() is False
+        assert len(fallos) == 1 and isinstance(fallos[0], TypeError)
+
+
+class TestLibroReporte:
+    """Tests para el libro con varias hojas (RESUMEN, por mes, por aseguradora)."""
+
+    def _arbol(self, base):
+        ruta_anio = _crear_arbol(base)
+        (ruta_anio / "11-NOVIEMBRE" / "02 DE NOVIEMBRE" / "AURORA" / "COTU010").mkdir(parents=True)
+        return ruta_anio
+
+    def test_hojas_resumen_y_grupos(self, tmp_path):
+        pytest.importorskip("pandas")
+        registros = cotu_logic.extraer_registros(str(self._arbol(tmp_path / "arbol")))
+        hojas = dict(cotu_logic.libro_reporte(
+            registros, agrupar=(cotu_logic.COL_MES, COL_COMPANIA), nombre_principal="NOVEDADES ANUALES"))
+        assert list(hojas) == ["RESUMEN", "NOVEDADES ANUALES", "11-NOVIEMBRE", "12-DICIEMBRE", "AURORA", "SOLIDARIA"]
+        resumen = hojas["RESUMEN"]
+        assert resumen.values.tolist()[:3] == [
+            ["TOTAL", "", 4, 100.0], ["MES", "11-NOVIEMBRE", 1, 25.0], ["MES", "12-DICIEMBRE", 3, 75.0]]
+        assert hojas["12-DICIEMBRE"][COL_FACTURA].tolist() == ["COTU001", "COTU002", "COTU003"]
+        assert hojas["AURORA"][COL_FACTURA].tolist() == ["COTU010", "COTU003"]
+        assert len(hojas["NOVEDADES ANUALES"]) == 4
+
+    def test_resumido_y_escritura(self, tmp_path):
+        pytest.importorskip("pandas")
+        openpyxl = pytest.importorskip("openpyxl")
+        registros = cotu_logic.extraer_registros(str(self._arbol(tmp_path / "arbol")))
+        hojas = cotu_logic.libro_reporte(registros, formato_resumido=True, agrupar=(COL_COMPANIA,))
+        ruta = tmp_path / "libro.xlsx"
+        cotu_logic.escribir_libro(hojas, str(ruta), "openpyxl")
+        libro = openpyxl.load_workbook(ruta)
+        assert libro.sheetnames == ["RESUMEN", "AURORA", "SOLIDARIA"]
+        solidaria = libro["SOLIDARIA"]
+        assert [f for f in solidaria.iter_rows(values_only=True)] == [
+            ("FECHA", "COTU", "ASEGURADORA"),
+            ("23 DE DICIEMBRE", "COTU001", "SOLIDARIA"),
+            ("23 DE DICIEMBRE", "COTU002", "SOLIDARIA"),
+        ]
+        assert solidaria.auto_filter.ref == "A1:C3"
+        assert solidaria.column_dimensions["A"].width == len("23 DE DICIEMBRE") + 2
+
+    def test_nombres_de_hoja_validos_y_unicos(self):
+        usados = {"RESUMEN"}
+        assert cotu_logic._nombre_hoja("resumen", usados) == "resumen (2)"
+        assert cotu_logic._nombre_hoja("SEGUROS A/B [SUR]", usados) == "SEGUROS A-B -SUR-"
+        largo = cotu_logic._nombre_hoja("X" * 40, usados)
+        assert len(largo) == 31
+        assert cotu_logic._nombre_hoja("X" * 40, usados) == "X" * 27 + " (2)"
+
+    def test_cli_hojas_por_mes(self, tmp_path):
+        pytest.importorskip("pandas")
+        openpyxl = pytest.importorskip("openpyxl")
+        ruta_anio = self._arbol(tmp_path / "arbol")
+        assert cotu_logic.main_cli(["report", "--ruta", str(ruta_anio), "--tipo", "Año",
+                                    "--hojas-por-mes", "--salida", str(tmp_path)]) == 0
+        libro = openpyxl.load_workbook(tmp_path / "cotus_2025.xlsx")
+        assert libro.sheetnames == ["RESUMEN", "NOVEDADES ANUALES", "11-NOVIEMBRE", "12-DICIEMBRE"]
+
+
+class TestColumnar:
+    """Tests para la exportación Parquet/Feather y su lectura como registros."""
+
+    def test_dataframe_columnar_tipado(self, tmp_path):
+        pd = pytest.importorskip("pandas")
+        registros = cotu_logic.extraer_registros(str(_crear_arbol(tmp_path)))
+        df = cotu_logic.dataframe_columnar(registros)
+        assert isinstance(df[COL_COMPANIA].dtype, pd.CategoricalDtype)
+        assert pd.api.types.is_datetime64_any_dtype(df[cotu_logic.COL_FECHA_TIPADA])
+        assert list(df[COL_FACTURA]) == ["COTU001", "COTU002", "COTU003"]
+        assert df[cotu_logic.COL_FECHA_TIPADA].iloc[-1] == pd.Timestamp(2025, 12, 24)
+
+    def test_registros_desde_dataframe(self, tmp_path):
+        pytest.importorskip("pandas")
+        registros = cotu_logic.extraer_registros(str(_crear_arbol(tmp_path)))
+        registros.append(cotu_logic.Registro("2025", "?", "SIN FECHA", "COTU001", "x", ""))
+        cargados = cotu_logic.registros_desde_dataframe(cotu_logic.dataframe_columnar(registros))
+        assert sorted(cargados) == sorted(registros)
+        assert cargados.resumen.total == 4
+        assert cargados.resumen.numeros_repetidos == ["COTU001"]
+
+    def test_sin_pyarrow(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(cotu_logic, "motor_columnar", lambda: None)
+        with pytest.raises(ImportError, match="pyarrow"):
+            cotu_logic.exportar_columnar([], str(tmp_path / "r.parquet"))
+        with pytest.raises(ValueError):
+            cotu_logic.cargar_columnar(str(tmp_path / "r.csv"))
+
+    @pytest.mark.parametrize("formato", ["parquet", "feather"])
+    def test_ida_y_vuelta(self, tmp_path, formato):
+        pytest.importorskip("pyarrow")
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        assert cotu_logic.main_cli(["report", "--ruta", str(ruta_anio), "--tipo", "Año",
+                                    "--formato", formato, "--salida", str(tmp_path)]) == 0
+        cargados = cotu_logic.cargar_columnar(str(tmp_path / f"cotus_2025.{formato}"))
+        assert sorted(cargados) == sorted(cotu_logic.extraer_registros(str(ruta_anio)))
+        assert cargados.resumen.total == 3
+
+
+class TestDiferencias:
+    """Tests para la comparación de periodos (nuevas, eliminadas y movidas)."""
+
+    def _reg(self, factura, fecha="01 DE AGOSTO", compania="SURA"):
+        return cotu_logic.Registro("2025", "08-AGOSTO", fecha, factura, factura, compania)
+
+    def test_nuevas_eliminadas_y_movidas(self):
+        anteriores = [self._reg("COTU1"), self._reg("COTU2"), self._reg("COTU3"), self._reg("COTU4")]
+        actuales = [
+            self._reg("COTU1"),
+            self._reg("cotu2 ", "02 DE AGOSTO"),  # Otro día (N° normalizado)
+            self._reg("COTU3", compania="AURORA"),  # Otra aseguradora
+            self._reg("COTU5"),
+        ]
+        dif = cotu_logic.comparar_registros(anteriores, actuales)
+        assert dif.sin_cambios == 1
+        assert [r[COL_FACTURA] for r in dif.nuevos] == ["COTU5"]
+        assert [r[COL_FACTURA] for r in dif.eliminados] == ["COTU4"]
+        assert [(a[COL_FACTURA], b[COL_COMPANIA]) for a, b in dif.movidos] == [("COTU2", "SURA"), ("COTU3", "AURORA")]
+        assert dif.total_cambios == 4
+
+    def test_repetidos_se_emparejan_uno_a_uno(self):
+        anteriores = [self._reg("COTU1"), self._reg("COTU1"), self._reg("COTU")]
+        actuales = [self._reg("COTU1"), self._reg("COTU1", "03 DE AGOSTO"), self._reg("COTU1", "04 DE AGOSTO"),
+                    self._reg("COTU", "05 DE AGOSTO")]
+        dif = cotu_logic.comparar_registros(anteriores, actuales)
+        assert dif.sin_cambios == 1
+        assert len(dif.movidos) == 1
+        # Sin N° de factura no se considera movida
+        assert [r[cotu_logic.COL_FECHA] for r in dif.nuevos] == ["04 DE AGOSTO", "05 DE AGOSTO"]
+        assert [r[COL_FACTURA] for r in dif.eliminados] == ["COTU"]
+
+    def test_periodo_anterior(self):
+        assert cotu_logic.periodo_anterior(cotu_logic.TIPO_MES, datetime(2025, 3, 1), datetime(2025, 3, 31)) == \
+            (datetime(2025, 2, 1), datetime(2025, 2, 28))
+        assert cotu_logic.periodo_anterior(cotu_logic.TIPO_SEMANA, datetime(2025, 12, 8), datetime(2025, 12, 14)) == \
+            (datetime(2025, 12, 1), datetime(2025, 12, 7))
+        assert cotu_logic.periodo_anterior(cotu_logic.TIPO_DIA, datetime(2025, 1, 1), datetime(2025, 1, 1)) == \
+            (datetime(2024, 12, 31), datetime(2024, 12, 31))
+
+    def test_cli_diff_contra_copia(self, tmp_path, monkeypatch):
+        pytest.importorskip("pandas")
+        openpyxl = pytest.importorskip("openpyxl")
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        copia = cotu_logic.extraer_registros(str(ruta_anio))
+        monkeypatch.setattr(cotu_logic, "cargar_columnar", lambda ruta, medicion=None: copia)
+        dia = ruta_anio / "12-DICIEMBRE" / "23 DE DICIEMBRE"
+        (dia / "AURORA").mkdir()
+        (dia / "SOLIDARIA" / "COTU001").rename(dia / "AURORA" / "COTU001")  # Otra aseguradora
+        os.rmdir(ruta_anio / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "AURORA" / "COTU003")
+        (dia / "SOLIDARIA" / "COTU004").mkdir()
+        assert cotu_logic.main_cli(["diff", "--ruta", str(ruta_anio), "--tipo", "Mes", "--desde", "01/12/2025",
+                                    "--hasta", "31/12/2025", "--contra", "cierre.parquet",
+                                    "--salida", str(tmp_path)]) == 0
+        libro = openpyxl.load_workbook(tmp_path / "cotus_diferencias_20251201_20251231.xlsx")
+        assert libro.sheetnames == ["RESUMEN", "NUEVAS", "ELIMINADAS", "MOVIDAS"]
+        resumen = dict(libro["RESUMEN"].iter_rows(min_row=2, values_only=True))
+        assert resumen == {"NUEVAS": 1, "ELIMINADAS": 1, "MOVIDAS": 1, "SIN CAMBIOS": 1}
+        movida = list(libro["MOVIDAS"].iter_rows(min_row=2, values_only=True))
+        assert movida[0][:4] == ("COTU001", "12-DICIEMBRE", "23 DE DICIEMBRE", "SOLIDARIA")
+        assert movida[0][6] == "AURORA"
+
+    def test_copia_con_mas_meses_que_el_periodo(self, tmp_path, monkeypatch):
+        pytest.importorskip("pandas")
+        pytest.importorskip("openpyxl")
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        (ruta_anio / "11-NOVIEMBRE" / "20 DE NOVIEMBRE" / "AURORA" / "COTU009").mkdir(parents=True)
+        (ruta_anio / "10-OCTUBRE" / "02 DE OCTUBRE" / "SURA" / "COTU008").mkdir(parents=True)
+        copia = cotu_logic.extraer_registros(str(ruta_anio))  # Año hasta el cierre
+        assert len(copia) == 5
+        monkeypatch.setattr(cotu_logic, "cargar_columnar", lambda ruta, medicion=None: copia)
+        os.rmdir(ruta_anio / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "AURORA" / "COTU003")
+        ruta, dif = cotu_logic.generar_diferencias(str(ruta_anio), cotu_logic.TIPO_MES, datetime(2025, 12, 1),
+                                                   datetime(2025, 12, 31), contra="cierre.parquet",
+                                                   carpeta_salida=str(tmp_path))
+        assert ruta
+        assert [r[COL_FACTURA] for r in dif.eliminados] == ["COTU003"]
+        assert dif.nuevos == [] and dif.movidos == []
+        assert dif.sin_cambios == 2
+
+    def test_cli_diff_periodo_anterior(self, tmp_path):
+        pytest.importorskip("pandas")
+        openpyxl = pytest.importorskip("openpyxl")
+        ruta_anio = _crear_arbol(tmp_path / "arbol")
+        noviembre = ruta_anio / "11-NOVIEMBRE" / "20 DE NOVIEMBRE"
+        (noviembre / "AURORA" / "COTU001").mkdir(parents=True)
+        (noviembre / "AURORA" / "COTU009").mkdir(parents=True)
+        assert cotu_logic.main_cli(["diff", "--ruta", str(ruta_anio), "--tipo", "Mes", "--desde", "01/12/2025",
+                                    "--hasta", "31/12/2025", "--periodo-anterior", "--salida", str(tmp_path)]) == 0
+        libro = openpyxl.load_workbook(tmp_path / "cotus_periodos_20251201_20251231.xlsx")
+        assert libro.sheetnames == ["RESUMEN", "SOLO PERIODO ACTUAL", "SOLO PERIODO ANTERIOR", "EN AMBOS PERIODOS"]
+        resumen = dict(libro["RESUMEN"].iter_rows(min_row=2, values_only=True))
+        assert resumen == {"SOLO PERIODO ACTUAL": 2, "SOLO PERIODO ANTERIOR": 1, "EN AMBOS PERIODOS": 1,
+                           "MISMA CARPETA": 0}
+        ambos = list(libro["EN AMBOS PERIODOS"].iter_rows(min_row=2, values_only=True))
+        assert ambos[0][:4] == ("COTU001", "11-NOVIEMBRE", "20 DE NOVIEMBRE", "AURORA")
+
+    def test_cli_diff_anio_requiere_contra(self, tmp_path):
+        with pytest.raises(SystemExit):
+            cotu_logic.main_cli(["diff", "--ruta", str(tmp_path), "--tipo", "Año"])
+        with pytest.raises(SystemExit):
+            cotu_logic.main_cli(["diff", "--ruta", str(tmp_path), "--tipo", "Año", "--periodo-anterior"])
@@ -141,6 +141,23 @@ class TestFiltrarPorTipo:
     def test_lista_vacia(self, app):
         assert app.filtrar_por_tipo([], app.TIPO_MES, "01/12/2025", "31/12/2025") == []
 
+    def test_descarta_registros_sin_fecha(self, app):
+        registros = [
+            {app.COL_ANIO: "2025", app.COL_MES: "DICIEMBRE", app.COL_FECHA: "25 DE DICIEMBRE", app.COL_FACTURA: "COTU1"},
+            {app.COL_ANIO: "2025", app.COL_MES: "VARIOS", app.COL_FECHA: "SIN FECHA", app.COL_FACTURA: "COTU2"},
+        ]
+        resultado = app.filtrar_por_tipo(registros, app.TIPO_SEMANA, "25/12/2025", "25/12/2025")
+        assert [r[app.COL_FACTURA] for r in resultado] == ["COTU1"]
+
+    def test_no_refiltra_si_la_extraccion_ya_aplico_el_rango(self, app, tmp_path):
+        (tmp_path / "2025" / "12-DICIEMBRE" / "23 DE DICIEMBRE" / "SOL" / "COTU1").mkdir(parents=True)
+        (tmp_path / "2025" / "12-DICIEMBRE" / "24 DE DICIEMBRE" / "SOL" / "COTU2").mkdir(parents=True)
+        inicio, fin = datetime(2025, 12, 1), datetime(2025, 12, 23)
+        registros = app.extraer_facturas(str(tmp_path / "2025"), inicio, fin)
+        resultado = app.filtrar_por_tipo(registros, app.TIPO_MES, "01/12/2025", "23/12/2025")
+        assert resultado is registros
+        assert [r[app.COL_FACTURA] for r in resultado] == ["COTU1"]
+
 
 # --- extraer_facturas ---
 class TestExtraerFacturas:
@@ -227,3 +244,200 @@ class TestEsRutaSistema:
         if user:
             assert _es(user) is False
         assert _es("/tmp/cotu_test") is False
+
+
+# --- arranque ---
+class TestImportacionesDiferidas:
+    """El módulo no debe cargar pandas/openpyxl ni configurar logging al importarse."""
+
+    def test_importar_no_carga_pandas(self):
+        import subprocess
+        raiz = Path(__file__).resolve().parent.parent
+        codigo = (
+            "import sys, logging\n"
+            "sys.path.insert(0, 'tests')\n"
+            "import conftest, generador_facturas_cotu\n"
+            "print('pandas' in sys.modules, 'openpyxl' in sys.modules, "
+            "bool(logging.getLogger('GeneradorCOTU').handlers))\n"
+        )
+        res = subprocess.run([sys.executable, "-c", codigo], cwd=raiz, capture_output=True, text=True)
+        assert res.stdout.strip() == "False False False"
+
+
+# --- TablaVirtual ---
+class _TreeFalso:
+    """Treeview mínimo en memoria para probar la virtualización sin Tk."""
+
+    def __init__(self):
+        self.filas = {}
+        self._n = 0
+        self._seleccion = ()
+
+    def insert(self, _padre, _pos, values):
+        self._n += 1
+        iid = f"I{self._n}"
+        self.filas[iid] = values
+        return iid
+
+    def item(self, iid, values):
+        self.filas[iid] = values
+
+    def delete(self, iid):
+        del self.filas[iid]
+        self._seleccion = tuple(i for i in self._seleccion if i != iid)
+
+    def selection(self):
+        return self._seleccion
+
+    def selection_set(self, items):
+        self._seleccion = tuple(items)
+
+
+class TestTablaVirtual:
+    """Tests para la tabla virtualizada de la vista previa."""
+
+    def _tabla(self, datos, filas_visibles):
+        from unittest.mock import MagicMock
+        from generador_facturas_cotu import TablaVirtual
+        tabla = object.__new__(TablaVirtual)
+        tabla.columnas = ["N° FACTURA"]
+        tabla.tree = _TreeFalso()
+        tabla.scrollbar = MagicMock()
+        tabla._items = []
+        tabla._seleccion = set()
+        tabla._filas_visibles = filas_visibles
+        tabla.establecer_datos(datos)
+        return tabla
+
+    def test_solo_crea_filas_visibles(self):
+        datos = [{"N° FACTURA": f"COTU{i}"} for i in range(100_000)]
+        tabla = self._tabla(datos, 20)
+        assert len(tabla.tree.filas) == 20
+        tabla.ir_a(50_000)
+        assert len(tabla.tree.filas) == 20
+        assert [v[0] for v in tabla.tree.filas.values()][0] == "COTU50000"
+        tabla.scrollbar.set.assert_called_with(0.5, 50_020 / 100_000)
+
+    def test_final_y_pocos_datos(self):
+        tabla = self._tabla([{"N° FACTURA": f"COTU{i}"} for i in range(30)], 20)
+        tabla.ir_a(10_000)
+        assert tabla._inicio == 10
+        assert [v[0] for v in tabla.tree.filas.values()][-1] == "COTU29"
+        tabla.establecer_datos([{"N° FACTURA": "COTU1"}])
+        assert list(tabla.tree.filas.values()) == [["COTU1"]]
+        tabla.establecer_datos([])
+        assert tabla.tree.filas == {}
+
+    def test_seleccion_sigue_al_registro(self):
+        datos = [{"N° FACTURA": f"COTU{i}"} for i in range(100)]
+        tabla = self._tabla(datos, 20)
+        tabla.tree.selection_set([tabla._items[12]])
+        tabla._al_seleccionar()
+        tabla.desplazar(10)
+        # El registro 12 está ahora en la tercera fila visible
+        (item,) = tabla.tree.selection()
+        assert item == tabla._items[2] and tabla.tree.filas[item] == ["COTU12"]
+        tabla.ir_a(50)
+        assert tabla.tree.selection() == ()
+        assert tabla.seleccionados() == [datos[12]]
+        tabla.ir_a(0)
+        assert tabla.tree.selection() == (tabla._items[12],)
+        tabla.establecer_datos(datos[:5])
+        assert tabla.seleccionados() == [] and tabla.tree.selection() == ()
+
+
+class TestPanelRendimiento:
+    """El panel de Ajustes muestra la última medición de cada operación."""
+
+    def test_ultima_medicion_por_operacion(self, app):
+        from unittest.mock import MagicMock
+        import cotu_logic
+
+        app._mediciones = {}
+        app.texto_rendimiento = MagicMock()
+        for operacion, facturas in (("Excel", 10), ("CSV", 5), ("Excel", 20)):
+            medicion = cotu_logic.MedicionRendimiento(operacion)
+            medicion.facturas = facturas
+            app._mostrar_medicion(medicion.terminar())
+        texto = app.texto_rendimiento.set.call_args[0][0]
+        assert list(app._mediciones) == ["Excel", "CSV"]
+        assert "Excel:" in texto and "20 facturas" in texto and "10 facturas" not in texto
+
+
+class TestVistaPreviaCancelada:
+    """Al cancelar, la búsqueda de las facturas parciales se prepara en el hilo de trabajo."""
+
+    def test_indice_preparado_fuera_del_hilo_de_la_interfaz(self, app):
+        import cotu_logic
+
+        parciales = cotu_logic.ListaRegistros(
+            [cotu_logic.Registro("2025", "12-DICIEMBRE", "23 DE DICIEMBRE", "COTU001", "", "SOLIDARIA")])
+        error = cotu_logic.Cancelado()
+        error.registros = parciales
+
+        def _cancelar(params):
+            raise error
+
+        pendientes = []
+        app.root.after = lambda ms, func=None: pendientes.append(func)
+        app._obtener_registros = _cancelar
+        recibidos = []
+        app._on_vista_previa_cancelada = lambda regs, indice=None: recibidos.append((regs, indice))
+        app._ejecutar_vista_previa_background(
+            {"tipo": app.TIPO_ANIO, "medicion": cotu_logic.MedicionRendimiento("Vista previa")})
+        for func in pendientes:
+            func()
+        regs, indice = recibidos[0]
+        assert regs is parciales
+        # Las claves ya se calcularon antes de volver al hilo de Tk
+        assert indice is not None and indice._claves is not None
+        assert indice.buscar("solidaria") == list(parciales)
+
+
+class TestExportarCsvConCache:
+    """El CSV consulta la caché de escaneos una sola vez y une los CSV idénticos en curso."""
+
+    def _params(self, app, ruta_base):
+        return {"ruta_base": str(ruta_base), "tipo": app.TIPO_ANIO, "nombre_anio": "2025",
+                "fecha_inicio": None, "fecha_fin": None, "fecha_inicio_str": "", "fecha_fin_str": "",
+                "formato_resumido": True}
+
+    def _preparar(self, app):
+        import cotu_logic
+
+        app._ejecutor = cotu_logic.EjecutorTrabajos()
+        app._cache_resultados = cotu_logic.CacheResultados()
+        consultas = []
+        obtener = app._cache_resultados.obtener
+        app._cache_resultados.obtener = lambda clave: consultas.append(clave) or obtener(clave)
+        app._al_finalizar_csv = lambda res, params=None: None
+        app.actualizar_status = lambda *a, **k: None
+        return consultas
+
+    def test_resultado_en_cache_se_consulta_una_vez(self, app, tmp_path):
+        import cotu_logic
+
+        registros = [cotu_logic.Registro("2025", "12-DICIEMBRE", "23 DE DICIEMBRE", "COTU001", "", "SOLIDARIA")]
+        consultas = self._preparar(app)
+        params = self._params(app, tmp_path)
+        app._cache_resultados.guardar(app._clave_escaneo(params), {str(tmp_path): os.stat(tmp_path).st_mtime_ns},
+                                      registros)
+        app._ejecutar_csv(params)
+        assert len(consultas) == 1
+        assert (tmp_path / "cotus_2025.csv").read_text(encoding="utf-8-sig").splitlines()[1:] == \
+            ["23 DE DICIEMBRE,COTU001,SOLIDARIA"]
+
+    def test_sin_cache_envia_con_clave_de_escaneo(self, app, tmp_path):
+        import cotu_logic
+
+        consultas = self._preparar(app)
+        claves = []
+        enviar = app._ejecutor.enviar
+        app._ejecutor.enviar = lambda clave, funcion, cancelacion=None: claves.append(clave) or enviar(clave, funcion, cancelacion)
+        app._iterar_facturas = lambda params, token: iter(
+            [cotu_logic.Registro("2025", "12-DICIEMBRE", "24 DE DICIEMBRE", "COTU003", "", "AURORA")])
+        params = self._params(app, tmp_path)
+        app._ejecutar_csv(params)
+        assert len(consultas) == 1
+        assert claves == [("csv", app._clave_escaneo(params), True)]
+        assert (tmp_path / "cotus_2025.csv").exists()